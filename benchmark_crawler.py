@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import metadata as meta
+import my_crawler
+import my_async_crawler
+from my_stand_in_server import start_stand_in_server
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+# Benchmark of the crawlers against the local stand-in server (my_stand_in_server.py).
+# Every crawl runs in its own process, since the crawlers keep their state in static variables,
+# and saves its blocks in a temporary directory instead of the data_files
+
+
+# Makes the crawlers save the metadata and the blocks in the given directory
+def use_temporary_data_files(data_files_path):
+    meta.METADATA_DICTIONARY_FILE_PATH = os.path.join(data_files_path, meta.METADATA_DICTIONARY_FILENAME)
+    meta.VISITED_SET_FILE_PATH = os.path.join(data_files_path, meta.VISITED_SET_FILENAME)
+    meta.STEM_TABLE_FILE_PATH = os.path.join(data_files_path, meta.STEM_TABLE_FILENAME)
+    meta.FRONTIER_FILE_PATH = os.path.join(data_files_path, meta.FRONTIER_FILENAME)
+    meta.CRAWL_LOG_FILE_PATH = os.path.join(data_files_path, meta.CRAWL_LOG_FILENAME)
+    meta.BLOCK_FILE_NAME_PREFIX_PATH = os.path.join(data_files_path, meta.BLOCK)
+
+
+# Crawls the stand-in server with the given crawler and prints the number of pages that were kept per second.
+# The "threads" crawler cleans the html texts in a pool of parser processes, the "inline" crawler in its threads
+def run_crawl(mode, workers, num_of_links, number_of_pages, latency, parser_backend):
+    stand_in_server, first_page_url = start_stand_in_server(number_of_pages=number_of_pages, latency=latency)
+    # The links of the stand-in server are http links
+    my_crawler.Crawler.link_scheme = "http"
+    # The stand-in server stands for many hosts, so the connections to it are not limited per host
+    meta.MAX_CONNECTIONS_PER_HOST = workers
+
+    with tempfile.TemporaryDirectory() as data_files_path:
+        use_temporary_data_files(data_files_path)
+        crawl_start_time = time.time()
+        if mode == "threads":
+            my_crawler.crawl(first_page_url, num_of_links, True, workers, "BFS", parser_backend=parser_backend)
+        elif mode == "inline":
+            my_crawler.crawl(first_page_url, num_of_links, True, workers, "BFS", parser_processes=0,
+                             parser_backend=parser_backend)
+        elif mode == "async":
+            my_async_crawler.crawl(first_page_url, num_of_links, True, workers, "BFS", parser_backend=parser_backend)
+        else:
+            raise ValueError("No such crawler mode as " + mode)
+        crawl_time = time.time() - crawl_start_time
+
+    stand_in_server.shutdown()
+    print("RESULT %s %d %d %f" % (mode, workers, my_crawler.Crawler.kept_links_crawled_in_session, crawl_time))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "run":
+        # Args: run, mode (threads, inline or async), workers (threads or concurrency), links to keep, pages, latency,
+        # parser backend
+        run_crawl(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]), float(sys.argv[6]), sys.argv[7])
+        sys.exit(0)
+
+    # Args (all of them are optional): links to keep, pages of the stand-in server, latency in seconds,
+    # the comma separated list of workers for each mode, the comma separated list of the modes and the parser backend
+    num_of_links_arg = sys.argv[1] if len(sys.argv) > 1 else "500"
+    number_of_pages_arg = sys.argv[2] if len(sys.argv) > 2 else "5000"
+    latency_arg = sys.argv[3] if len(sys.argv) > 3 else "0.05"
+    workers_arg = sys.argv[4] if len(sys.argv) > 4 else "1,4,16,64"
+    modes_arg = sys.argv[5] if len(sys.argv) > 5 else "inline,threads,async"
+    parser_backend_arg = sys.argv[6] if len(sys.argv) > 6 else meta.DEFAULT_PARSER_BACKEND
+
+    print("mode     workers  pages  seconds  pages/sec")
+    for mode_arg in modes_arg.split(','):
+        for workers_number in workers_arg.split(','):
+            output = subprocess.run([sys.executable, __file__, "run", mode_arg, workers_number, num_of_links_arg,
+                                     number_of_pages_arg, latency_arg, parser_backend_arg], stdout=subprocess.PIPE,
+                                    universal_newlines=True).stdout
+            for line in output.splitlines():
+                if line.startswith("RESULT "):
+                    _, mode, workers, pages, seconds = line.split()
+                    print("%-8s %7s %6s %8.2f %10.1f" % (mode, workers, pages, float(seconds),
+                                                        int(pages) / float(seconds)))
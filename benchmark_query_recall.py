@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from my_query_processor import QueryProcessor
+
+import sys
+import time
+import random
+import numpy as np
+
+# Recall report of the approximate top-k queries (with a postings budget over the impact ordered postings)
+# against the exhaustive ranker, along with the mean time of each query. The index has to be built by my_indexer.py
+
+
+# Returns random queries made of the terms of the index, most of the terms are chosen from the most frequent terms
+# (like the words of the real queries) and the rest from all the terms
+def get_random_queries(query_processor, number_of_queries, seed=0):
+    terms = np.concatenate([segment.terms for segment in query_processor.index.segments])
+    terms, inverse = np.unique(terms, return_inverse=True)
+    document_frequencies = query_processor.index.get_document_frequencies(terms)
+    frequent_terms = terms[np.argsort(-document_frequencies, kind='stable')[:500]].tolist()
+    terms = terms.tolist()
+
+    query_random = random.Random(seed)
+    return [" ".join(query_random.choice(frequent_terms if query_random.random() < 0.7 else terms)
+                     for _ in range(query_random.randint(1, 6))) for _ in range(number_of_queries)]
+
+
+# Returns the top k urls of each query and the mean time of a query
+def run_queries(query_processor, queries, k, **top_k_args):
+    results = []
+    start_time = time.time()
+    for query in queries:
+        results.append(list(query_processor.top_k(query, k, **top_k_args).keys()))
+    return results, (time.time() - start_time) / len(queries)
+
+
+# Returns the mean recall of the results against the exact results (the part of the exact top k that was found)
+def get_mean_recall(results, exact_results):
+    recalls = [len(set(result) & set(exact_result)) / len(exact_result)
+               for result, exact_result in zip(results, exact_results) if len(exact_result) > 0]
+    return sum(recalls) / len(recalls) if len(recalls) > 0 else 1.0
+
+
+if __name__ == '__main__':
+    # Args (all of them are optional): k, the comma separated list of the postings budgets, the number of random
+    # queries, and a file with the queries (one query in each line) that is used instead of the random queries
+    k_arg = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    budgets_arg = sys.argv[2] if len(sys.argv) > 2 else "100,1000,10000,100000"
+    number_of_queries_arg = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    my_query_processor = QueryProcessor(read_only=True)
+    # Every ranker is timed, so the results are not kept in the result cache
+    my_query_processor.result_cache.max_size = 0
+    if len(sys.argv) > 4:
+        with open(sys.argv[4], encoding='utf-8') as queries_file:
+            queries_arg = [line.strip() for line in queries_file if line.strip() != ""]
+    else:
+        queries_arg = get_random_queries(my_query_processor, number_of_queries_arg)
+
+    # The proximity boost is off, so the recall only measures the error of the postings budget
+    exhaustive_results, exhaustive_time = run_queries(my_query_processor, queries_arg, k_arg, dynamic_pruning=False,
+                                                      proximity=False)
+    max_score_results, max_score_time = run_queries(my_query_processor, queries_arg, k_arg, proximity=False)
+
+    print("ranker              recall@%d  ms/query" % k_arg)
+    print("%-18s %10.3f %9.2f" % ("exhaustive", 1.0, exhaustive_time * 1000))
+    print("%-18s %10.3f %9.2f" % ("maxscore", get_mean_recall(max_score_results, exhaustive_results),
+                                  max_score_time * 1000))
+    for budget in budgets_arg.split(','):
+        budget_results, budget_time = run_queries(my_query_processor, queries_arg, k_arg,
+                                                  postings_budget=int(budget), proximity=False)
+        print("%-18s %10.3f %9.2f" % ("budget " + budget, get_mean_recall(budget_results, exhaustive_results),
+                                      budget_time * 1000))
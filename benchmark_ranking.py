@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from my_query_processor import QueryProcessor
+from my_text_processor import TextProcessor
+from benchmark_query_recall import get_random_queries, run_queries, get_mean_recall
+import metadata as meta
+
+import sys
+import random
+
+# Relevance and latency report of the rankings (the cosine similarity and BM25), see meta.RANKINGS.
+# The relevance is measured with known-item queries: the title of a random document is the query and the documents
+# with the same title are its relevant documents (unless a file with judged queries is given). The latency is the
+# mean time of a query with the exhaustive evaluation and with the MaxScore dynamic pruning, whose recall against
+# the exhaustive evaluation has to be 1.0. The proximity boost is off, so only the rankings are compared.
+# The index has to be built by my_indexer.py
+
+
+# Returns known-item queries { title : set of the urls of the documents with that title }, the titles of random
+# documents with at least two useful words (the documents without a title have their url as the title)
+def get_title_queries(query_processor, number_of_queries, seed=0):
+    index = query_processor.index
+    title_urls = {}
+    for doc_id in range(index.total_docs):
+        title_urls.setdefault(index.get_title(doc_id), set()).add(index.get_url(doc_id))
+    titles = sorted(title for title, urls in title_urls.items()
+                    if title not in urls and len(TextProcessor.get_useful_word_list(title, stemming=True)) > 1)
+    titles = random.Random(seed).sample(titles, min(number_of_queries, len(titles)))
+    return {title: title_urls[title] for title in titles}
+
+
+# Returns the judged queries of a file with a query and a relevant url in each line (separated by a tab),
+# as { query : set of the relevant urls }
+def load_judged_queries(file_path):
+    judged_queries = {}
+    with open(file_path, encoding='utf-8') as judgments_file:
+        for line in judgments_file:
+            query, _, url = line.strip().partition("\t")
+            if query != "" and url != "":
+                judged_queries.setdefault(query, set()).add(url)
+    return judged_queries
+
+
+# Returns the mean reciprocal rank of the first relevant document in the results and the part of the queries
+# with a relevant document in their results (success@k)
+def get_relevance(results, relevant_urls):
+    reciprocal_ranks = []
+    for result, relevant in zip(results, relevant_urls):
+        ranks = [rank for rank, url in enumerate(result, 1) if url in relevant]
+        reciprocal_ranks.append(1 / ranks[0] if len(ranks) > 0 else 0.0)
+    if len(reciprocal_ranks) == 0:
+        return 0.0, 0.0
+    return sum(reciprocal_ranks) / len(reciprocal_ranks), \
+        sum(1 for rank in reciprocal_ranks if rank > 0) / len(reciprocal_ranks)
+
+
+if __name__ == '__main__':
+    # Args (all of them are optional): k, the number of queries, and a file with the judged queries
+    # (a query and a relevant url in each line, separated by a tab) that is used instead of the title queries
+    k_arg = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    number_of_queries_arg = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    my_query_processor = QueryProcessor(read_only=True)
+    # Every ranking is timed, so the results are not kept in the result cache
+    my_query_processor.result_cache.max_size = 0
+    if len(sys.argv) > 3:
+        judged_queries_arg = load_judged_queries(sys.argv[3])
+    else:
+        judged_queries_arg = get_title_queries(my_query_processor, number_of_queries_arg)
+    relevance_queries = list(judged_queries_arg.keys())
+    latency_queries = get_random_queries(my_query_processor, number_of_queries_arg)
+
+    print(len(relevance_queries).__str__() + " judged queries, " + len(latency_queries).__str__()
+          + " random queries, " + my_query_processor.index.total_docs.__str__() + " documents")
+    print("ranking   MRR@%d  success@%d  exhaustive ms/query  maxscore ms/query  maxscore recall@%d"
+          % (k_arg, k_arg, k_arg))
+    rankings_results = {}
+    for ranking in meta.RANKINGS:
+        results, _ = run_queries(my_query_processor, relevance_queries, k_arg, proximity=False, ranking=ranking)
+        mean_reciprocal_rank, success = get_relevance(results, judged_queries_arg.values())
+        rankings_results[ranking] = results
+
+        exhaustive_results, exhaustive_time = run_queries(my_query_processor, latency_queries, k_arg,
+                                                          dynamic_pruning=False, proximity=False, ranking=ranking)
+        max_score_results, max_score_time = run_queries(my_query_processor, latency_queries, k_arg,
+                                                        proximity=False, ranking=ranking)
+        print("%-8s %7.3f %10.3f %20.2f %18.2f %19.3f" % (ranking, mean_reciprocal_rank, success,
+                                                          exhaustive_time * 1000, max_score_time * 1000,
+                                                          get_mean_recall(max_score_results, exhaustive_results)))
+
+    # The part of the top k documents of the default ranking that the other rankings also find
+    for ranking in meta.RANKINGS:
+        if ranking != meta.DEFAULT_RANKING:
+            print("overlap@%d of %s with %s: %.3f" % (k_arg, ranking, meta.DEFAULT_RANKING,
+                                                      get_mean_recall(rankings_results[ranking],
+                                                                      rankings_results[meta.DEFAULT_RANKING])))
@@ -15,27 +15,209 @@ BLOCK = "doc_data_block_"
 
 # The name of the file that has the metadata
 METADATA_DICTIONARY_FILENAME = "metadata.npy"
-# The name of the file that has inverted indexer_dict
-INVERTED_INDEXER_FILENAME = "inverted_indexer.npy"
-# The name of the file that has the documents metadata
-DOC_METADATA_FILENAME = "documents_metadata.npy"
 # Prefix of each of the block file that has documents
 BLOCK_FILE_NAME_PREFIX = path.join(DOCUMENTS_DATA_FILENAME, BLOCK)
 
+# The name of the file that has the visited links of the crawler
+VISITED_SET_FILENAME = "visited_links.npz"
+# The name of the file that has the table of the words and their stems
+STEM_TABLE_FILENAME = "stem_table.npz"
+# The names of the files of the crawl's checkpoint (the links of the frontier) and of the crawl's log
+# (the changes of the crawl after the checkpoint)
+FRONTIER_FILENAME = "frontier.npz"
+CRAWL_LOG_FILENAME = "crawl_log.txt"
+
 # Complete path for each of the files
 # metadata
 METADATA_DICTIONARY_FILE_PATH = path.join(DATA_FILES_PATH, METADATA_DICTIONARY_FILENAME)
-# inverted indexer_dict
-INVERTED_INDEXER_FILE_PATH = path.join(DATA_FILES_PATH, INVERTED_INDEXER_FILENAME)
-# documents metadata
-DOC_METADATA_FILE_PATH = path.join(DATA_FILES_PATH, DOC_METADATA_FILENAME)
+# visited links
+VISITED_SET_FILE_PATH = path.join(DATA_FILES_PATH, VISITED_SET_FILENAME)
+# stem table
+STEM_TABLE_FILE_PATH = path.join(DATA_FILES_PATH, STEM_TABLE_FILENAME)
+# frontier and crawl log
+FRONTIER_FILE_PATH = path.join(DATA_FILES_PATH, FRONTIER_FILENAME)
+CRAWL_LOG_FILE_PATH = path.join(DATA_FILES_PATH, CRAWL_LOG_FILENAME)
+# The directory of the compact (array-backed) inverted index, the index is made of segments
+INVERTED_INDEX_DIR_PATH = path.join(DATA_FILES_PATH, INVERTED_INDEXERS_FILENAME)
 # Prefix of each of the block file that has documents
 BLOCK_FILE_NAME_PREFIX_PATH = path.join(DATA_FILES_PATH, BLOCK_FILE_NAME_PREFIX)
 
+# The file (inside the INVERTED_INDEX_DIR_PATH) with the manifest of the index segments
+SEGMENTS_MANIFEST_FILENAME = "segments.npy"
+# The lock file (next to the manifest) that the processes that change the manifest lock
+SEGMENTS_LOCK_FILENAME = "segments.lock"
+# Prefix of the directory of each segment (inside the INVERTED_INDEX_DIR_PATH)
+SEGMENT_DIR_PREFIX = "segment_"
+# manifest dictionary special keys
+MANIFEST_SEGMENTS_KEY = "segments"  # The names of the segments' directories, in the order of their documents
+MANIFEST_NEXT_SEGMENT_KEY = "next_segment_number"
+MANIFEST_INDEXED_BLOCKS_KEY = "indexed_blocks"  # { block_number : number of the block's documents indexed }
+MANIFEST_VERSION_KEY = "version"  # Increased every time that the segments change
+# The number of shards, only in the manifest of a sharded index. A sharded index has no segments of its own,
+# each shard is an index (with its own manifest and segments) in a directory inside the INVERTED_INDEX_DIR_PATH
+MANIFEST_SHARDS_KEY = "shards"
+SHARD_DIR_PREFIX = "shard_"
+# When there are more segments than this number, the compaction merges some of them
+MAX_SEGMENTS = 8
+# The number of consecutive segments that are merged together by the compaction
+SEGMENTS_MERGE_FACTOR = 4
+# If True, every segment also has its postings in impact order (twice the size of the postings on the disk)
+BUILD_IMPACT_ORDERED_POSTINGS = True
+# The maximum number of postings that a query reads from the impact ordered postings (the accuracy vs latency knob),
+# None for the exact top-k. The top-k documents of the postings that are read are scored again exactly
+QUERY_POSTINGS_BUDGET = None
+# If True, the postings of every new segment are compressed (delta + variable-byte encoded, in blocks with skip
+# pointers) instead of being saved as int32 arrays
+COMPRESS_POSTINGS = True
+# The number of postings in each compressed block, a probe of the postings decodes only the blocks that it needs
+POSTINGS_BLOCK_SIZE = 128
+# If True, every new segment also has the positions of the terms in the documents (delta + variable-byte encoded),
+# for the phrase queries and the proximity of the query terms
+BUILD_POSITIONAL_POSTINGS = True
+# The multi-term queries are scored again with the proximity of their terms, only their top candidates (at least
+# this number of them) are scored again. The similarity of a document is multiplied by
+# (1 + PROXIMITY_WEIGHT * proximity), the proximity is 1 when all the query terms are next to each other
+PROXIMITY_CANDIDATES = 100
+PROXIMITY_WEIGHT = 0.5
+# The rankings of the queries, the cosine similarity of the tf-idf vectors (tf = freq/max_freq) or BM25.
+# The ranking is chosen for each query, the queries that don't choose one use the DEFAULT_RANKING
+RANKING_COSINE = "cosine"
+RANKING_BM25 = "bm25"
+RANKINGS = (RANKING_COSINE, RANKING_BM25)
+DEFAULT_RANKING = RANKING_COSINE
+# The parameters of BM25, the saturation of the term frequency and the normalization by the document's length
+BM25_K1 = 1.2
+BM25_B = 0.75
+# The maximum number of results that a user of the search engine can ask for
+QUERY_MAX_RESULTS = 1000
+# The maximum number of queries that the result cache of the QueryProcessor keeps (0 for no result cache)
+QUERY_CACHE_SIZE = 1000
+# The seconds that a result stays in the result cache (None for no expiration), the results are also removed
+# from the cache when the index changes
+QUERY_CACHE_TTL = 600
+# The maximum number of queries of the search engine's users that are kept for the relevance feedback,
+# and the seconds that the feedback of a query can be given
+QUERY_STATES_SIZE = 10000
+QUERY_STATE_TTL = 3600
+
+# The files of each segment of the compact inverted index (all of them are saved inside the segment's directory)
+# Sorted array with all the terms (the term dictionary), the id of a term is its position in this array
+INDEX_TERMS_FILENAME = "terms.npy"
+# The postings of the term with id t are in the positions [term_offsets[t], term_offsets[t + 1]) of the postings arrays
+INDEX_TERM_OFFSETS_FILENAME = "term_offsets.npy"
+# Postings arrays, the document id and the frequency of the term in that document (int32)
+INDEX_DOC_IDS_FILENAME = "doc_ids.npy"
+INDEX_FREQS_FILENAME = "freqs.npy"
+# The compressed postings (only if COMPRESS_POSTINGS, instead of the postings arrays), the VByte encoded bytes
+# of the document ids' gaps and of the frequencies with the first byte of each block in them, the last document id
+# of each block (the skip pointers), the first block of each term and the number of postings in each block
+INDEX_POSTINGS_DOC_DATA_FILENAME = "postings_doc_data.npy"
+INDEX_POSTINGS_DOC_BLOCK_OFFSETS_FILENAME = "postings_doc_block_offsets.npy"
+INDEX_POSTINGS_FREQ_DATA_FILENAME = "postings_freq_data.npy"
+INDEX_POSTINGS_FREQ_BLOCK_OFFSETS_FILENAME = "postings_freq_block_offsets.npy"
+INDEX_POSTINGS_BLOCK_LAST_DOC_IDS_FILENAME = "postings_block_last_doc_ids.npy"
+INDEX_TERM_BLOCKS_FILENAME = "term_blocks.npy"
+INDEX_POSTINGS_BLOCK_SIZE_FILENAME = "postings_block_size.npy"
+# The positional postings (only if BUILD_POSITIONAL_POSTINGS), the VByte encoded bytes of the position gaps
+# of each posting with the first byte of each block in them and the number of postings in each block
+INDEX_POSITIONS_DATA_FILENAME = "positions_data.npy"
+INDEX_POSITIONS_BLOCK_OFFSETS_FILENAME = "positions_block_offsets.npy"
+INDEX_POSITIONS_BLOCK_SIZE_FILENAME = "positions_block_size.npy"
+# The position gaps of the merged postings before they are compressed (a temporary file of the merge)
+INDEX_POSITION_GAPS_FILENAME = "position_gaps.npy"
+# The maximum weight (freq/(max_freq*Ld)) of each term in its postings, the upper bound of the term's score
+# (without the idf and the query's weight) that the dynamic pruning of the queries uses
+INDEX_TERM_MAX_WEIGHT_FILENAME = "term_max_weight.npy"
+# The maximum frequency of each term in its postings and the minimum length/freq of the documents of its postings,
+# the upper bound of the term's BM25 score (for any average length of the documents) that the dynamic pruning uses
+INDEX_TERM_MAX_FREQ_FILENAME = "term_max_freq.npy"
+INDEX_TERM_MIN_LENGTH_RATIO_FILENAME = "term_min_length_ratio.npy"
+# The postings of each term sorted by impact (freq/(max_freq*Ld), the biggest first) instead of document id,
+# the approximate queries read only the first postings of each term (only if BUILD_IMPACT_ORDERED_POSTINGS)
+INDEX_IMPACT_DOC_IDS_FILENAME = "impact_doc_ids.npy"
+INDEX_IMPACT_FREQS_FILENAME = "impact_freqs.npy"
+# Documents table, the position of a document in these arrays is its document id
+INDEX_DOC_URLS_FILENAME = "doc_urls"  # string table
+INDEX_DOC_TITLES_FILENAME = "doc_titles"  # string table
+INDEX_DOC_MAX_FREQ_FILENAME = "doc_max_freq.npy"
+INDEX_DOC_LD_FILENAME = "doc_ld.npy"
+# The length of each document (the number of its words), for the BM25 ranking
+INDEX_DOC_LENGTH_FILENAME = "doc_length.npy"
+# The document ids sorted by their url, used to find the document id of a url with binary search
+INDEX_DOC_URL_ORDER_FILENAME = "doc_url_order.npy"
+# Forward index, a CSR matrix with a row for each document and a column for each term,
+# the values are the tf (freq/max_freq) of the term in the document
+INDEX_FORWARD_INDPTR_FILENAME = "forward_indptr.npy"
+INDEX_FORWARD_TERM_IDS_FILENAME = "forward_term_ids.npy"
+INDEX_FORWARD_TF_FILENAME = "forward_tf.npy"
+# Suffixes of the two files that a string table is made of
+STRING_TABLE_DATA_SUFFIX = "_data.npy"
+STRING_TABLE_OFFSETS_SUFFIX = "_offsets.npy"
+
 # metadata dictionary special keys
 META_TOTAL_BLOCKS_KEY = "total_blocks"
 META_BLOCK_SIZE_KEY = "max_block_size"
-META_CRAWLED_LINKS_SET_KEY = "crawled_links_set"
+META_CRAWLED_LINKS_SET_KEY = "crawled_links_set"  # Only in the metadata of the older crawls, before the visited set
+# (block number, documents of the block) at the last checkpoint, the websites that were kept after the checkpoint
+# are the documents of that block after these documents and the documents of the next blocks
+META_CHECKPOINT_POSITION_KEY = "checkpoint_position"
 
 # Each block will have by default some websites saved in it
 DEFAULT_MAX_BLOCK_SIZE = 1000
+
+# The columnar format of the blocks (my_blocks.py), each block is a directory (BLOCK_FILE_NAME_PREFIX_PATH + number)
+# with append-only files. The older blocks are pickled dictionaries (BLOCK_FILE_NAME_PREFIX_PATH + number + ".npy")
+# The end of the tokens of each document in the tokens file (int64)
+BLOCK_DOC_OFFSETS_FILENAME = "doc_offsets.bin"
+# The token ids of the words of all the documents (uint32), the id of a word is its position in the vocabulary
+BLOCK_TOKENS_FILENAME = "tokens.bin"
+# String columns, the utf-8 bytes of the strings one after the other and the end of each string in them (int64)
+BLOCK_URLS_FILENAME = "urls"
+BLOCK_TITLES_FILENAME = "titles"
+BLOCK_VOCABULARY_FILENAME = "vocabulary"
+BLOCK_STRING_DATA_SUFFIX = "_data.bin"
+BLOCK_STRING_OFFSETS_SUFFIX = "_offsets.bin"
+
+# The visited links of the crawler (my_visited_set.py)
+# The backend of the visited set of a new crawl, "fingerprints" (exact) or "bloom" (smaller, with false positives)
+DEFAULT_VISITED_SET_BACKEND = "fingerprints"
+# The new fingerprints are merged in the sorted array when they are at least this number
+VISITED_SET_MIN_MERGE_SIZE = 4096
+# The false positive rate of the bloom filter and the number of links that its first filter can have
+BLOOM_ERROR_RATE = 0.001
+BLOOM_INITIAL_CAPACITY = 100000
+
+# The connections pools of the crawlers' sessions
+# The maximum number of connections that are kept alive to the same host (by each session)
+MAX_CONNECTIONS_PER_HOST = 4
+# The maximum number of hosts that have a connection pool (by each session of the threaded crawler)
+MAX_POOLED_HOSTS = 100
+
+# The seconds that a crawler thread waits for a link, before it checks if the other threads are still crawling
+FRONTIER_WAIT_TIMEOUT = 0.5
+# The seconds between two checkpoints of a crawl (my_checkpoint.py)
+CHECKPOINT_INTERVAL = 60
+# The politeness of the crawlers' frontier (my_frontier.py)
+# The minimum delay in seconds between two requests to the same host
+MIN_HOST_DELAY = 1.0
+# The maximum crawl-delay of a robots.txt that is respected, in seconds
+MAX_CRAWL_DELAY = 30.0
+# The user agent whose rules of the robots.txt files are followed
+ROBOTS_USER_AGENT = "*"
+
+# The html parsing of the crawlers (my_parser_pool.py)
+# The parser of the TextProcessor, "html.parser", "lxml" or "regex"
+DEFAULT_PARSER_BACKEND = "html.parser"
+# The number of html texts that can wait in the pool of the parser processes, for each parser process
+PARSER_PENDING_PER_PROCESS = 2
+
+# The maximum number of words that the stem cache of the TextProcessor keeps
+STEM_CACHE_SIZE = 100000
+
+# The indexing of the crawled websites while the crawl is running (the IndexingPipeline of my_indexer.py)
+# The maximum number of websites that wait in the queue of the indexing process, the crawler waits when it is full
+STREAMING_QUEUE_SIZE = 1000
+# The seconds after a website is received by the indexing process that it is added to the index in a new segment
+STREAMING_SEGMENT_INTERVAL = 2.0
+# The memory budget (in MB) of the single-pass indexer of the indexing process
+STREAMING_MEMORY_BUDGET_MB = 64
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+from my_crawler import Crawler, check_header, save_stem_cache, close_indexing_pipeline
+from my_text_processor import TextProcessor
+from my_parser_pool import ParserPool
+from my_checkpoint import Checkpointer
+from my_indexer import IndexingPipeline
+import metadata as meta
+
+import sys
+import time
+import queue
+import asyncio
+import aiohttp
+
+
+# Crawler that runs on an event loop instead of threads. Each of the workers is a coroutine, so thousands of websites
+# can be fetched concurrently by one thread, while the html texts are parsed in a pool of processes.
+# It uses the same static variables of the Crawler class (the crawling_links_frontier, the crawled_links_set and the
+# current block), so it can continue a crawl of the Crawler and the blocks' files are the same.
+# The websites are kept in the threads of the event loop's executor, since keeping a website takes the locks of the
+# Crawler (that the checkpoints hold) and waits while the queue of the indexing pipeline is full
+class AsyncCrawler:
+
+    def __init__(self, concurrency=100, parser_processes=None, parser_backend=meta.DEFAULT_PARSER_BACKEND):
+        # The maximum number of websites that are fetched at the same time
+        self.concurrency = concurrency
+        self.parser_processes = parser_processes
+        self.parser_backend = parser_backend
+        # The number of links that are being crawled right now (their out-links are not added yet)
+        self.links_in_progress = 0
+        # Condition that the workers wait on when the frontier is empty, until another worker adds links to it
+        self.links_changed = None
+
+    # Commits one get-request (raises a timeout if 5 seconds are passed without response from the server)
+    async def fetch(self, session, link):
+        async with session.get(link, allow_redirects=True) as response:
+            # First, checking the header before the body is read, in order to avoid crawling on this website
+            # if it has non-text content type, or it's length is tremendously big
+            check_header(response.headers)
+            return await response.text(errors='replace')
+
+    # Returns False if the robots.txt of the link's host does not allow the link (only for the politeness frontier)
+    async def is_allowed_by_robots(self, session, link):
+        if Crawler.crawling_links_frontier is not Crawler.host_frontier:
+            return True
+        robots_cache = Crawler.host_frontier.robots_cache
+        robots_url = robots_cache.get_missing_robots_url(link)
+        if robots_url is not None:
+            robots_cache.add_robots(link, await self.fetch_robots(session, robots_url))
+        return robots_cache.can_fetch(link)
+
+    # Returns the text of the robots.txt, or an empty text (everything is allowed) if the host has no robots.txt
+    async def fetch_robots(self, session, robots_url):
+        try:
+            async with session.get(robots_url, allow_redirects=True) as response:
+                if response.status in (401, 403):
+                    # The host does not allow the access to its robots.txt, so nothing of the host is allowed
+                    return "User-agent: *\nDisallow: /"
+                if response.status != 200:
+                    return ""
+                return await response.text(errors='replace')
+        except Exception:
+            return ""
+
+    # Returns False if the website was not kept because the crawl has enough websites, True otherwise
+    async def crawl_link(self, session, parser_pool, link):
+        if not await self.is_allowed_by_robots(session, link):
+            print("Website " + link + " was not saved: It is not allowed by robots.txt" + '\n')
+            return True
+
+        try:
+            html_text = await self.fetch(session, link)
+        except Exception as e:
+            print("Website " + link + " was not saved: " + e.__str__() + '\n')
+            return True
+
+        # Cleaning the text and finding the out-links in a parser process, in order to not block the event loop
+        try:
+            title, cleaned_words, list_of_links = await parser_pool.parse_async(html_text, Crawler.link_scheme)
+        except Exception as e:
+            print("Website " + link + " was not saved: " + e.__str__() + '\n')
+            return True
+
+        # If the website does not have a title, the one used is the original link
+        if title is None:
+            title = link
+
+        # If the search algorithm is DFS then reserve the order of the list in order to
+        # get the expected search order in the search-set
+        if Crawler.get_link_from_search_set == Crawler.crawling_links_stack.pop:
+            list_of_links.reverse()
+
+        # Adding only the new links (the ones that don't exist in the dictionary set), all of them at once
+        Crawler.add_links_to_frontier(list_of_links)
+
+        # Keeping the website in an executor's thread, in order to not block the event loop (the other workers keep
+        # fetching their websites while this one waits for the locks or for the indexing pipeline)
+        return await asyncio.get_running_loop().run_in_executor(None, Crawler.keep_website, link, title,
+                                                                cleaned_words)
+
+    async def worker(self, session, parser_pool):
+        # Crawling while the number of good links crawled are less than the desired links
+        while Crawler.kept_links_crawled_in_session < Crawler.num_of_links_to_crawl:
+            if len(Crawler.crawling_links_frontier) == 0:
+                # If no other worker is crawling, no more out-links will be added
+                if self.links_in_progress == 0:
+                    break
+                async with self.links_changed:
+                    await self.links_changed.wait()
+                continue
+
+            # Taking a link without waiting, since waiting would block the event loop.
+            # The politeness frontier gives no link if no host is ready yet, waiting until the next host is ready
+            try:
+                link = Crawler.get_link_from_search_set(timeout=0)
+            except queue.Empty:
+                await asyncio.sleep(min(Crawler.crawling_links_frontier.get_waiting_time(), meta.MIN_HOST_DELAY))
+                continue
+            # If this link has already been crawled skip it in order to find an alternative website.
+            # Otherwise marked as visited, in order to avoid crawling it from another worker
+            if not Crawler.reserve_link(link):
+                continue
+
+            Crawler.links_crawled_in_session.increment()
+            self.links_in_progress += 1
+            link_crawled = False
+            try:
+                link_crawled = await self.crawl_link(session, parser_pool, link)
+            finally:
+                self.links_in_progress -= 1
+                if link_crawled:
+                    Crawler.finish_link(link)
+                # Waking up the waiting workers, there may be new links (or no links will come any more)
+                async with self.links_changed:
+                    self.links_changed.notify_all()
+
+    async def crawl(self):
+        self.links_changed = asyncio.Condition()
+        timeout = aiohttp.ClientTimeout(sock_connect=5, sock_read=5)
+        # The connections are kept alive and reused, with at most MAX_CONNECTIONS_PER_HOST connections to each host
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=meta.MAX_CONNECTIONS_PER_HOST)
+        parser_pool = ParserPool(self.parser_processes, self.parser_backend)
+        try:
+            async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+                await asyncio.gather(*[self.worker(session, parser_pool) for _ in range(self.concurrency)])
+        finally:
+            parser_pool.shutdown()
+
+
+# Crawls on an event loop with the given concurrency and saves the crawled websites in the blocks' files
+# If stream_to_index is True the kept websites are indexed while crawling, like the crawl of the my_crawler.py
+def crawl(starting_url, num_of_links, start_from_scratch, concurrency, algorithm,
+          visited_set_backend=meta.DEFAULT_VISITED_SET_BACKEND, parser_processes=None,
+          parser_backend=meta.DEFAULT_PARSER_BACKEND, stream_to_index=False):
+    start = time.time()
+
+    starting_url_not_visited = Crawler.init_static_variables(start_url=starting_url, num_of_links_to_crawl=num_of_links,
+                                                             start_from_scratch=start_from_scratch,
+                                                             search_algorithm=algorithm,
+                                                             number_of_threads=concurrency,
+                                                             visited_set_backend=visited_set_backend)
+
+    if starting_url_not_visited:
+        # The stems are cached in the parser processes, the stem table is kept for the next crawls
+        TextProcessor.stem_cache.load(meta.STEM_TABLE_FILE_PATH)
+        if stream_to_index:
+            Crawler.indexing_pipeline = IndexingPipeline(new_index=start_from_scratch)
+        crawl_start_time = time.time()
+        # The checkpoints of the crawl are saved in the background, a crawl that is stopped is resumed from them
+        checkpointer = Checkpointer(Crawler.save_checkpoint)
+        checkpointer.start()
+        try:
+            asyncio.run(AsyncCrawler(concurrency, parser_processes, parser_backend).crawl())
+        except KeyboardInterrupt:
+            # The websites that were being crawled are crawled again when the crawl is resumed
+            print("The crawl is stopped")
+        checkpointer.stop()
+
+        print("Crawling time: %s seconds" % format((time.time() - crawl_start_time), ".2f"))
+        print("Total Number of web-pages checked or visited in this session were: " +
+              Crawler.links_crawled_in_session.__str__())
+        print("Number of web-pages kept in this session are: " + Crawler.kept_links_crawled_in_session.__str__())
+        print("Total time to crawl: ", (time.time() - start))
+
+        Crawler.close_current_block()
+        Crawler.save_checkpoint()
+        save_stem_cache()
+        close_indexing_pipeline()
+    else:
+        print(starting_url + " is already visited. You can run the crawler again "
+                             "and give a non-visited website to start from.")
+
+
+if __name__ == '__main__':
+    # Loading args in variables, the same args as the my_crawler.py but with the concurrency instead of the threads:
+    # optionally the visited set backend of a new crawl, the number of the parser processes (by default one for
+    # each cpu), the parser backend and the indexing while crawling (1 or 0)
+    starting_url_arg = sys.argv[1]
+    num_of_links_arg = int(sys.argv[2])
+    start_from_scratch_arg = sys.argv[3] == '1'
+    concurrency_arg = int(sys.argv[4])
+    algorithm_arg = sys.argv[5]
+    visited_set_backend_arg = sys.argv[6] if len(sys.argv) > 6 else meta.DEFAULT_VISITED_SET_BACKEND
+    parser_processes_arg = int(sys.argv[7]) if len(sys.argv) > 7 else None
+    parser_backend_arg = sys.argv[8] if len(sys.argv) > 8 else meta.DEFAULT_PARSER_BACKEND
+    stream_to_index_arg = len(sys.argv) > 9 and sys.argv[9] == '1'
+
+    crawl(starting_url_arg, num_of_links_arg, start_from_scratch_arg, concurrency_arg, algorithm_arg,
+          visited_set_backend_arg, parser_processes_arg, parser_backend_arg, stream_to_index_arg)
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+import metadata as meta
+
+import os
+import shutil
+import numpy as np
+
+# Columnar format of the blocks of documents that the crawler saves and the indexer reads.
+# A block is a directory with a urls and a titles column (a string for each document), the vocabulary of the block
+# (a string for each word, the id of a word is its position in the vocabulary) and the token ids of the words of
+# all the documents in one flat uint32 array, with the end of each document's tokens in the doc offsets.
+# All the files are append-only, a document is added at the end of the files and the doc offsets are written last,
+# so the documents of a block are the ones that have their doc offset (a reader never sees a half-written document)
+
+
+def get_block_path(block_number):
+    return meta.BLOCK_FILE_NAME_PREFIX_PATH + block_number.__str__()
+
+
+# The file of a block of the older format, a pickled dictionary { url : (title, [word, word, ...]) }
+def get_pickled_block_path(block_number):
+    return meta.BLOCK_FILE_NAME_PREFIX_PATH + block_number.__str__() + ".npy"
+
+
+# Returns the array of the file with the values that are written completely (all of their bytes).
+# If mmap_mode is 'r' the file is memory-mapped instead of being read in memory
+def load_column(file_path, dtype, mmap_mode=None):
+    if not os.path.exists(file_path):
+        return np.zeros(0, dtype=dtype)
+    count = os.path.getsize(file_path) // np.dtype(dtype).itemsize
+    if mmap_mode is None or count == 0:
+        return np.fromfile(file_path, dtype=dtype, count=count)
+    return np.memmap(file_path, dtype=dtype, mode=mmap_mode, shape=(count,)).view(np.ndarray)
+
+
+# Returns the offsets of a file with the end of each value, with the start (0) of the first value before them
+def load_offsets(file_path, count=None, mmap_mode=None):
+    ends = load_column(file_path, np.int64, mmap_mode)
+    if count is not None:
+        ends = ends[:count]
+    offsets = np.zeros(len(ends) + 1, dtype=np.int64)
+    offsets[1:] = ends
+    return offsets
+
+
+# Read-only column of strings of a block, the strings [offsets[i], offsets[i + 1]) of the data
+class StringColumn:
+
+    def __init__(self, file_path_prefix, count=None, mmap_mode=None):
+        self.offsets = load_offsets(file_path_prefix + meta.BLOCK_STRING_OFFSETS_SUFFIX, count, mmap_mode)
+        self.data = load_column(file_path_prefix + meta.BLOCK_STRING_DATA_SUFFIX, np.uint8, mmap_mode)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # Returns the strings [first, end) of the column
+    def get_strings(self, first=0, end=None):
+        end = len(self) if end is None else end
+        data = self.data[self.offsets[first]:self.offsets[end]].tobytes()
+        starts = (self.offsets[first:end] - self.offsets[first]).tolist()
+        ends = (self.offsets[first + 1:end + 1] - self.offsets[first]).tolist()
+        return [data[start:string_end].decode('utf-8') for start, string_end in zip(starts, ends)]
+
+
+# Read-only block of documents of the columnar format
+class DocumentBlock:
+
+    def __init__(self, block_path, mmap_mode=None):
+        self.block_path = block_path
+        self.doc_offsets = load_offsets(os.path.join(block_path, meta.BLOCK_DOC_OFFSETS_FILENAME), mmap_mode=mmap_mode)
+        self.tokens = load_column(os.path.join(block_path, meta.BLOCK_TOKENS_FILENAME), np.uint32,
+                                  mmap_mode)[:self.doc_offsets[-1]]
+        self.urls = StringColumn(os.path.join(block_path, meta.BLOCK_URLS_FILENAME), len(self), mmap_mode)
+        self.titles = StringColumn(os.path.join(block_path, meta.BLOCK_TITLES_FILENAME), len(self), mmap_mode)
+        self.vocabulary = StringColumn(os.path.join(block_path, meta.BLOCK_VOCABULARY_FILENAME), mmap_mode=mmap_mode)
+
+    # The number of documents of the block
+    def __len__(self):
+        return len(self.doc_offsets) - 1
+
+    def get_urls(self, first=0):
+        return self.urls.get_strings(first, len(self))
+
+    def get_titles(self, first=0):
+        return self.titles.get_strings(first, len(self))
+
+    # Returns the words of the vocabulary, only the words with the given ids if they are given
+    def get_vocabulary(self, term_ids=None):
+        vocabulary = self.vocabulary.get_strings()
+        if term_ids is None:
+            return vocabulary
+        return [vocabulary[term_id] for term_id in term_ids.tolist()]
+
+    # Returns the token ids of the documents after the first ones and the offsets of each document's tokens in them
+    def get_tokens(self, first=0):
+        doc_offsets = self.doc_offsets[first:] - self.doc_offsets[first]
+        return doc_offsets, self.tokens[self.doc_offsets[first]:self.doc_offsets[-1]]
+
+    # Returns the documents (url, (title, words)) after the first ones, like the items of the older blocks' dictionary
+    def get_documents(self, first=0):
+        vocabulary = self.get_vocabulary()
+        doc_offsets, tokens = self.get_tokens(first)
+        for doc, url, title in zip(range(len(doc_offsets) - 1), self.get_urls(first), self.get_titles(first)):
+            yield url, (title, [vocabulary[token] for token in tokens[doc_offsets[doc]:doc_offsets[doc + 1]].tolist()])
+
+
+# Block of the older format (a pickled dictionary), with the same columns as a DocumentBlock
+# that are made in memory when the block is loaded
+class PickledDocumentBlock(DocumentBlock):
+
+    def __init__(self, block_path):
+        self.block_path = block_path
+        pages_dictionary = np.load(block_path, allow_pickle=True).item()
+        # Assert in order to confirm that this is a dictionary before the call of the items() operation
+        assert isinstance(pages_dictionary, dict)
+        self.pages_urls = list(pages_dictionary.keys())
+        self.pages_titles = [title for title, _ in pages_dictionary.values()]
+        vocabulary = {}
+        tokens = [[vocabulary.setdefault(word, len(vocabulary)) for word in words]
+                  for _, words in pages_dictionary.values()]
+        self.pages_vocabulary = list(vocabulary.keys())
+        self.doc_offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        self.doc_offsets[1:] = np.cumsum([len(doc_tokens) for doc_tokens in tokens])
+        self.tokens = np.fromiter((token for doc_tokens in tokens for token in doc_tokens), dtype=np.uint32,
+                                  count=self.doc_offsets[-1])
+
+    def get_urls(self, first=0):
+        return self.pages_urls[first:]
+
+    def get_titles(self, first=0):
+        return self.pages_titles[first:]
+
+    def get_vocabulary(self, term_ids=None):
+        if term_ids is None:
+            return self.pages_vocabulary
+        return [self.pages_vocabulary[term_id] for term_id in term_ids.tolist()]
+
+
+# Returns the block with the given number, of the columnar format or of the older format
+def open_block(block_number, mmap_mode=None):
+    block_path = get_block_path(block_number)
+    if os.path.isdir(block_path):
+        return DocumentBlock(block_path, mmap_mode)
+    return PickledDocumentBlock(get_pickled_block_path(block_number))
+
+
+# Appends documents to a block of the columnar format. If append is False the block is made from scratch.
+# When an existing block is opened, the bytes after its last complete document (the ones of a document
+# that was being written when the writer stopped) are removed, so the new documents are appended after it
+class DocumentBlockWriter:
+
+    def __init__(self, block_path, append=True):
+        self.block_path = block_path
+        if not append:
+            shutil.rmtree(block_path, ignore_errors=True)
+        os.makedirs(block_path, exist_ok=True)
+
+        block = DocumentBlock(block_path)
+        self.number_of_documents = len(block)
+        # { word : token id } of the vocabulary of the block
+        self.vocabulary = {word: token_id for token_id, word in enumerate(block.get_vocabulary())}
+        # The end of each string column's data
+        self.data_ends = {meta.BLOCK_URLS_FILENAME: int(block.urls.offsets[-1]),
+                          meta.BLOCK_TITLES_FILENAME: int(block.titles.offsets[-1]),
+                          meta.BLOCK_VOCABULARY_FILENAME: int(block.vocabulary.offsets[-1])}
+        self.tokens_end = int(block.doc_offsets[-1])
+
+        # Removing the incomplete bytes at the end of the files and opening them for appending
+        file_sizes = {meta.BLOCK_DOC_OFFSETS_FILENAME: 8 * len(block),
+                      meta.BLOCK_TOKENS_FILENAME: 4 * self.tokens_end}
+        for name, strings in ((meta.BLOCK_URLS_FILENAME, len(block)), (meta.BLOCK_TITLES_FILENAME, len(block)),
+                              (meta.BLOCK_VOCABULARY_FILENAME, len(self.vocabulary))):
+            file_sizes[name + meta.BLOCK_STRING_DATA_SUFFIX] = self.data_ends[name]
+            file_sizes[name + meta.BLOCK_STRING_OFFSETS_SUFFIX] = 8 * strings
+        self.files = {}
+        for filename, file_size in file_sizes.items():
+            self.files[filename] = open(os.path.join(block_path, filename), 'ab')
+            self.files[filename].truncate(file_size)
+
+    def __len__(self):
+        return self.number_of_documents
+
+    # Appends the strings at the end of the string column
+    def append_strings(self, name, strings):
+        encoded_strings = [string.encode('utf-8') for string in strings]
+        ends = self.data_ends[name] + np.cumsum([len(string) for string in encoded_strings], dtype=np.int64)
+        self.files[name + meta.BLOCK_STRING_DATA_SUFFIX].write(b''.join(encoded_strings))
+        self.files[name + meta.BLOCK_STRING_OFFSETS_SUFFIX].write(ends.tobytes())
+        if len(encoded_strings) > 0:
+            self.data_ends[name] = int(ends[-1])
+
+    # Appends a document at the end of the block, the new words are added to the vocabulary.
+    # The document is written to the files (not only to their buffers) when the method returns
+    def add_document(self, url, title, words):
+        new_words = [word for word in dict.fromkeys(words) if word not in self.vocabulary]
+        for word in new_words:
+            self.vocabulary[word] = len(self.vocabulary)
+        tokens = np.fromiter((self.vocabulary[word] for word in words), dtype=np.uint32, count=len(words))
+
+        self.append_strings(meta.BLOCK_VOCABULARY_FILENAME, new_words)
+        self.files[meta.BLOCK_TOKENS_FILENAME].write(tokens.tobytes())
+        self.append_strings(meta.BLOCK_URLS_FILENAME, [url])
+        self.append_strings(meta.BLOCK_TITLES_FILENAME, [title])
+        self.tokens_end += len(tokens)
+        # The doc offset of the document is written after all the other columns of the document
+        for filename, block_file in self.files.items():
+            if filename != meta.BLOCK_DOC_OFFSETS_FILENAME:
+                block_file.flush()
+        self.files[meta.BLOCK_DOC_OFFSETS_FILENAME].write(np.int64(self.tokens_end).tobytes())
+        self.files[meta.BLOCK_DOC_OFFSETS_FILENAME].flush()
+        self.number_of_documents += 1
+
+    # Writes the documents to the disk (not only to the operating system), for the checkpoints of the crawl
+    def sync(self):
+        for block_file in self.files.values():
+            block_file.flush()
+            os.fsync(block_file.fileno())
+
+    def close(self):
+        for block_file in self.files.values():
+            block_file.close()
+
+
+# Converts the blocks of the older format (pickled dictionaries) to the columnar format, the pickled files are removed
+def convert_pickled_blocks(total_blocks):
+    for block_number in range(1, total_blocks + 1):
+        pickled_block_path = get_pickled_block_path(block_number)
+        if os.path.isdir(get_block_path(block_number)) or not os.path.exists(pickled_block_path):
+            continue
+        print("Converting block " + block_number.__str__() + " to the columnar format")
+        block_writer = DocumentBlockWriter(get_block_path(block_number), append=False)
+        for url, (title, words) in PickledDocumentBlock(pickled_block_path).get_documents():
+            block_writer.add_document(url, title, words)
+        block_writer.close()
+        os.remove(pickled_block_path)
+
+
+if __name__ == '__main__':
+    # Converts the blocks of the crawled documents (their number is in the metadata) to the columnar format
+    metadata_dict = np.load(meta.METADATA_DICTIONARY_FILE_PATH, allow_pickle=True).item()
+    # Assert in order to confirm that this is a dictionary before the call of the get() operation
+    assert isinstance(metadata_dict, dict)
+    convert_pickled_blocks(metadata_dict.get(meta.META_TOTAL_BLOCKS_KEY))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import metadata as meta
+
+import os
+import threading
+import numpy as np
+
+
+# Writes the file (with write_file, that is given the opened file) in a temporary file, writes it to the disk
+# and then renames it, so the file is always the old one or the new one (a crash never leaves a half-written file).
+# The directory is written to the disk too, so the new file is on the disk when the function returns
+# (the changes that are saved after it, like the truncation of the crawl log, can't be on the disk before it)
+def write_file_atomically(file_path, write_file):
+    temporary_path = file_path + ".tmp"
+    with open(temporary_path, 'wb') as temporary_file:
+        write_file(temporary_file)
+        temporary_file.flush()
+        os.fsync(temporary_file.fileno())
+    os.replace(temporary_path, file_path)
+    # Only the posix systems can open a directory in order to sync it
+    if hasattr(os, 'O_DIRECTORY'):
+        directory = os.open(os.path.dirname(os.path.abspath(file_path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+# Saves the object (with np.save) atomically and durably (see write_file_atomically)
+def save_file_atomically(file_path, saved_object):
+    write_file_atomically(file_path, lambda saved_file: np.save(saved_file, saved_object))
+
+
+# Append-only log (write-ahead log) of the changes of a crawl after its last checkpoint, a line for each record with
+# the type of the record and its value. The websites that are kept are not in the log, since the blocks are
+# append-only too (my_blocks.py). A resumed crawl replays the records of the log after it loads the checkpoint,
+# so only the links that were being crawled when the crawl stopped are crawled again
+class CrawlLog:
+    FRONTIER_RECORD = "F"  # A link was added to the frontier
+    RESERVED_RECORD = "R"  # A link was taken from the frontier to be crawled (and it was added to the visited set)
+    DONE_RECORD = "D"  # A link was crawled, it is not crawled again (whether its website was kept or not)
+    BLOCK_RECORD = "B"  # A new block was started
+
+    def __init__(self, file_path=meta.CRAWL_LOG_FILE_PATH):
+        self.file_path = file_path
+        # The lock of the appends, a checkpoint holds it while it saves the crawl and clears the log
+        self.lock = threading.Lock()
+        self.log_file = open(file_path, 'a', encoding='utf-8')
+
+    # Appends a record for each of the values. If flush is True the records are written to the file (not only to its
+    # buffer) when the method returns, the buffered records are lost if the crawler is killed
+    def append(self, record_type, values, flush=False):
+        with self.lock:
+            self.log_file.write("".join(record_type + "\t" + value + "\n" for value in values))
+            if flush:
+                self.log_file.flush()
+
+    # Removes all the records (after they were saved in a checkpoint), the lock has to be held
+    def clear(self):
+        self.log_file.flush()
+        self.log_file.truncate(0)
+
+    def close(self):
+        self.log_file.close()
+
+    # Returns the values of each type of record of the log { record type : [value, ...] }.
+    # The last record is skipped if it was not written completely
+    @staticmethod
+    def read(file_path=meta.CRAWL_LOG_FILE_PATH):
+        records = {CrawlLog.FRONTIER_RECORD: [], CrawlLog.RESERVED_RECORD: [], CrawlLog.DONE_RECORD: [],
+                   CrawlLog.BLOCK_RECORD: []}
+        if not os.path.exists(file_path):
+            return records
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as log_file:
+            for line in log_file:
+                if not line.endswith("\n"):
+                    break
+                record_type, _, value = line[:-1].partition("\t")
+                if record_type in records:
+                    records[record_type].append(value)
+        return records
+
+
+# Thread that saves a checkpoint every interval seconds (with the given function), until it is stopped
+class Checkpointer(threading.Thread):
+
+    def __init__(self, save_checkpoint, interval=meta.CHECKPOINT_INTERVAL):
+        threading.Thread.__init__(self, daemon=True)
+        self.save_checkpoint = save_checkpoint
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.save_checkpoint()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
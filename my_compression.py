@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import metadata as meta
+import numpy as np
+import os
+
+
+# Variable-byte (VByte) encoding of non-negative integers, 7 bits of the integer in each byte (the least significant
+# first) and the high bit of the byte set in all the bytes of the integer except the last one.
+# Returns the uint8 array with the bytes of all the integers and the number of bytes of each integer
+def vbyte_encode(values):
+    values = np.asarray(values, dtype=np.int64)
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28, 35):
+        num_bytes += values >= (1 << bits)
+    # The position of each byte in the bytes of its integer
+    value_positions = np.repeat(np.arange(len(values)), num_bytes)
+    byte_positions = np.arange(len(value_positions)) - np.repeat(np.cumsum(num_bytes) - num_bytes, num_bytes)
+    encoded = (values[value_positions] >> (7 * byte_positions)) & 0x7f
+    encoded[byte_positions < num_bytes[value_positions] - 1] |= 0x80
+    return encoded.astype(np.uint8), num_bytes
+
+
+# Decodes all the integers of the VByte encoded bytes at once (the bytes must end with the last byte of an integer)
+def vbyte_decode(encoded):
+    encoded = np.asarray(encoded, dtype=np.uint8)
+    is_last_byte = encoded < 0x80
+    # Most of the integers have one byte (the frequencies and the small gaps of the document ids)
+    if is_last_byte.all():
+        return encoded.astype(np.int64)
+    ends = np.flatnonzero(is_last_byte)
+    starts = np.zeros(len(ends), dtype=np.int64)
+    starts[1:] = ends[:-1] + 1
+    shifts = 7 * (np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((encoded & 0x7f).astype(np.int64) << shifts, starts)
+
+
+# Returns the bytes of the given byte ranges [byte_starts, byte_ends) of the data, one after the other
+def get_byte_ranges(data, byte_starts, byte_ends):
+    byte_lengths = (byte_ends - byte_starts).astype(np.int64)
+    if len(byte_lengths) == 1:
+        return data[int(byte_starts[0]):int(byte_ends[0])]
+    return data[np.repeat(byte_starts - (np.cumsum(byte_lengths) - byte_lengths), byte_lengths)
+                + np.arange(int(byte_lengths.sum()))]
+
+
+# Postings that are compressed in blocks of (at most) POSTINGS_BLOCK_SIZE postings of the same term.
+# The gaps between the document ids (the first gap of a term is its first document id) and the frequencies are
+# VByte encoded in two different byte arrays, so the document ids of consecutive blocks are the sums of their gaps.
+# The blocks of the term with id t are the blocks [term_blocks[t], term_blocks[t + 1]), the bytes of block b are
+# the doc_data[doc_block_offsets[b]:doc_block_offsets[b + 1]] and freq_data[freq_block_offsets[b]:...].
+# The last document id of each block is the skip pointer of the block, the blocks that may have some document ids
+# are found with binary search on them, so only these blocks are decoded (the blocks are decoded all at once)
+class CompressedPostings:
+
+    def __init__(self, index_path, term_offsets, mmap_mode=None):
+        self.index_path = index_path
+        self.mmap_mode = mmap_mode
+        self.term_offsets = term_offsets
+        self.doc_data = self.load_array(meta.INDEX_POSTINGS_DOC_DATA_FILENAME)
+        self.doc_block_offsets = self.load_array(meta.INDEX_POSTINGS_DOC_BLOCK_OFFSETS_FILENAME)
+        self.freq_data = self.load_array(meta.INDEX_POSTINGS_FREQ_DATA_FILENAME)
+        self.freq_block_offsets = self.load_array(meta.INDEX_POSTINGS_FREQ_BLOCK_OFFSETS_FILENAME)
+        self.block_last_doc_ids = self.load_array(meta.INDEX_POSTINGS_BLOCK_LAST_DOC_IDS_FILENAME)
+        self.term_blocks = self.load_array(meta.INDEX_TERM_BLOCKS_FILENAME)
+        self.block_size = int(self.load_array(meta.INDEX_POSTINGS_BLOCK_SIZE_FILENAME))
+
+    # The memory-mapped arrays are used as plain arrays (of the same memory), since the many small slices
+    # of the blocks are slower when each of them is a memmap object
+    def load_array(self, filename):
+        return np.load(os.path.join(self.index_path, filename), mmap_mode=self.mmap_mode).view(np.ndarray)
+
+    # Returns the postings (doc_ids, freqs) of the consecutive blocks [first_block, end_block)
+    # that start from the document id base
+    def decode_block_range(self, first_block, end_block, base=0):
+        gaps = vbyte_decode(self.doc_data[self.doc_block_offsets[first_block]:self.doc_block_offsets[end_block]])
+        doc_ids = np.cumsum(gaps)
+        if base != 0:
+            doc_ids += base
+        return doc_ids, vbyte_decode(self.freq_data[self.freq_block_offsets[first_block]:
+                                                    self.freq_block_offsets[end_block]])
+
+    # Returns the postings (doc_ids, freqs) of the given blocks (sorted) of the term with the given id
+    def decode_blocks(self, term_id, blocks):
+        first_block = int(self.term_blocks[term_id])
+        # The number of postings of each block, only the last block of the term may have fewer than block_size
+        counts = np.minimum(self.block_size, int(self.term_offsets[term_id + 1] - self.term_offsets[term_id])
+                            - (blocks - first_block) * self.block_size)
+        # The document id that the first gap of each block is added to
+        bases = np.where(blocks > first_block, self.block_last_doc_ids[np.maximum(blocks - 1, 0)], 0)
+        gaps = vbyte_decode(get_byte_ranges(self.doc_data, self.doc_block_offsets[blocks],
+                                            self.doc_block_offsets[blocks + 1]))
+        freqs = vbyte_decode(get_byte_ranges(self.freq_data, self.freq_block_offsets[blocks],
+                                             self.freq_block_offsets[blocks + 1]))
+        # The document ids are the sums of the gaps of each block, starting from the base of the block
+        gaps_sums = np.cumsum(gaps)
+        block_starts = np.cumsum(counts) - counts
+        return gaps_sums - np.repeat(gaps_sums[block_starts] - gaps[block_starts] - bases, counts), freqs
+
+    # Returns the postings (doc_ids, freqs) of the term with the given id
+    def get_postings_by_id(self, term_id):
+        return self.decode_block_range(int(self.term_blocks[term_id]), int(self.term_blocks[term_id + 1]))
+
+    # Returns all the postings (doc_ids, freqs) of the index, in the order of the terms
+    def get_all_postings(self):
+        gaps = vbyte_decode(self.doc_data)
+        freqs = vbyte_decode(self.freq_data)
+        if len(gaps) == 0:
+            return gaps, freqs
+        # The document ids are the sums of the gaps of each term
+        gaps_sums = np.cumsum(gaps)
+        term_starts = self.term_offsets[:-1]
+        return gaps_sums - np.repeat(gaps_sums[term_starts] - gaps[term_starts], np.diff(self.term_offsets)), freqs
+
+    # Returns the frequency of the term with the given id in each of the given (sorted) document ids,
+    # 0 for the documents that don't contain the term. Only the blocks that may have the document ids are decoded
+    def get_term_frequencies(self, term_id, doc_ids):
+        first_block, end_block = int(self.term_blocks[term_id]), int(self.term_blocks[term_id + 1])
+        # The first block of the term with a last document id that is not smaller than each document id
+        doc_blocks = np.searchsorted(self.block_last_doc_ids[first_block:end_block], doc_ids) + first_block
+        freqs = np.zeros(len(doc_ids), dtype=np.int64)
+        in_blocks = np.flatnonzero(doc_blocks < end_block)
+        if len(in_blocks) == 0:
+            return freqs
+        blocks = np.unique(doc_blocks[in_blocks])
+        if len(blocks) == 1 or 2 * len(blocks) > end_block - first_block:
+            # Decoding the consecutive blocks from the first to the last needed block is faster
+            # than gathering the bytes of the needed blocks
+            first_needed_block, end_needed_block = int(blocks[0]), int(blocks[-1]) + 1
+            base = 0 if first_needed_block == first_block else int(self.block_last_doc_ids[first_needed_block - 1])
+            block_doc_ids, block_freqs = self.decode_block_range(first_needed_block, end_needed_block, base)
+        else:
+            block_doc_ids, block_freqs = self.decode_blocks(term_id, blocks)
+        positions = np.minimum(np.searchsorted(block_doc_ids, doc_ids[in_blocks]), len(block_doc_ids) - 1)
+        found = block_doc_ids[positions] == doc_ids[in_blocks]
+        freqs[in_blocks[found]] = block_freqs[positions[found]]
+        return freqs
+
+    # Saves the postings (sorted by term and then by document id) compressed in blocks of block_size postings
+    @staticmethod
+    def save(index_path, term_offsets, doc_ids, freqs, block_size=meta.POSTINGS_BLOCK_SIZE):
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        counts = np.diff(term_offsets)
+        # The position of each posting in the postings of its term, the blocks start every block_size postings
+        term_positions = np.arange(len(doc_ids)) - np.repeat(term_offsets[:-1], counts)
+        block_starts = np.flatnonzero(term_positions % block_size == 0)
+        block_ends = np.append(block_starts[1:], len(doc_ids))
+        term_blocks = np.zeros(len(counts) + 1, dtype=np.int64)
+        term_blocks[1:] = np.cumsum((counts + block_size - 1) // block_size)
+
+        # The gaps between the document ids, the first posting of each term keeps its document id
+        gaps = np.diff(doc_ids, prepend=0)
+        gaps[term_positions == 0] = doc_ids[term_positions == 0]
+
+        for data_filename, block_offsets_filename, values in (
+                (meta.INDEX_POSTINGS_DOC_DATA_FILENAME, meta.INDEX_POSTINGS_DOC_BLOCK_OFFSETS_FILENAME, gaps),
+                (meta.INDEX_POSTINGS_FREQ_DATA_FILENAME, meta.INDEX_POSTINGS_FREQ_BLOCK_OFFSETS_FILENAME, freqs)):
+            encoded, num_bytes = vbyte_encode(values)
+            # The first byte of the postings of each block
+            value_offsets = np.zeros(len(values) + 1, dtype=np.int64)
+            value_offsets[1:] = np.cumsum(num_bytes)
+            np.save(os.path.join(index_path, data_filename), encoded)
+            np.save(os.path.join(index_path, block_offsets_filename),
+                    np.append(value_offsets[block_starts], len(encoded)).astype(np.int64))
+
+        np.save(os.path.join(index_path, meta.INDEX_POSTINGS_BLOCK_LAST_DOC_IDS_FILENAME),
+                doc_ids[block_ends - 1].astype(np.int32))
+        np.save(os.path.join(index_path, meta.INDEX_TERM_BLOCKS_FILENAME), term_blocks)
+        np.save(os.path.join(index_path, meta.INDEX_POSTINGS_BLOCK_SIZE_FILENAME), np.array(block_size))
+
+
+# Returns the position gaps of the postings from the positions of each posting (sorted, freqs[i] positions
+# for the i-th posting): the first position of each posting and then the gaps between its positions
+def get_position_gaps(positions, freqs):
+    positions = np.asarray(positions, dtype=np.int64)
+    posting_starts = np.cumsum(freqs) - freqs
+    gaps = np.diff(positions, prepend=0)
+    gaps[posting_starts] = positions[posting_starts]
+    return gaps
+
+
+# The positions of the terms in the documents (the positions of the words in the document's list of words),
+# for each posting the positions of its term in its document. The position gaps of each posting (get_position_gaps)
+# are VByte encoded in blocks of (at most) block_size postings of the same term, like the blocks of the
+# CompressedPostings. The positions of the postings of block b are in positions_data[block_offsets[b]:
+# block_offsets[b + 1]] and the number of positions of each posting is its frequency, so only the blocks
+# of the postings whose positions are needed are decoded
+class PositionalPostings:
+
+    def __init__(self, index_path, term_offsets, mmap_mode=None):
+        self.index_path = index_path
+        self.mmap_mode = mmap_mode
+        self.positions_data = self.load_array(meta.INDEX_POSITIONS_DATA_FILENAME)
+        self.block_offsets = self.load_array(meta.INDEX_POSITIONS_BLOCK_OFFSETS_FILENAME)
+        self.block_size = int(self.load_array(meta.INDEX_POSITIONS_BLOCK_SIZE_FILENAME))
+        # The first block of each term
+        self.term_blocks = np.zeros(len(term_offsets), dtype=np.int64)
+        self.term_blocks[1:] = np.cumsum((np.diff(term_offsets) + self.block_size - 1) // self.block_size)
+
+    def load_array(self, filename):
+        return np.load(os.path.join(self.index_path, filename), mmap_mode=self.mmap_mode).view(np.ndarray)
+
+    # Returns the positions of the given postings (sorted positions in the postings of the term with the given id),
+    # term_freqs are the frequencies of all the postings of the term
+    def get_positions(self, term_id, posting_ranks, term_freqs):
+        if len(posting_ranks) == 0:
+            return []
+        # The first position (of all the term's positions) of each posting of the term
+        value_offsets = np.zeros(len(term_freqs) + 1, dtype=np.int64)
+        value_offsets[1:] = np.cumsum(term_freqs)
+        posting_blocks = posting_ranks // self.block_size
+        blocks = np.unique(posting_blocks)
+        first_block = int(self.term_blocks[term_id])
+        gaps = vbyte_decode(get_byte_ranges(self.positions_data, self.block_offsets[blocks + first_block],
+                                            self.block_offsets[blocks + first_block + 1]))
+        # The first position of each block in the decoded gaps, and of each posting
+        block_first_values = value_offsets[blocks * self.block_size]
+        block_value_counts = value_offsets[np.minimum((blocks + 1) * self.block_size, len(term_freqs))] \
+            - block_first_values
+        block_starts = np.cumsum(block_value_counts) - block_value_counts
+        posting_block_positions = np.searchsorted(blocks, posting_blocks)
+        posting_starts = block_starts[posting_block_positions] + value_offsets[posting_ranks] \
+            - block_first_values[posting_block_positions]
+        return [np.cumsum(gaps[start:start + freq]) for start, freq
+                in zip(posting_starts.tolist(), np.asarray(term_freqs)[posting_ranks].tolist())]
+
+    # Returns the position gaps of all the postings of the index, in the order of the postings
+    def get_all_position_gaps(self):
+        return vbyte_decode(self.positions_data)
+
+    # Saves the position gaps of the postings (sorted by term and then by document id, freqs[i] gaps
+    # for the i-th posting) compressed in blocks of block_size postings
+    @staticmethod
+    def save(index_path, term_offsets, freqs, position_gaps, block_size=meta.POSTINGS_BLOCK_SIZE):
+        counts = np.diff(term_offsets)
+        # The position of each posting in the postings of its term, the blocks start every block_size postings
+        term_positions = np.arange(len(freqs)) - np.repeat(term_offsets[:-1], counts)
+        block_starts = np.flatnonzero(term_positions % block_size == 0)
+
+        encoded, num_bytes = vbyte_encode(position_gaps)
+        # The first byte of the positions of each posting
+        value_offsets = np.zeros(len(freqs) + 1, dtype=np.int64)
+        value_offsets[1:] = np.cumsum(freqs)
+        byte_offsets = np.zeros(len(position_gaps) + 1, dtype=np.int64)
+        byte_offsets[1:] = np.cumsum(num_bytes)
+        np.save(os.path.join(index_path, meta.INDEX_POSITIONS_DATA_FILENAME), encoded)
+        np.save(os.path.join(index_path, meta.INDEX_POSITIONS_BLOCK_OFFSETS_FILENAME),
+                np.append(byte_offsets[value_offsets[block_starts]], len(encoded)).astype(np.int64))
+        np.save(os.path.join(index_path, meta.INDEX_POSITIONS_BLOCK_SIZE_FILENAME), np.array(block_size))
@@ -1,15 +1,44 @@
 # -*- coding: utf-8 -*-
 import my_text_processor as my_tp
 from my_text_processor import TextProcessor
+from my_frontier import LinkQueue, LinkStack, HostFrontier
+from my_visited_set import create_visited_set, load_visited_set, save_arrays_file
+from my_checkpoint import CrawlLog, Checkpointer, save_file_atomically
+from my_parser_pool import ParserPool
+from my_blocks import DocumentBlockWriter
+from my_indexer import IndexingPipeline
+import my_blocks
 import metadata as meta
 
+import os
 import sys
 import requests
 import ssl
 import threading
+import queue
 import time
 import numpy as np
-from collections import deque
+
+
+# Counter that is increased and decreased by many threads
+class AtomicCounter:
+
+    def __init__(self, value=0):
+        self.value = value
+        self.lock = threading.Lock()
+
+    def increment(self):
+        with self.lock:
+            self.value += 1
+            return self.value
+
+    def decrement(self):
+        with self.lock:
+            self.value -= 1
+            return self.value
+
+    def __str__(self):
+        return self.value.__str__()
 
 
 class Crawler(threading.Thread):
@@ -19,45 +48,69 @@ class Crawler(threading.Thread):
     total_blocks = None
     # Each block will have a specific number of websites saved in it
     max_block_size = None
-    # Set that holds the links that have been crawled
+    # Set that holds the links that have been crawled (a visited set of my_visited_set.py)
     crawled_links_set = None
 
-    # Using deque for both queue and stack operations
-    # Deque is preferred over list in the cases where we need quicker append
-    # and pop operations from both the ends of container, as deque provides an
-    # O(1) time complexity for append and pop operations as compared to list which provides O(n) time complexity
-    crawling_links_deque = deque()
-
-    pages_dictionary = None  # The  dictionary with the websites and words that have been crawled
+    # Thread-safe queue and stack of links (queue.Queue and queue.LifoQueue), so the threads can take and add links
+    # without a lock of the crawler. The threads that wait for a link are woken up when links are added
+    crawling_links_queue = LinkQueue()
+    crawling_links_stack = LinkStack()
+    # Frontier with a queue for each host, that gives the links of each host with a delay between them
+    host_frontier = HostFrontier()
+    # The queue, the stack or the frontier that the links are added to, the one of the search algorithm's pop operation
+    crawling_links_frontier = None
+
+    # The writer of the current block, the websites and words that have been crawled are appended to the block.
+    # None when the next website starts a new block
+    block_writer = None
     num_of_links_to_crawl = None
-    links_crawled_in_session = 0  # Set that holds the number of links that have been crawled only in this session
+    # The number of links that have been crawled only in this session
+    links_crawled_in_session = AtomicCounter()
     kept_links_crawled_in_session = 0
-    count_consecutive_empty_queue_accesses = 0
+    # The number of links that are being crawled right now (their out-links are not added yet)
+    links_in_progress = AtomicCounter()
 
-    # The method's signature of the deque that will be called to get a new link
+    # The method's signature of the frontier that will be called to get a new link
     get_link_from_search_set = None
+    number_of_threads = None
+    # Only the out-links with this scheme are crawled
+    link_scheme = "https"
 
     # Dictionary that has the functions used for the different pop operations
     # depending on the search algorithm that will be used
     queue_dict = {
-        "DFS": crawling_links_deque.pop,  # Works like LIFO
-        "BFS": crawling_links_deque.popleft,  # Works like FIFO
+        "DFS": crawling_links_stack.pop,  # Works like LIFO
+        "BFS": crawling_links_queue.pop,  # Works like FIFO
+        "POLITE": host_frontier.pop,  # Gives the links of the host that is ready the longest time
     }
 
     # Since the crawler class uses it's objects/instances as a way to crawl different websites with many threads,
     # locks(semaphores) are going to be used. Using static locks for the Crawler so that
-    # two threads won't be able to access the queue or the dictionary at same time.
-    # This lock is used for the read/write of the crawling_links_deque deque
-    crawling_links_deque_lock = threading.Lock()
-    # This lock is used for the read/write of the dictionary and the kept_links_crawled_in_session
+    # two threads won't be able to access the visited set or the dictionary at same time.
+    # This lock is used for the check and the add of a link in the crawled_links_set
+    crawled_links_lock = threading.Lock()
+    # This lock is used for the appends to the current block and the kept_links_crawled_in_session
     dictionary_lock = threading.Lock()
 
     # The TextProcessor object that will use stemming
     # and will also be used for other text processing/manipulation operations
     text_processor = TextProcessor(stemming=True)
+    # The pool of the parser processes that clean the html texts, None if the threads clean them
+    parser_pool = None
+    # The pipeline that the kept websites are sent to in order to be indexed while crawling, None if they are
+    # indexed after the crawl by the my_indexer.py
+    indexing_pipeline = None
+
+    # The log of the changes of the crawl after the last checkpoint (my_checkpoint.py)
+    crawl_log = None
+    # The links that are being crawled (taken from the frontier, but their websites are not crawled yet)
+    links_being_crawled = set()
+    # The links that are crawled again even though they are in the visited set, the links that were being crawled
+    # when the previous crawl stopped
+    links_to_crawl_again = set()
 
     @staticmethod
-    def init_metadata_dict():
+    def init_metadata_dict(visited_set_backend=meta.DEFAULT_VISITED_SET_BACKEND):
         # Dictionary that holds all the metadata
         Crawler.metadata_dict = {}
         # The default total number of website blocks saved in the files
@@ -65,21 +118,26 @@ class Crawler(threading.Thread):
         # Each block will have by default some websites saved in it
         Crawler.max_block_size = meta.DEFAULT_MAX_BLOCK_SIZE
         # Set that holds the links that have been crawled
-        Crawler.crawled_links_set = set()
+        Crawler.crawled_links_set = create_visited_set(visited_set_backend)
 
     @staticmethod
-    def init_static_variables(start_url, num_of_links_to_crawl, search_algorithm, start_from_scratch=1, number_of_threads=1):
+    def init_static_variables(start_url, num_of_links_to_crawl, search_algorithm, start_from_scratch=1, number_of_threads=1,
+                              visited_set_backend=meta.DEFAULT_VISITED_SET_BACKEND):
         # Check that the search algorithm is listed in the queue_dict, in order to
         # work with the implemented crawl function. Otherwise throw an exception
         if not (search_algorithm in Crawler.queue_dict):
             raise KeyError("No such algorithm as" + search_algorithm + "is supported")
         else:
             Crawler.get_link_from_search_set = Crawler.queue_dict[search_algorithm]
+            Crawler.crawling_links_frontier = Crawler.get_link_from_search_set.__self__
 
+        Crawler.links_being_crawled = set()
+        Crawler.links_to_crawl_again = set()
         if start_from_scratch:
-            Crawler.init_metadata_dict()
-            # The current block's dictionary with the websites and words that have been crawled
-            Crawler.pages_dictionary = {}
+            Crawler.init_metadata_dict(visited_set_backend)
+            # The first website starts the first block
+            Crawler.block_writer = None
+            Crawler.open_crawl_log(clear=True)
         else:
             try:
                 Crawler.metadata_dict = np.load(meta.METADATA_DICTIONARY_FILE_PATH, allow_pickle=True).item()
@@ -87,71 +145,231 @@ class Crawler(threading.Thread):
                 assert isinstance(Crawler.metadata_dict, dict)
                 Crawler.total_blocks = Crawler.metadata_dict.get(meta.META_TOTAL_BLOCKS_KEY)
                 Crawler.max_block_size = Crawler.metadata_dict.get(meta.META_BLOCK_SIZE_KEY)
-                Crawler.crawled_links_set = Crawler.metadata_dict.get(meta.META_CRAWLED_LINKS_SET_KEY)
-
-                # The current block's dictionary with the websites and words that have been crawled
-                Crawler.pages_dictionary = np.load(meta.BLOCK_FILE_NAME_PREFIX_PATH + Crawler.total_blocks.__str__() +
-                                                   ".npy", allow_pickle=True).item()
-                # Assert in order to confirm that this is a dictionary before the call of the get() operation
-                assert isinstance(Crawler.pages_dictionary, dict)
-                # Checks if the current block is "full" in order to make a new one
-                if len(Crawler.pages_dictionary) == Crawler.max_block_size:
-                    Crawler.pages_dictionary = {}
+                Crawler.crawled_links_set = Crawler.load_crawled_links_set(visited_set_backend)
+                # The changes of the crawl after its last checkpoint
+                Crawler.replay_crawl_log()
+                Crawler.open_crawl_log(clear=False)
+
+                # The websites are appended to the last block, if it is not "full" (a new block is started after
+                # a last block of the older format, since the older blocks are not appended to)
+                Crawler.block_writer = None
+                last_block_path = my_blocks.get_block_path(Crawler.total_blocks)
+                if Crawler.total_blocks > 0 and os.path.isdir(last_block_path):
+                    Crawler.block_writer = DocumentBlockWriter(last_block_path)
+                    if len(Crawler.block_writer) >= Crawler.max_block_size:
+                        Crawler.close_current_block()
             except FileNotFoundError:
                 print("File " + meta.METADATA_DICTIONARY_FILE_PATH.__str__() +
                       " was not found. Starting crawling from scratch.")
-                Crawler.init_metadata_dict()
-                # The current block's dictionary with the websites and words that have been crawled
-                Crawler.pages_dictionary = {}
+                Crawler.init_metadata_dict(visited_set_backend)
+                # The first website starts the first block
+                Crawler.block_writer = None
+                Crawler.open_crawl_log(clear=True)
 
         Crawler.num_of_links_to_crawl = num_of_links_to_crawl
         Crawler.number_of_threads = number_of_threads
-        Crawler.crawling_links_deque.append(start_url)
+        Crawler.add_links_to_frontier([start_url])
 
-        # If the starting url is already visited then we might not be able to add more new documents
-        if start_url in Crawler.crawled_links_set:
+        # If the starting url is already visited (and the frontier of the previous crawl has no links)
+        # then we might not be able to add more new documents
+        if start_url in Crawler.crawled_links_set and len(Crawler.crawling_links_frontier) == 0:
             return False
         else:
             return True
 
+    # Opens the log of the crawl, the log is cleared when the crawl starts from scratch
+    @staticmethod
+    def open_crawl_log(clear):
+        if Crawler.crawl_log is not None:
+            Crawler.crawl_log.close()
+        Crawler.crawl_log = CrawlLog(meta.CRAWL_LOG_FILE_PATH)
+        if clear:
+            with Crawler.crawl_log.lock:
+                Crawler.crawl_log.clear()
+            if os.path.exists(meta.FRONTIER_FILE_PATH):
+                os.remove(meta.FRONTIER_FILE_PATH)
+
+    # Restores the state of the crawl after its last checkpoint (the visited set is the one of the checkpoint):
+    # the blocks that were started after the checkpoint and the websites that were kept in them are added,
+    # then the links of the log are added to the visited set and to the frontier of the checkpoint.
+    # The links that were being crawled (at the checkpoint or later) and were not crawled are crawled again
+    @staticmethod
+    def replay_crawl_log():
+        records = CrawlLog.read(meta.CRAWL_LOG_FILE_PATH)
+        frontier_links, links_being_crawled = [], []
+        if os.path.exists(meta.FRONTIER_FILE_PATH):
+            with np.load(meta.FRONTIER_FILE_PATH) as frontier_file:
+                frontier_links = frontier_file['links'].tolist()
+                links_being_crawled = frontier_file['links_being_crawled'].tolist()
+
+        # The blocks that were started after the checkpoint (the metadata has the blocks of the checkpoint)
+        Crawler.total_blocks = max([Crawler.total_blocks] + [int(block_number) for block_number
+                                                             in records[CrawlLog.BLOCK_RECORD]])
+        # The websites that were kept after the checkpoint, their links are crawled even if the log lost them
+        first_block, first_document = Crawler.metadata_dict.get(meta.META_CHECKPOINT_POSITION_KEY,
+                                                                (Crawler.total_blocks + 1, 0))
+        kept_links = []
+        for block_number in range(first_block, Crawler.total_blocks + 1):
+            if os.path.isdir(my_blocks.get_block_path(block_number)):
+                kept_links.extend(my_blocks.open_block(block_number).get_urls(
+                    first_document if block_number == first_block else 0))
+
+        crawled_links = set(records[CrawlLog.DONE_RECORD]).union(kept_links)
+        for link in crawled_links:
+            Crawler.crawled_links_set.add(link)
+        Crawler.links_to_crawl_again = set(links_being_crawled).union(records[CrawlLog.RESERVED_RECORD]) - \
+            crawled_links
+        # The links to crawl again were taken from the frontier before the other links
+        Crawler.crawling_links_frontier.put_many(sorted(Crawler.links_to_crawl_again) + frontier_links +
+                                                 records[CrawlLog.FRONTIER_RECORD])
+        print("Crawl resumed from its checkpoint: " + len(Crawler.crawling_links_frontier).__str__() +
+              " links in the frontier, " + len(kept_links).__str__() + " websites kept after the checkpoint, " +
+              len(Crawler.links_to_crawl_again).__str__() + " links to crawl again")
+
+    # Loads the visited set of the previous crawls. The metadata of the older crawls have the set of the crawled links
+    # instead of the visited set's file, their links are added to a new visited set of the given backend
+    @staticmethod
+    def load_crawled_links_set(visited_set_backend=meta.DEFAULT_VISITED_SET_BACKEND):
+        crawled_links_set = Crawler.metadata_dict.pop(meta.META_CRAWLED_LINKS_SET_KEY, None)
+        if crawled_links_set is None:
+            return load_visited_set(meta.VISITED_SET_FILE_PATH)
+        visited_set = create_visited_set(visited_set_backend)
+        for link in crawled_links_set:
+            visited_set.add(link)
+        return visited_set
+
+    # Starts a new block (made from scratch) that the next websites are appended to.
+    # The block is in the log before its directory is made, so a resumed crawl knows all the blocks
     @staticmethod
-    def clear_dictionary_and_save_block_to_disk():
+    def start_new_block():
         Crawler.total_blocks += 1
-        block_file_name = meta.BLOCK_FILE_NAME_PREFIX_PATH + Crawler.total_blocks.__str__() + ".npy"
-        np.save(block_file_name, Crawler.pages_dictionary)
-        Crawler.pages_dictionary.clear()
-        Crawler.pages_dictionary = {}
+        Crawler.crawl_log.append(CrawlLog.BLOCK_RECORD, [Crawler.total_blocks.__str__()], flush=True)
+        Crawler.block_writer = DocumentBlockWriter(my_blocks.get_block_path(Crawler.total_blocks), append=False)
 
+    # Closes the current block, its websites are already on the disk
     @staticmethod
-    def save_last_page_dict():
-        if len(Crawler.pages_dictionary) > 0:
-            Crawler.clear_dictionary_and_save_block_to_disk()
+    def close_current_block():
+        if Crawler.block_writer is not None:
+            Crawler.block_writer.close()
+            Crawler.block_writer = None
 
     @staticmethod
     def update_metadata_file():
         Crawler.metadata_dict.update({meta.META_TOTAL_BLOCKS_KEY: Crawler.total_blocks})
-        Crawler.metadata_dict.update({meta.META_CRAWLED_LINKS_SET_KEY: Crawler.crawled_links_set})
         Crawler.metadata_dict.update({meta.META_BLOCK_SIZE_KEY: Crawler.max_block_size})
-        np.save(meta.METADATA_DICTIONARY_FILE_PATH, Crawler.metadata_dict)
+        # The websites after this position are kept after the checkpoint (the next website starts a new block
+        # if there is no current block)
+        if Crawler.block_writer is None:
+            checkpoint_position = (Crawler.total_blocks + 1, 0)
+        else:
+            checkpoint_position = (Crawler.total_blocks, len(Crawler.block_writer))
+        Crawler.metadata_dict.update({meta.META_CHECKPOINT_POSITION_KEY: checkpoint_position})
+        save_file_atomically(meta.METADATA_DICTIONARY_FILE_PATH, Crawler.metadata_dict)
 
+    # Saves a checkpoint of the crawl, its visited set, its frontier (with the links that are being crawled) and its
+    # metadata. Each file is replaced atomically (renamed), the log is cleared after the files are saved.
+    # The crawl is paused while the checkpoint is saved, so the files and the log have the same state of the crawl
+    @staticmethod
+    def save_checkpoint():
+        checkpoint_start_time = time.time()
+        with Crawler.dictionary_lock, Crawler.crawled_links_lock, Crawler.crawl_log.lock:
+            if Crawler.block_writer is not None:
+                Crawler.block_writer.sync()
+            Crawler.crawled_links_set.save(meta.VISITED_SET_FILE_PATH)
+            save_arrays_file(meta.FRONTIER_FILE_PATH,
+                             links=np.array(Crawler.crawling_links_frontier.get_links(), dtype=str),
+                             links_being_crawled=np.array(sorted(Crawler.links_being_crawled), dtype=str))
+            Crawler.update_metadata_file()
+            Crawler.crawl_log.clear()
+        print("Checkpoint of the crawl saved in %f seconds" % (time.time() - checkpoint_start_time))
+
+    # Takes the link from the frontier to crawl it, returns False if the link is already visited.
+    # Otherwise reserving / marked as visited, in order to avoid collision with other threads
+    @staticmethod
+    def reserve_link(link):
+        with Crawler.crawled_links_lock:
+            if link in Crawler.crawled_links_set and link not in Crawler.links_to_crawl_again:
+                return False
+            Crawler.links_to_crawl_again.discard(link)
+            Crawler.crawled_links_set.add(link)
+            Crawler.links_being_crawled.add(link)
+            Crawler.crawl_log.append(CrawlLog.RESERVED_RECORD, [link])
+        return True
+
+    # Marks the link as crawled, so it is not crawled again if the crawl is resumed
+    @staticmethod
+    def finish_link(link):
+        with Crawler.crawled_links_lock:
+            if link in Crawler.links_being_crawled:
+                Crawler.links_being_crawled.discard(link)
+                Crawler.crawl_log.append(CrawlLog.DONE_RECORD, [link], flush=True)
+
+    # Adds the links that are not visited to the frontier, all of them at once.
+    # The visited set is read without the lock, a link that is visited meanwhile is skipped when it is taken
+    @staticmethod
+    def add_links_to_frontier(links):
+        new_links = [new_link for new_link in links if new_link not in Crawler.crawled_links_set]
+        Crawler.crawling_links_frontier.put_many(new_links)
+        Crawler.crawl_log.append(CrawlLog.FRONTIER_RECORD, new_links)
+
+    # Keeps the website in the current block, returns False if the crawl has enough websites and it was not kept
+    # (the link remains in the links that are being crawled, so it is crawled again if the crawl is resumed)
+    @staticmethod
+    def keep_website(link, title, cleaned_words):
+        with Crawler.dictionary_lock:
+            document_position = Crawler.add_website_content_to_current_block(link, title, cleaned_words)
+            if document_position is None:
+                return False
+            # The link is marked as crawled together with its website, so a checkpoint has both or none of them
+            Crawler.finish_link(link)
+        # The website is sent to the indexing pipeline after the lock is released, since the pipeline waits while
+        # its queue is full and the other threads and the checkpoints need the lock meanwhile. The websites may be
+        # sent out of order, the indexing process reads the websites that it has not got yet from the blocks
+        indexing_pipeline = Crawler.indexing_pipeline
+        if indexing_pipeline is not None:
+            block_number, document_number = document_position
+            indexing_pipeline.add_document(block_number, document_number, link, title, cleaned_words)
+        return True
+
+    # Returns the position of the website in the blocks (block_number, document_number),
+    # None if the crawl has enough websites
     @staticmethod
     def add_website_content_to_current_block(link, title, cleaned_words):
         # Only saving the website if the the number of good links crawled are less than the desired links
         if Crawler.kept_links_crawled_in_session < Crawler.num_of_links_to_crawl:
-            # Updating the dictionary with the content
-            Crawler.pages_dictionary.update({link: (title, cleaned_words)})
+            # Appending the content to the current block
+            if Crawler.block_writer is None:
+                Crawler.start_new_block()
+            Crawler.block_writer.add_document(link, title, cleaned_words)
+            document_position = (Crawler.total_blocks, len(Crawler.block_writer) - 1)
             Crawler.kept_links_crawled_in_session += 1
             print("Kept website Num " + Crawler.kept_links_crawled_in_session.__str__() + ": " + link
                   + " from: " + threading.current_thread().__str__() + '\n')
-            # Checks if the current block is "full" in order to save it to the disk and clear it from the memory
-            if len(Crawler.pages_dictionary) == Crawler.max_block_size:
-                Crawler.clear_dictionary_and_save_block_to_disk()
+            # Checks if the current block is "full" in order to close it, the next website starts a new block
+            if len(Crawler.block_writer) >= Crawler.max_block_size:
+                Crawler.close_current_block()
+            return document_position
+        return None
+
+    # Returns False if the robots.txt of the link's host does not allow the link. Only the politeness frontier
+    # follows the robots.txt files, the robots.txt of each host is fetched the first time that a link of it is crawled
+    @staticmethod
+    def is_allowed_by_robots(session, link):
+        if Crawler.crawling_links_frontier is not Crawler.host_frontier:
+            return True
+        robots_cache = Crawler.host_frontier.robots_cache
+        robots_url = robots_cache.get_missing_robots_url(link)
+        if robots_url is not None:
+            robots_cache.add_robots(link, fetch_robots(session, robots_url))
+        return robots_cache.can_fetch(link)
 
     # Constructor of the class, initialize the thread
     def __init__(self, start_url):
         threading.Thread.__init__(self)
         self.starting_url = start_url
         self.num_of_links_crawled_by_self = 0
+        # Each thread has its own session, that keeps the connections alive and reuses them
+        self.session = create_session()
 
     # The run method start the crawling on this Crawler's object(thread)
     def run(self):
@@ -160,112 +378,133 @@ class Crawler(threading.Thread):
         time.sleep(0.1)
 
         # Crawling while the number of good links crawled are less than the desired links
-        while True:
-            Crawler.dictionary_lock.acquire()
-            if Crawler.kept_links_crawled_in_session >= Crawler.num_of_links_to_crawl:
-                Crawler.dictionary_lock.release()
-                break
-
-            # If the dequeue (the set of the links that the crawler is searching)
-            # is currently empty, free the locks and skip this loop until another thread adds links to the set
-            Crawler.crawling_links_deque_lock.acquire()
-            if len(Crawler.crawling_links_deque) == 0:
-                Crawler.dictionary_lock.release()
-                Crawler.crawling_links_deque_lock.release()
-
-                # Thread sleep-delay to allow time to another thread to add to the crawling_links_deque
-                time.sleep(2)
-                Crawler.count_consecutive_empty_queue_accesses += 1
-                # Allowing an upper bound of maximum consecutive times that the queue will be empty for the threads
-                if Crawler.count_consecutive_empty_queue_accesses >= number_of_threads * 2:
-                    print(threading.current_thread().__str__() + " is released, "
-                                                                 "too many times tried to access empty queue. "
-                                                                 "No out-links.")
+        while Crawler.kept_links_crawled_in_session < Crawler.num_of_links_to_crawl:
+            # Waiting for a link, the frontier wakes up the thread when another thread adds links to it
+            try:
+                link = Crawler.get_link_from_search_set(timeout=meta.FRONTIER_WAIT_TIMEOUT)
+            except queue.Empty:
+                if len(Crawler.crawling_links_frontier) > 0:
+                    # The politeness frontier has links, but no host is ready yet, waiting until the next host is ready
+                    if Crawler.crawling_links_frontier is Crawler.host_frontier:
+                        time.sleep(min(Crawler.host_frontier.get_waiting_time(), meta.MIN_HOST_DELAY))
+                    continue
+                # If no other thread is crawling, no more out-links will be added
+                if Crawler.links_in_progress.value == 0:
+                    print(threading.current_thread().__str__() + " is released, the frontier is empty. No out-links.")
                     break
                 continue
-            else:
-                Crawler.count_consecutive_empty_queue_accesses = 0
 
-            link = Crawler.get_link_from_search_set()
-            Crawler.crawling_links_deque_lock.release()
-
-            # If this link has already been crawled free the locks and
-            # skip this loop in order to find an alternative website
-            if link in Crawler.crawled_links_set:
-                Crawler.dictionary_lock.release()
+            # If this link has already been crawled skip it in order to find an alternative website
+            if not Crawler.reserve_link(link):
                 continue
 
-            #  Reserving / marked as visited, in order to avoid collision with other threads
-            Crawler.crawled_links_set.add(link)
-            Crawler.dictionary_lock.release()
-
             # Increasing number of links checked
-            Crawler.links_crawled_in_session += 1
+            Crawler.links_crawled_in_session.increment()
             # Increasing self(thread's) number of links checked
             self.num_of_links_crawled_by_self += 1
 
-            # Trying to crawl on the website
-            # If crawling on that specific website is failed, we are not deleting from the dictionary
-            # In order to not to crawl again on that specific website (The the empty content links are deleter later on)
-            try:
-                # First, checking for the header only, in order to avoid crawling on this website
-                # if it has non-text content type, or it's length is tremendously big
-                check_endpoint_header(link)
-                # If no exception/error was raised so far,
-                # Commit a get-request, raises a timeout if 5 seconds are passed without response from the server
-                html_text = requests.get(link, timeout=(5, 5), allow_redirects=True).text
-            except(Exception, ssl.SSLWantReadError, requests.exceptions.Timeout, requests.exceptions.MissingSchema,
-                   requests.exceptions.ConnectionError, requests.exceptions.InvalidURL,
-                   requests.exceptions.InvalidSchema, requests.exceptions.TooManyRedirects) as e:
-                print("Website " + link + " was not saved: " + e.__str__() + '\n')
-                continue  # Continue crawling in other websites
-
-            # Try to clean the text and keep only the useful words in a list.
-            # If most of the words of this text are not in the English vocabulary,
-            # an exception will be caught in order to avoid saving the text of that website
+            Crawler.links_in_progress.increment()
+            link_crawled = False
             try:
-                # Getting the title along with the cleaned words
-                title, cleaned_words = Crawler.text_processor.get_cleaned_doc(html_text)
-            except (Exception, my_tp.lang_detect_exception.LangDetectException) as e:
-                print("Website " + link + " was not saved: " + e.__str__() + '\n')
-                continue  # Continue crawling in other websites
-
-            # If the website does not have a title, the one used is the original link
-            if title is None:
-                title = link
-
-            Crawler.dictionary_lock.acquire()
-            Crawler.add_website_content_to_current_block(link, title, cleaned_words)
-            Crawler.dictionary_lock.release()
-
-            # Finding the new links that start with "https" only
-            list_of_links = TextProcessor.get_https_links_from_text(html_text)
-
-            # If the search algorithm is DFS then reserve the order of the list in order to
-            # get the expected search order in the search-set
-            if Crawler.get_link_from_search_set == Crawler.crawling_links_deque.pop:
-                list_of_links.reverse()
-
-            # Adding only the new links (the ones that don't exist in the dictionary set)
-            for new_link in list_of_links:
-                Crawler.crawling_links_deque_lock.acquire()
-                if new_link not in Crawler.crawled_links_set:
-                    Crawler.crawling_links_deque.append(new_link)
-                Crawler.crawling_links_deque_lock.release()
+                link_crawled = self.crawl_link(link)
+            finally:
+                Crawler.links_in_progress.decrement()
+                if link_crawled:
+                    Crawler.finish_link(link)
 
+        self.session.close()
         print(threading.current_thread().__str__() + " has finished. Thread checked "
               + self.num_of_links_crawled_by_self.__str__() + " websites" + '\n')
 
+    # Crawls on the website of the link, saves its content in the current block and adds its out-links to the frontier.
+    # Returns False if the website was not kept because the crawl has enough websites, True otherwise
+    def crawl_link(self, link):
+        if not Crawler.is_allowed_by_robots(self.session, link):
+            print("Website " + link + " was not saved: It is not allowed by robots.txt" + '\n')
+            return True
 
-# Performs a GET-request for the header only in order to avoid the crawling on this website
-# if it has non-text content type, or it's length is tremendously big
-def check_endpoint_header(url):
-    # Get request for the header only and the important thing is the setting allow_redirects=True,
-    # in order to get the final website's header in case of redirection.
-    # Raises a timeout if 5 seconds are passed without response from the server
-    head_response = requests.head(url, timeout=(5, 5), allow_redirects=True)
-    header = head_response.headers
-
+        # Trying to crawl on the website
+        # If crawling on that specific website is failed, we are not deleting from the dictionary
+        # In order to not to crawl again on that specific website (The the empty content links are deleter later on)
+        try:
+            html_text = fetch_website(self.session, link)
+        except(Exception, ssl.SSLWantReadError, requests.exceptions.Timeout, requests.exceptions.MissingSchema,
+               requests.exceptions.ConnectionError, requests.exceptions.InvalidURL,
+               requests.exceptions.InvalidSchema, requests.exceptions.TooManyRedirects) as e:
+            print("Website " + link + " was not saved: " + e.__str__() + '\n')
+            return True  # Continue crawling in other websites
+
+        # Try to clean the text and keep only the useful words in a list.
+        # If most of the words of this text are not in the English vocabulary,
+        # an exception will be caught in order to avoid saving the text of that website
+        try:
+            if Crawler.parser_pool is None:
+                # Getting the title along with the cleaned words
+                title, cleaned_words = Crawler.text_processor.get_cleaned_doc(html_text)
+                # Finding the new links that start with the link scheme ("https") only
+                list_of_links = TextProcessor.get_links_from_text(html_text, Crawler.link_scheme)
+            else:
+                # The same, in a parser process (the thread waits if the pool is full)
+                title, cleaned_words, list_of_links = Crawler.parser_pool.parse(html_text, Crawler.link_scheme)
+        except (Exception, my_tp.lang_detect_exception.LangDetectException) as e:
+            print("Website " + link + " was not saved: " + e.__str__() + '\n')
+            return True  # Continue crawling in other websites
+
+        # If the website does not have a title, the one used is the original link
+        if title is None:
+            title = link
+
+        # If the search algorithm is DFS then reserve the order of the list in order to
+        # get the expected search order in the search-set
+        if Crawler.get_link_from_search_set == Crawler.crawling_links_stack.pop:
+            list_of_links.reverse()
+
+        # Adding only the new links (the ones that don't exist in the dictionary set), all of them at once.
+        # The out-links are added before the website is kept, so a kept website has its out-links in the log
+        Crawler.add_links_to_frontier(list_of_links)
+
+        return Crawler.keep_website(link, title, cleaned_words)
+
+
+# Returns a session with pools of keep-alive connections, so the requests to the same host reuse the same
+# connection (without a new TCP and TLS handshake). Each host has at most MAX_CONNECTIONS_PER_HOST connections
+def create_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=meta.MAX_POOLED_HOSTS,
+                                            pool_maxsize=meta.MAX_CONNECTIONS_PER_HOST, pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Commits one streamed get-request and returns the html text of the website. The important thing is the setting
+# allow_redirects=True, in order to get the final website's header in case of redirection.
+# The header is checked before the body is read, in order to avoid the crawling on this website
+# if it has non-text content type, or it's length is tremendously big.
+# Raises a timeout if 5 seconds are passed without response from the server
+def fetch_website(session, url):
+    with session.get(url, timeout=(5, 5), allow_redirects=True, stream=True) as response:
+        check_header(response.headers)
+        # If no exception/error was raised so far, reading the body
+        return response.text
+
+
+# Returns the text of the robots.txt, or an empty text (everything is allowed) if the host has no robots.txt
+def fetch_robots(session, robots_url):
+    try:
+        response = session.get(robots_url, timeout=(5, 5), allow_redirects=True)
+    except Exception:
+        return ""
+    if response.status_code in (401, 403):
+        # The host does not allow the access to its robots.txt, so nothing of the host is allowed
+        return "User-agent: *\nDisallow: /"
+    if response.status_code != 200:
+        return ""
+    return response.text
+
+
+# Raises an exception if the header is of a website with non-text content type, or tremendously big length
+def check_header(header):
     # Checks if the content-type is not text or unknown in order to avoid the crawling on this website
     content_type = header.get('content-type')
     if content_type is None:
@@ -281,47 +520,104 @@ def check_endpoint_header(url):
         raise requests.exceptions.InvalidSchema("Website Content error: Size of " + content_length + " is too big")
 
 
-# Loading args in variables
-
-start = time.time()
-
-starting_url = sys.argv[1]
-num_of_links = int(sys.argv[2])
-start_from_scratch = sys.argv[3]
-number_of_threads = int(sys.argv[4])
-algorithm = sys.argv[5]
-
-if start_from_scratch == '1':
-    start_from_scratch = True
-else:
-    start_from_scratch = False
-
-# Global variables
-crawler_threads = []
-
-starting_url_not_visited = Crawler.init_static_variables(start_url=starting_url, num_of_links_to_crawl=num_of_links,
-                                                         start_from_scratch=start_from_scratch, search_algorithm=algorithm,
-                                                         number_of_threads=number_of_threads)
-
-if starting_url_not_visited:
-    crawl_start_time = time.time()
-    for i in range(number_of_threads):
-        # Notice that all the threads start from the same starting url, but only one will crawl this website
-        crawler = Crawler(start_url=starting_url)
-        crawler.start()
-        crawler_threads.append(crawler)
-    for crawler in crawler_threads:
-        crawler.join()
-
-    print("Crawling time: %s seconds" % format((time.time() - crawl_start_time), ".2f"))
-    print("Total Number of web-pages checked or visited in this session were: " + Crawler.links_crawled_in_session.__str__())
-    print("Number of web-pages kept in this session are: " + Crawler.kept_links_crawled_in_session.__str__())
-    print("Total time to crawl: ", (time.time() - start))
-
-    Crawler.save_last_page_dict()
-    Crawler.update_metadata_file()
-else:
-    print(starting_url + " is already visited. You can run the crawler again "
-                         "and give a non-visited website to start from.")
-
-
+# Saves the stem cache as the table of the words and their stems, for the next crawls and the query processor
+def save_stem_cache():
+    stem_cache_stats = TextProcessor.stem_cache.get_stats()
+    print("Stem cache: %d words, %d hits, %d misses, hit rate %.3f" % (
+        stem_cache_stats["size"], stem_cache_stats["hits"], stem_cache_stats["misses"], stem_cache_stats["hit_rate"]))
+    TextProcessor.stem_cache.save(meta.STEM_TABLE_FILE_PATH)
+
+
+# Waits for the indexing pipeline (if any) to index the last websites of the crawl
+def close_indexing_pipeline():
+    if Crawler.indexing_pipeline is not None:
+        indexing_start_time = time.time()
+        Crawler.indexing_pipeline.close()
+        Crawler.indexing_pipeline = None
+        print("Time needed for the last websites to be indexed: %f seconds" % (time.time() - indexing_start_time))
+
+
+# Crawls with the given number of threads and saves the crawled websites in the blocks' files.
+# The html texts are cleaned by parser_processes processes (by default one for each cpu), or by the threads if it is 0
+# (by default too, if there is only one cpu, since the processes would only add the cost of sending the texts).
+# If stream_to_index is True the kept websites are indexed while crawling (the index is made from scratch
+# if the crawl starts from scratch), so they are searchable a few seconds after they are crawled
+def crawl(starting_url, num_of_links, start_from_scratch, number_of_threads, algorithm,
+          visited_set_backend=meta.DEFAULT_VISITED_SET_BACKEND, parser_processes=None,
+          parser_backend=meta.DEFAULT_PARSER_BACKEND, stream_to_index=False):
+    start = time.time()
+
+    # Global variables
+    crawler_threads = []
+
+    starting_url_not_visited = Crawler.init_static_variables(start_url=starting_url, num_of_links_to_crawl=num_of_links,
+                                                             start_from_scratch=start_from_scratch,
+                                                             search_algorithm=algorithm,
+                                                             number_of_threads=number_of_threads,
+                                                             visited_set_backend=visited_set_backend)
+
+    if starting_url_not_visited:
+        Crawler.text_processor = TextProcessor(stemming=True, parser_backend=parser_backend)
+        # Warm start of the stem cache, with the words that were stemmed in the previous crawls
+        TextProcessor.stem_cache.load(meta.STEM_TABLE_FILE_PATH)
+        if parser_processes is None and os.cpu_count() == 1:
+            parser_processes = 0
+        if parser_processes != 0:
+            Crawler.parser_pool = ParserPool(parser_processes, parser_backend)
+        if stream_to_index:
+            Crawler.indexing_pipeline = IndexingPipeline(new_index=start_from_scratch)
+
+        crawl_start_time = time.time()
+        for i in range(number_of_threads):
+            # Notice that all the threads start from the same starting url, but only one will crawl this website
+            crawler = Crawler(start_url=starting_url)
+            crawler.start()
+            crawler_threads.append(crawler)
+        # The checkpoints of the crawl are saved in the background, a crawl that is stopped is resumed from them
+        checkpointer = Checkpointer(Crawler.save_checkpoint)
+        checkpointer.start()
+        try:
+            for crawler in crawler_threads:
+                crawler.join()
+        except KeyboardInterrupt:
+            # The threads stop after the websites that they are crawling, the websites that are not kept any more
+            # are crawled again when the crawl is resumed
+            print("The crawl is stopped, waiting for the threads to finish their websites")
+            Crawler.num_of_links_to_crawl = Crawler.kept_links_crawled_in_session
+            for crawler in crawler_threads:
+                crawler.join()
+        checkpointer.stop()
+        if Crawler.parser_pool is not None:
+            Crawler.parser_pool.shutdown()
+            Crawler.parser_pool = None
+
+        print("Crawling time: %s seconds" % format((time.time() - crawl_start_time), ".2f"))
+        print("Total Number of web-pages checked or visited in this session were: " +
+              Crawler.links_crawled_in_session.__str__())
+        print("Number of web-pages kept in this session are: " + Crawler.kept_links_crawled_in_session.__str__())
+        print("Total time to crawl: ", (time.time() - start))
+
+        Crawler.close_current_block()
+        Crawler.save_checkpoint()
+        save_stem_cache()
+        close_indexing_pipeline()
+    else:
+        print(starting_url + " is already visited. You can run the crawler again "
+                             "and give a non-visited website to start from.")
+
+
+if __name__ == '__main__':
+    # Loading args in variables, the visited set backend of a new crawl, the number of the parser processes
+    # (0 for parsing in the threads), the parser backend and the indexing while crawling (1 or 0) are optional
+    starting_url_arg = sys.argv[1]
+    num_of_links_arg = int(sys.argv[2])
+    start_from_scratch_arg = sys.argv[3] == '1'
+    number_of_threads_arg = int(sys.argv[4])
+    algorithm_arg = sys.argv[5]
+    visited_set_backend_arg = sys.argv[6] if len(sys.argv) > 6 else meta.DEFAULT_VISITED_SET_BACKEND
+    parser_processes_arg = int(sys.argv[7]) if len(sys.argv) > 7 else None
+    parser_backend_arg = sys.argv[8] if len(sys.argv) > 8 else meta.DEFAULT_PARSER_BACKEND
+    stream_to_index_arg = len(sys.argv) > 9 and sys.argv[9] == '1'
+
+    crawl(starting_url_arg, num_of_links_arg, start_from_scratch_arg, number_of_threads_arg, algorithm_arg,
+          visited_set_backend_arg, parser_processes_arg, parser_backend_arg, stream_to_index_arg)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import metadata as meta
+
+import time
+import heapq
+import queue
+import itertools
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+
+# Returns the host of the link (in lower case), the links of the same host are in the same queue of the frontier
+def get_host(link):
+    return urlsplit(link).netloc.lower()
+
+
+# Keeps the robots.txt rules of each host. The robots.txt files are fetched by the crawlers (each of them with its
+# own client), this class only parses them and answers if a link is allowed and what is the crawl-delay of a host
+class RobotsCache:
+
+    def __init__(self, user_agent=meta.ROBOTS_USER_AGENT):
+        self.user_agent = user_agent
+        # { host : RobotFileParser of the host's robots.txt }
+        self.robots_parsers = {}
+
+    # Returns the url of the robots.txt of the link's host, or None if the robots.txt of the host is already known
+    def get_missing_robots_url(self, link):
+        if get_host(link) in self.robots_parsers:
+            return None
+        split_link = urlsplit(link)
+        return split_link.scheme + "://" + split_link.netloc + "/robots.txt"
+
+    # Parses the robots.txt text of the link's host (an empty text allows every link of the host)
+    def add_robots(self, link, robots_text):
+        robots_parser = RobotFileParser()
+        robots_parser.parse(robots_text.splitlines())
+        self.robots_parsers[get_host(link)] = robots_parser
+
+    # Returns True if the robots.txt of the link's host allows the link (or if it is not known yet)
+    def can_fetch(self, link):
+        robots_parser = self.robots_parsers.get(get_host(link))
+        return robots_parser is None or robots_parser.can_fetch(self.user_agent, link)
+
+    # Returns the crawl-delay of the host's robots.txt in seconds (0 if it has none, or if it is not known yet)
+    def get_crawl_delay(self, host):
+        robots_parser = self.robots_parsers.get(host)
+        if robots_parser is None:
+            return 0
+        crawl_delay = robots_parser.crawl_delay(self.user_agent)
+        if crawl_delay is None:
+            # The request-rate is the number of requests that are allowed in a number of seconds
+            request_rate = robots_parser.request_rate(self.user_agent)
+            if request_rate is None or request_rate.requests == 0:
+                return 0
+            crawl_delay = request_rate.seconds / request_rate.requests
+        return min(float(crawl_delay), meta.MAX_CRAWL_DELAY)
+
+
+# Thread-safe FIFO queue of links, that can add all the out-links of a page at once (with one lock acquisition)
+class LinkQueue(queue.Queue):
+
+    def __len__(self):
+        return self.qsize()
+
+    def put_many(self, links):
+        if len(links) == 0:
+            return
+        # The queue has no maximum size, so it is never full
+        with self.not_full:
+            for link in links:
+                self._put(link)
+            self.unfinished_tasks += len(links)
+            self.not_empty.notify(len(links))
+
+    # Returns the next link, waiting for at most timeout seconds (raises queue.Empty if there are no links)
+    def pop(self, timeout=None):
+        return self.get(timeout=timeout)
+
+    # Returns a copy of the links that are waiting, in their order (for the checkpoints of the crawl)
+    def get_links(self):
+        with self.mutex:
+            return list(self.queue)
+
+
+# Thread-safe LIFO queue (stack) of links
+class LinkStack(LinkQueue, queue.LifoQueue):
+    pass
+
+
+# Frontier with a queue of links for each host. The hosts are kept in a priority queue (heap) by the time
+# that they are ready to be requested again, so each pop gives a link of the host that is ready the longest time.
+# After a link of a host is given, the host is not ready again before its delay has passed (the minimum delay
+# or the crawl-delay of its robots.txt, the biggest of them). The links of each host are given in FIFO order.
+# It has the put_many, pop and len operations of the LinkQueue, so the crawlers can use it the same way
+class HostFrontier:
+
+    def __init__(self, min_delay=meta.MIN_HOST_DELAY, robots_cache=None):
+        self.min_delay = min_delay
+        self.robots_cache = RobotsCache() if robots_cache is None else robots_cache
+        # { host : deque with the links of the host that are waiting }
+        self.host_queues = {}
+        # Heap of (ready time, insertion counter, host) for each host that has links waiting
+        self.ready_hosts_heap = []
+        # The counter breaks the ties of the ready times, so the hosts with the same ready time are given in order
+        self.host_counter = itertools.count()
+        # { host : the time that the host can be requested again }
+        self.next_request_times = {}
+        self.total_links = 0
+        # The condition that the threads wait on, until a host is ready or new links are added
+        self.links_changed = threading.Condition()
+
+    def __len__(self):
+        return self.total_links
+
+    # Returns the delay between two requests to the host
+    def get_host_delay(self, host):
+        return max(self.min_delay, self.robots_cache.get_crawl_delay(host))
+
+    def put_many(self, links):
+        with self.links_changed:
+            for link in links:
+                self.append(link)
+            self.links_changed.notify_all()
+
+    # Adds a link, the lock of links_changed has to be held
+    def append(self, link):
+        host = get_host(link)
+        host_queue = self.host_queues.get(host)
+        if host_queue is None:
+            host_queue = deque()
+            self.host_queues[host] = host_queue
+            # The host was not in the heap, since it had no links waiting
+            heapq.heappush(self.ready_hosts_heap, (self.next_request_times.get(host, 0), next(self.host_counter), host))
+        host_queue.append(link)
+        self.total_links += 1
+
+    # Returns a link of the host that is ready the longest time, waiting for at most timeout seconds
+    # until a host is ready (raises queue.Empty if no host is ready in time)
+    def pop(self, timeout=None):
+        end_time = None if timeout is None else time.time() + timeout
+        with self.links_changed:
+            while True:
+                now = time.time()
+                waiting_time = None if len(self.ready_hosts_heap) == 0 else self.ready_hosts_heap[0][0] - now
+                if waiting_time is not None and waiting_time <= 0:
+                    return self.pop_ready_link(now)
+                if end_time is not None:
+                    if end_time <= now:
+                        raise queue.Empty
+                    waiting_time = end_time - now if waiting_time is None else min(waiting_time, end_time - now)
+                self.links_changed.wait(waiting_time)
+
+    # Removes and returns a link of the first host of the heap, the lock of links_changed has to be held
+    def pop_ready_link(self, now):
+        host = self.ready_hosts_heap[0][2]
+        host_queue = self.host_queues[host]
+        link = host_queue.popleft()
+        self.total_links -= 1
+        self.next_request_times[host] = now + self.get_host_delay(host)
+        if len(host_queue) == 0:
+            # The host leaves the heap until new links of it are appended
+            del self.host_queues[host]
+            heapq.heappop(self.ready_hosts_heap)
+        else:
+            heapq.heapreplace(self.ready_hosts_heap, (self.next_request_times[host], next(self.host_counter), host))
+        return link
+
+    # Returns a copy of the links that are waiting, the links of each host in their order
+    def get_links(self):
+        with self.links_changed:
+            return [link for host_queue in self.host_queues.values() for link in host_queue]
+
+    # Returns the seconds until the next host is ready (0 if a host is ready now or if there are no links)
+    def get_waiting_time(self):
+        with self.links_changed:
+            if len(self.ready_hosts_heap) == 0:
+                return 0
+            return max(0, self.ready_hosts_heap[0][0] - time.time())
@@ -1,188 +1,549 @@
 # -*- coding: utf-8 -*-
 import metadata as meta
+from my_postings import PostingsIndex
+import my_segments
+import my_blocks
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import math
-import threading
 import time
 import sys
+import os
 import queue
+import signal
+import shutil
+import tempfile
+import itertools
+import threading
+import multiprocessing
 
 
-class InvertedIndexer(threading.Thread):
+class InvertedIndexer:
     # Static-class variables
-    indexer = None
     total_document_blocks = None
-    document_blocks_read = 0
-    documents_metadata = {}
+    max_block_size = None
     new_documents_found = 0
-    document_queue = queue.Queue()
-
-    # Locks for global(static) variables
-    lock_indexer = threading.Lock()
-    lock_documents_data = threading.Lock()
-    lock_queue = threading.Lock()
+    # Dictionary with the number of documents of each block that are already indexed { block_number : documents }
+    # The crawler only adds documents at the end of a block, so only the documents after these are indexed
+    indexed_blocks = {}
+    # The number of shards of the index (0 if the index is not sharded), the documents of each block
+    # are indexed in one of the shards
+    number_of_shards = 0
 
     # Initialising indexer and it's static variables for the indexer
+    # If number_of_shards is given the index is made from scratch when it doesn't have that number of shards
+    # (0 for an index that is not sharded), else a new index is not sharded and an existing index keeps its shards
     @staticmethod
-    def init_indexer(new_indexer=True):
+    def init_indexer(new_indexer=True, number_of_shards=None):
         # First we will be loading the first block with documents/websites
         metadata_dict = np.load(meta.METADATA_DICTIONARY_FILE_PATH, allow_pickle=True).item()
         # Assert in order to confirm that this is a dictionary before the call of the get() operation
         assert isinstance(metadata_dict, dict)
         # Get the total amount of document blocks to read from
         InvertedIndexer.total_document_blocks = metadata_dict.get(meta.META_TOTAL_BLOCKS_KEY)
+        InvertedIndexer.max_block_size = metadata_dict.get(meta.META_BLOCK_SIZE_KEY)
+        return InvertedIndexer.open_index(new_indexer, number_of_shards)
 
+    # Opens the index (its shards and the documents of the blocks that are indexed), or makes it from scratch
+    # when new_indexer is True, with the same parameters as the init_indexer
+    @staticmethod
+    def open_index(new_indexer=True, number_of_shards=None):
         # Variable that holds the boolean value that determines if a new inverted indexer will be made or not
         create_new_indexer = new_indexer
 
         # Check if we start over or we start from existed indexer
         if not create_new_indexer:
-            try:
-                InvertedIndexer.indexer = np.load(meta.INVERTED_INDEXER_FILE_PATH, allow_pickle=True).item()
-                InvertedIndexer.documents_metadata = np.load(meta.DOC_METADATA_FILE_PATH, allow_pickle=True).item()
-            except FileNotFoundError:
-                print("File " + meta.INVERTED_INDEXER_FILE_PATH.__str__() +
+            if os.path.exists(my_segments.get_manifest_path()):
+                InvertedIndexer.number_of_shards = my_segments.get_number_of_shards()
+                if number_of_shards is not None and number_of_shards != InvertedIndexer.number_of_shards:
+                    print("The index has " + InvertedIndexer.number_of_shards.__str__() + " shards instead of " +
+                          number_of_shards.__str__() + ". Starting inverted-indexer from scratch.")
+                    create_new_indexer = True
+                else:
+                    # The indexed blocks of all the shards (of the index itself if it is not sharded)
+                    InvertedIndexer.indexed_blocks = {}
+                    for shard_path in my_segments.get_shard_paths():
+                        manifest = my_segments.load_manifest(shard_path)
+                        InvertedIndexer.indexed_blocks.update(manifest[meta.MANIFEST_INDEXED_BLOCKS_KEY])
+            else:
+                print("File " + my_segments.get_manifest_path().__str__() +
                       " was not found. Starting inverted-indexer from scratch.")
                 create_new_indexer = True
 
         if create_new_indexer:
-            InvertedIndexer.indexer = {}
+            # Deleting the segments of the old index
+            InvertedIndexer.number_of_shards = 0 if number_of_shards is None else number_of_shards
+            my_segments.clear_sharded_index(InvertedIndexer.number_of_shards)
+            InvertedIndexer.indexed_blocks = {}
 
         # Returns True or False in order to make the inverted indexer from scratch again or not
         return create_new_indexer
 
+    # Returns the numbers of the blocks that have documents which are not indexed yet
+    @staticmethod
+    def get_blocks_to_index():
+        return [block_number for block_number in range(1, InvertedIndexer.total_document_blocks + 1)
+                if InvertedIndexer.indexed_blocks.get(block_number, 0) < InvertedIndexer.max_block_size]
+
+    # Returns the new documents (url, (title, words)) of a block and the number of all the documents of the block
     @staticmethod
-    def get_frequency_dict(term_list):
+    def get_new_documents(block_number, documents_to_skip):
+        block = InvertedIndexer.load_block(block_number)
+        return block.get_documents(documents_to_skip), len(block)
+
+    # Returns the positions of each term in the list { term : [position, ...] },
+    # the frequency of a term is the number of its positions
+    @staticmethod
+    def get_positions_dict(term_list):
         # Creating an empty dictionary
-        freq_dict = {}
-        for item in term_list:
-            if item in freq_dict:
-                freq_dict[item] += 1
+        positions_dict = {}
+        for position, item in enumerate(term_list):
+            if item in positions_dict:
+                positions_dict[item].append(position)
             else:
-                freq_dict[item] = 1
-        return freq_dict
-
-    def __init__(self):
-        threading.Thread.__init__(self)
-        self.docs_processed = 0
-
-    # Method that creates the indexer
-    def run(self):
-        print(threading.current_thread().__str__() + "has started" + '\n')
-        # Thread sleep-delay before each of the thread's FIRST start only
-        time.sleep(0.1)
-
-        # Running until all documents are checked
-        while True:
-            InvertedIndexer.lock_queue.acquire()
-            # Checks if the queue is empty or not in order to continue and get a document/website from it
-            if InvertedIndexer.document_queue.empty():
-                # If the queue is empty try to load another block of documents
-                if InvertedIndexer.document_blocks_read != InvertedIndexer.total_document_blocks:
-                    print("Loading block " + (InvertedIndexer.document_blocks_read + 1).__str__()
-                          + " on indexer from disk")
-                    next_block_file = (InvertedIndexer.document_blocks_read + 1).__str__() + ".npy"
-                    pages_dictionary = np.load(meta.BLOCK_FILE_NAME_PREFIX_PATH + next_block_file,
-                                               allow_pickle=True).item()
-                    InvertedIndexer.document_blocks_read += 1
-                    # Assert in order to confirm that this is a dictionary before the call of the get() operation
-                    assert isinstance(pages_dictionary, dict)
-                    # Re-filling the queue
-                    for url, terms in pages_dictionary.items():
-                        pair = (url, terms)
-                        InvertedIndexer.document_queue.put(pair)
-                    pages_dictionary.clear()
-                else:
-                    # If all the blocks of documents are read the indexer has been completed
-                    InvertedIndexer.lock_queue.release()
-                    break
-
-            doc, (title, words) = InvertedIndexer.document_queue.get()
-            InvertedIndexer.lock_queue.release()
-
-            # Checks to find only unvisited documents
-            # (in the case of running the algorithm for another time after the inverted dictionary was already made)
-            InvertedIndexer.lock_documents_data.acquire()
-            if doc in InvertedIndexer.documents_metadata.keys():
-                InvertedIndexer.lock_documents_data.release()
+                positions_dict[item] = [position]
+        return positions_dict
+
+    # Returns the max_freq and Ld of a document from the frequencies of its words
+    @staticmethod
+    def get_max_freq_and_ld(word_freq_dict):
+        if len(word_freq_dict.values()) != 0:
+            max_freq = max(word_freq_dict.values())
+            #  The length of the vectors of the document
+            ld = math.sqrt(sum([x ** 2 for x in word_freq_dict.values()])) / max_freq
+        else:
+            max_freq = 0
+            ld = 0
+        return max_freq, ld
+
+    # Returns the postings (term id, document id, frequency) of the documents from the token ids of their words
+    # (the tokens of the document i are the tokens[doc_offsets[i]:doc_offsets[i + 1]]),
+    # sorted by the document id and then by the term id
+    @staticmethod
+    def get_token_postings(doc_offsets, tokens):
+        vocabulary_size = int(tokens.max()) + 1 if len(tokens) > 0 else 1
+        token_doc_ids = np.repeat(np.arange(len(doc_offsets) - 1, dtype=np.int64), np.diff(doc_offsets))
+        # Counting the (document, term) pairs of the tokens
+        pairs, posting_freqs = np.unique(token_doc_ids * vocabulary_size + tokens, return_counts=True)
+        return pairs % vocabulary_size, pairs // vocabulary_size, posting_freqs
+
+    # Returns the position of each token in its document (the tokens of the documents are given with the term id of
+    # each token), sorted by the term id, then by the document and then by the position, like the saved positions
+    @staticmethod
+    def get_token_positions(doc_offsets, token_term_ids):
+        token_positions = np.arange(len(token_term_ids)) - np.repeat(doc_offsets[:-1], np.diff(doc_offsets))
+        # The tokens are already sorted by the document and then by the position
+        return token_positions[np.argsort(token_term_ids, kind='stable')]
+
+    # Returns the max_freq and Ld of each document from the postings (sorted by the document id) of the documents,
+    # the same as the get_max_freq_and_ld of each document
+    @staticmethod
+    def get_documents_max_freq_and_ld(posting_doc_ids, posting_freqs, number_of_documents):
+        doc_max_freq = np.zeros(number_of_documents, dtype=np.int64)
+        doc_ld = np.zeros(number_of_documents, dtype=np.float64)
+        if len(posting_doc_ids) > 0:
+            doc_ids, doc_starts = np.unique(posting_doc_ids, return_index=True)
+            doc_max_freq[doc_ids] = np.maximum.reduceat(posting_freqs, doc_starts)
+            #  The length of the vectors of the documents
+            doc_ld[doc_ids] = np.sqrt(np.add.reduceat(posting_freqs ** 2, doc_starts)) / doc_max_freq[doc_ids]
+        return doc_max_freq, doc_ld
+
+    # Loads a block of documents from the disk (a block of the columnar format or a pickled block of the older format)
+    @staticmethod
+    def load_block(block_number):
+        print("Loading block " + block_number.__str__() + " on indexer from disk")
+        return my_blocks.open_block(block_number)
+
+    # Indexes the new documents of a block (the ones after the first documents_to_skip documents)
+    # into a partial index that is saved in partial_index_path.
+    # The postings are counted from the token ids of the block's columns, without a python object for each word.
+    # It runs in a worker process without sharing anything with the other workers,
+    # returns the number of new documents that were found in the block and the number of all its documents
+    @staticmethod
+    def index_block(block_number, documents_to_skip, partial_index_path):
+        block = InvertedIndexer.load_block(block_number)
+
+        # The documents table of the partial index, the id of a document is its position in the lists
+        urls = block.get_urls(documents_to_skip)
+        titles = block.get_titles(documents_to_skip)
+        # The term id (in the block's vocabulary), document id and frequency of each posting of the partial index
+        doc_offsets, tokens = block.get_tokens(documents_to_skip)
+        posting_term_ids, posting_doc_ids, posting_freqs = InvertedIndexer.get_token_postings(doc_offsets, tokens)
+        doc_max_freq, doc_ld = InvertedIndexer.get_documents_max_freq_and_ld(posting_doc_ids, posting_freqs,
+                                                                            len(urls))
+
+        # The sorted term dictionary of the partial index, only the words of the vocabulary that are in the documents
+        block_term_ids, posting_term_ids = np.unique(posting_term_ids, return_inverse=True)
+        block_terms = np.array(block.get_vocabulary(block_term_ids), dtype=str)
+        terms_order = np.argsort(block_terms)
+        term_ids = np.zeros(len(terms_order), dtype=np.int64)
+        term_ids[terms_order] = np.arange(len(terms_order))
+        positions = None
+        if meta.BUILD_POSITIONAL_POSTINGS:
+            positions = InvertedIndexer.get_token_positions(doc_offsets,
+                                                            term_ids[np.searchsorted(block_term_ids, tokens)])
+
+        PostingsIndex.save_postings(partial_index_path, block_terms[terms_order], term_ids[posting_term_ids.ravel()],
+                                    posting_doc_ids, posting_freqs, urls, titles, doc_ld, doc_max_freq, positions)
+        return len(urls), len(block)
+
+    # Indexes the new documents of the blocks in different processes, each block into its own partial index.
+    # Returns the paths of the partial indexes
+    @staticmethod
+    def index_blocks_in_processes(block_numbers, partial_indexes_path, number_of_processes=None):
+        partial_index_paths = [os.path.join(partial_indexes_path, block_number.__str__())
+                               for block_number in block_numbers]
+        documents_to_skip = [InvertedIndexer.indexed_blocks.get(block_number, 0) for block_number in block_numbers]
+
+        # Running the indexer in Processes
+        with ProcessPoolExecutor(max_workers=number_of_processes) as executor:
+            results = executor.map(InvertedIndexer.index_block, block_numbers, documents_to_skip, partial_index_paths)
+            for block_number, (new_documents, block_size) in zip(block_numbers, results):
+                InvertedIndexer.new_documents_found += new_documents
+                InvertedIndexer.indexed_blocks[block_number] = block_size
+
+        return partial_index_paths
+
+    # Indexes the new documents of the blocks in one pass with a SpimiIndexer,
+    # that saves a partial index on the disk every time that its memory budget is reached.
+    # Returns the paths of the partial indexes
+    @staticmethod
+    def index_blocks_with_spimi(block_numbers, partial_indexes_path, memory_budget_mb):
+        spimi_indexer = SpimiIndexer(partial_indexes_path, memory_budget_mb)
+        for block_number in block_numbers:
+            new_documents, block_size = InvertedIndexer.get_new_documents(
+                block_number, InvertedIndexer.indexed_blocks.get(block_number, 0))
+            for doc, (title, words) in new_documents:
+                spimi_indexer.add_document(doc, title, words)
+            InvertedIndexer.indexed_blocks[block_number] = block_size
+        spimi_indexer.save_segment()
+
+        InvertedIndexer.new_documents_found += spimi_indexer.documents_indexed
+        return spimi_indexer.segment_paths
+
+
+# Single-pass in-memory indexer (SPIMI): the postings of each document are appended straight to the postings lists
+# of a dictionary { term : ([doc_id_0, ...], [term_count_in_doc_0, ...], [positions in doc_0..., ...]) },
+# the positions are kept only if BUILD_POSITIONAL_POSTINGS. When the estimated memory of the
+# dictionary reaches the memory budget, the terms are sorted and the dictionary is saved on the disk as a segment
+# (a partial index) and a new dictionary is started. The segments are merged externally by merge_indexes
+class SpimiIndexer:
+    # Estimation of the bytes that python needs for a term of the dictionary (plus its characters),
+    # for a posting, for a position and for a document of the documents table (plus the characters of its url and title)
+    TERM_MEMORY_BYTES = 250
+    POSTING_MEMORY_BYTES = 80
+    POSITION_MEMORY_BYTES = 40
+    DOCUMENT_MEMORY_BYTES = 300
+
+    def __init__(self, segments_path, memory_budget_mb):
+        self.segments_path = segments_path
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.segment_paths = []
+        self.documents_indexed = 0
+        self.start_segment()
+
+    # Starts a new empty segment
+    def start_segment(self):
+        self.dictionary = {}
+        # The documents table of the segment, the id of a document is its position in the lists
+        self.urls, self.titles, self.doc_ld, self.doc_max_freq = [], [], [], []
+        self.used_memory = 0
+
+    def add_document(self, url, title, words):
+        doc_id = len(self.urls)
+        word_positions_dict = InvertedIndexer.get_positions_dict(words)
+        for word, word_positions in word_positions_dict.items():
+            postings = self.dictionary.get(word)
+            if postings is None:
+                # Word doesn't exist add it in the dictionary
+                postings = ([], [], [])
+                self.dictionary[word] = postings
+                self.used_memory += SpimiIndexer.TERM_MEMORY_BYTES + len(word)
+            postings[0].append(doc_id)
+            postings[1].append(len(word_positions))
+            if meta.BUILD_POSITIONAL_POSTINGS:
+                postings[2].extend(word_positions)
+        self.used_memory += SpimiIndexer.POSTING_MEMORY_BYTES * len(word_positions_dict)
+        if meta.BUILD_POSITIONAL_POSTINGS:
+            self.used_memory += SpimiIndexer.POSITION_MEMORY_BYTES * len(words)
+
+        # Find the max_freq and Ld of document
+        max_freq, ld = InvertedIndexer.get_max_freq_and_ld({word: len(word_positions) for word, word_positions
+                                                            in word_positions_dict.items()})
+        self.urls.append(url)
+        self.titles.append(title)
+        self.doc_ld.append(ld)
+        self.doc_max_freq.append(max_freq)
+        self.used_memory += SpimiIndexer.DOCUMENT_MEMORY_BYTES + len(url) + len(title)
+        self.documents_indexed += 1
+
+        if self.used_memory >= self.memory_budget:
+            self.save_segment()
+
+    # Saves the current segment on the disk (if it has any documents) and starts a new one
+    def save_segment(self):
+        if len(self.urls) == 0:
+            return
+        segment_path = os.path.join(self.segments_path, "segment_" + len(self.segment_paths).__str__())
+        print("Saving segment " + segment_path + " with " + len(self.urls).__str__() + " documents")
+
+        # Sorting the terms, the postings of each term are already sorted by the document id
+        terms = sorted(self.dictionary.keys())
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum([len(self.dictionary[term][0]) for term in terms])
+        doc_ids = np.fromiter(itertools.chain.from_iterable(self.dictionary[term][0] for term in terms),
+                              dtype=np.int32, count=term_offsets[-1])
+        freqs = np.fromiter(itertools.chain.from_iterable(self.dictionary[term][1] for term in terms),
+                            dtype=np.int32, count=term_offsets[-1])
+        positions = None
+        if meta.BUILD_POSITIONAL_POSTINGS:
+            positions = np.fromiter(itertools.chain.from_iterable(self.dictionary[term][2] for term in terms),
+                                    dtype=np.int64, count=int(freqs.sum()))
+
+        PostingsIndex.save_arrays(segment_path, terms, term_offsets, doc_ids, freqs,
+                                  self.urls, self.titles, self.doc_ld, self.doc_max_freq, positions)
+        self.segment_paths.append(segment_path)
+        self.start_segment()
+
+
+# Indexes the websites of a crawl while the crawl is running, in the indexing process of an IndexingPipeline.
+# The websites are added to a SpimiIndexer of their shard and segment_interval seconds after the first website that
+# is not indexed, the websites of each shard are added to the index of the shard as a new segment, that the search
+# app opens at its next query. The websites are given in the order that they are kept in the blocks. The websites
+# that were kept while the indexing was not running (the websites of the previous crawls that were not indexed,
+# or the ones that were not sent when the crawl was stopped) are read from the blocks when a later website
+# of their block (or of a next block) is given, so the indexed websites of a block are always its first websites
+class StreamingIndexer:
+
+    def __init__(self, segment_interval=meta.STREAMING_SEGMENT_INTERVAL,
+                 memory_budget_mb=meta.STREAMING_MEMORY_BUDGET_MB):
+        self.segment_interval = segment_interval
+        self.memory_budget_mb = memory_budget_mb
+        # The partial indexes of the segments are saved in a temporary directory next to the index
+        self.partial_indexes_path = tempfile.mkdtemp(prefix="streaming_indexes_", dir=meta.DATA_FILES_PATH)
+        # { block_number : documents } with the number of the documents of each block that are indexed
+        # or are in the spimi indexers
+        self.next_documents = dict(InvertedIndexer.indexed_blocks)
+        # The last block with documents that are indexed or are in the spimi indexers
+        self.last_block = max(self.next_documents.keys(), default=1)
+        # { shard_number : SpimiIndexer } with the documents of each shard that are not indexed yet
+        self.spimi_indexers = {}
+        # The time that the first document of the spimi indexers was added, None if they have no documents
+        self.first_pending_time = None
+        self.compactor = None
+
+    def get_spimi_indexer(self, block_number):
+        shard_number = 0 if InvertedIndexer.number_of_shards == 0 else \
+            my_segments.get_block_shard(block_number, InvertedIndexer.number_of_shards)
+        spimi_indexer = self.spimi_indexers.get(shard_number)
+        if spimi_indexer is None:
+            spimi_indexer = SpimiIndexer(os.path.join(self.partial_indexes_path, shard_number.__str__()),
+                                         self.memory_budget_mb)
+            self.spimi_indexers[shard_number] = spimi_indexer
+        return spimi_indexer
+
+    # Adds the document of the block with the given number (its position in the block),
+    # the documents that are already indexed are skipped
+    def add_document(self, block_number, document_number, url, title, words):
+        if document_number < self.next_documents.get(block_number, 0):
+            return
+        self.add_documents_from_blocks(block_number, document_number)
+        self.get_spimi_indexer(block_number).add_document(url, title, words)
+        self.next_documents[block_number] = document_number + 1
+        if self.first_pending_time is None:
+            self.first_pending_time = time.time()
+
+    # Adds the documents that are not indexed from the blocks on the disk,
+    # the documents of the blocks before the given block and the documents before the given document of the block
+    def add_documents_from_blocks(self, block_number, document_number):
+        if block_number == self.last_block and document_number == self.next_documents.get(block_number, 0):
+            return
+        for previous_block_number in range(self.last_block, block_number + 1):
+            block = my_blocks.open_block(previous_block_number, mmap_mode='r')
+            first_document = self.next_documents.get(previous_block_number, 0)
+            end_document = document_number if previous_block_number == block_number else len(block)
+            if first_document >= end_document:
                 continue
-            else:
-                InvertedIndexer.new_documents_found += 1
-            InvertedIndexer.lock_documents_data.release()
+            print("Indexing " + (end_document - first_document).__str__() + " documents of block " +
+                  previous_block_number.__str__() + " from the disk")
+            spimi_indexer = self.get_spimi_indexer(previous_block_number)
+            for doc, (title, words) in itertools.islice(block.get_documents(first_document),
+                                                        end_document - first_document):
+                spimi_indexer.add_document(doc, title, words)
+            self.next_documents[previous_block_number] = end_document
+        self.last_block = block_number
 
-            self.docs_processed += 1
+    # Returns the seconds until the documents of the spimi indexers are added to the index, None if they have none
+    def get_time_to_next_segment(self):
+        if self.first_pending_time is None:
+            return None
+        return max(0.0, self.first_pending_time + self.segment_interval - time.time())
 
-            word_freq_dict = InvertedIndexer.get_frequency_dict(words)
+    # Adds the documents of each shard's spimi indexer to the index of the shard as a new segment, then the segments
+    # are compacted in the background if any shard has too many of them
+    def save_segments(self):
+        shard_paths = my_segments.get_shard_paths()
+        number_of_shards = InvertedIndexer.number_of_shards
+        for shard_number, spimi_indexer in self.spimi_indexers.items():
+            spimi_indexer.save_segment()
+            shard_indexed_blocks = {block_number: documents for block_number, documents
+                                    in self.next_documents.items() if number_of_shards == 0 or
+                                    my_segments.get_block_shard(block_number, number_of_shards) == shard_number}
+            segment_name = my_segments.add_segment(spimi_indexer.segment_paths, shard_indexed_blocks,
+                                                   shard_paths[shard_number])
+            shutil.rmtree(spimi_indexer.segments_path)
+            InvertedIndexer.new_documents_found += spimi_indexer.documents_indexed
+            print("New segment " + segment_name + " with " + spimi_indexer.documents_indexed.__str__() +
+                  " documents was added to the index " + shard_paths[shard_number] + " in %f seconds after its "
+                  "first document" % (time.time() - self.first_pending_time))
+        self.spimi_indexers = {}
+        self.first_pending_time = None
+
+        if self.compactor is None or not self.compactor.is_alive():
+            if any(len(my_segments.load_manifest(shard_path)[meta.MANIFEST_SEGMENTS_KEY]) > meta.MAX_SEGMENTS
+                   for shard_path in shard_paths):
+                self.compactor = my_segments.SegmentCompactor()
+                self.compactor.start()
+
+    # Indexes the documents of the queue until it gives None (the end of the crawl),
+    # the last documents are added to the index before it returns
+    def run(self, documents_queue):
+        document = ()
+        while document is not None:
+            try:
+                document = documents_queue.get(timeout=self.get_time_to_next_segment())
+                if document is not None:
+                    self.add_document(*document)
+            except queue.Empty:
+                pass
+            if document is None or self.get_time_to_next_segment() == 0:
+                self.save_segments()
+
+        if self.compactor is not None:
+            self.compactor.join()
+        shutil.rmtree(self.partial_indexes_path)
+        print("Documents indexed while crawling: " + InvertedIndexer.new_documents_found.__str__())
 
-            for word, word_count in word_freq_dict.items():
-                InvertedIndexer.lock_indexer.acquire()
-                # Word doesn't exist add it in the indexer { word : [1,[(doc,word_count)]]}
-                if word not in InvertedIndexer.indexer:
-                    # Update indexer with the new word
-                    InvertedIndexer.indexer[word] = [1, [(doc, word_count)]]
-                else:
-                    # Get record for the word
-                    values = InvertedIndexer.indexer.get(word)
-                    InvertedIndexer.lock_indexer.release()
-                    # Increase appearances in docs
-                    values[0] += 1
-                    # Append the document with it's word count
-                    values[1].append((doc, word_count))
-                    # Update indexer
-                    InvertedIndexer.lock_indexer.acquire()
-                    InvertedIndexer.indexer.update({word: values})  # Update indexer
-                InvertedIndexer.lock_indexer.release()
-
-            # Find the max_freq and Ld of document
-            if len(word_freq_dict.values()) != 0:
-                max_freq = max(word_freq_dict.values())
-                #  The length of the vectors of the document
-                ld = math.sqrt(sum([x ** 2 for x in word_freq_dict.values()])) / max_freq
-            else:
-                max_freq = 0
-                ld = 0
 
-            InvertedIndexer.lock_documents_data.acquire()
-            InvertedIndexer.documents_metadata[doc] = (ld, max_freq, title)
-            InvertedIndexer.lock_documents_data.release()
+# Runs in the indexing process of the IndexingPipeline, the index is made from scratch if new_index is True
+# (with the same number of shards). The Ctrl-C of the crawl is ignored, the crawler stops the indexing itself
+# after its last websites were sent
+def run_streaming_indexer(documents_queue, new_index, segment_interval):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    InvertedIndexer.open_index(new_index, my_segments.get_number_of_shards())
+    StreamingIndexer(segment_interval).run(documents_queue)
 
-        print(threading.current_thread().__str__() + "has finished. Total docs processed: "
-              + self.docs_processed.__str__())
+
+# Pipeline from the crawler to a StreamingIndexer, so the websites become searchable a few seconds after they are
+# crawled (without an update of the index after the crawl). The websites that the crawler keeps are sent through
+# a bounded queue to the indexing process, the crawler waits when the queue is full (backpressure), so the websites
+# don't pile up in the memory when the indexing is slower than the crawl. The process is started with a forkserver,
+# since the crawler's threads are already running. The manifest of the index is locked by each process that changes
+# it (my_segments.ManifestLock), so no segment is lost if the my_indexer.py runs while the crawl is indexed by the
+# pipeline, but the websites that both of them index are in the index twice
+class IndexingPipeline:
+
+    def __init__(self, new_index=False, max_queued_documents=meta.STREAMING_QUEUE_SIZE,
+                 segment_interval=meta.STREAMING_SEGMENT_INTERVAL):
+        context = multiprocessing.get_context('forkserver')
+        self.documents_queue = context.Queue(max_queued_documents)
+        self.process = context.Process(target=run_streaming_indexer,
+                                       args=(self.documents_queue, new_index, segment_interval))
+        self.process.start()
+
+    # Puts the item in the queue, waiting while the queue is full. Returns False if the indexing process has stopped
+    def put(self, item):
+        while self.process.is_alive():
+            try:
+                self.documents_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # Sends the document (the document_number-th document of its block) to the indexing process.
+    # If the process has stopped, the document is indexed by the next update of the index
+    def add_document(self, block_number, document_number, url, title, words):
+        self.put((block_number, document_number, url, title, words))
+
+    # Waits for the indexing process to add the documents that were sent to the index
+    def close(self):
+        self.put(None)
+        self.process.join()
 
 
 # Updates the indexer in case of the desire to add any new data contained in data the data files
-def update_indexer(number_of_threads=1):
+# Only the documents that were added in the blocks after the last update are indexed.
+# By default each block with new documents is indexed in a different process into a partial index.
+# If a memory budget (in MB) is given, the blocks are indexed in one process by a SpimiIndexer
+# that saves a partial index every time that the memory budget is reached.
+# Then the partial indexes are merged into a new segment of the index, so the cost of an update depends only on
+# the number of the new documents. The new documents of a sharded index are added to the shard of their block,
+# each shard that has new documents gets a new segment.
+# When compact is True, a SegmentCompactor thread is started (and returned)
+# that merges segments in the background if there are too many of them
+def update_indexer(number_of_processes=None, memory_budget_mb=None, compact=True):
     index_start_time = time.time()
-    # Running the indexer in Threads
-    indexer_threads = []
-    for i in range(number_of_threads):
-        indexer = InvertedIndexer()
-        indexer.start()
-        indexer_threads.append(indexer)
-    for indexer in indexer_threads:
-        indexer.join()
+    InvertedIndexer.new_documents_found = 0
+    block_numbers = InvertedIndexer.get_blocks_to_index()
+    number_of_shards = InvertedIndexer.number_of_shards
+
+    # The partial indexes are saved in a temporary directory next to the index
+    partial_indexes_path = tempfile.mkdtemp(prefix="partial_indexes_", dir=meta.DATA_FILES_PATH)
+    for shard_number, shard_path in enumerate(my_segments.get_shard_paths()):
+        shard_block_numbers = [block_number for block_number in block_numbers if number_of_shards == 0 or
+                               my_segments.get_block_shard(block_number, number_of_shards) == shard_number]
+        shard_partial_indexes_path = os.path.join(partial_indexes_path, shard_number.__str__())
+        new_documents_before_shard = InvertedIndexer.new_documents_found
+        if memory_budget_mb is None:
+            partial_index_paths = InvertedIndexer.index_blocks_in_processes(shard_block_numbers,
+                                                                            shard_partial_indexes_path,
+                                                                            number_of_processes)
+        else:
+            partial_index_paths = InvertedIndexer.index_blocks_with_spimi(shard_block_numbers,
+                                                                          shard_partial_indexes_path,
+                                                                          memory_budget_mb)
+
+        # Merging the partial indexes into a new segment (of the shard)
+        if InvertedIndexer.new_documents_found > new_documents_before_shard:
+            shard_indexed_blocks = {block_number: documents for block_number, documents
+                                    in InvertedIndexer.indexed_blocks.items() if number_of_shards == 0 or
+                                    my_segments.get_block_shard(block_number, number_of_shards) == shard_number}
+            segment_name = my_segments.add_segment(partial_index_paths, shard_indexed_blocks, shard_path)
+            print("New segment " + segment_name + " was added to the index " + shard_path)
+    shutil.rmtree(partial_indexes_path)
+
     index_end_time = time.time()
     print("Time needed for indexer update: %f seconds" % (index_end_time - index_start_time))
     print("New documents found since the last update: " + InvertedIndexer.new_documents_found.__str__())
 
-    # Saving updated Inverted Indexer and documents' meta-data
-    np.save(meta.INVERTED_INDEXER_FILE_PATH, InvertedIndexer.indexer)
-    np.save(meta.DOC_METADATA_FILE_PATH, InvertedIndexer.documents_metadata)
-
-
-try:
-    new_indexer_parameter = sys.argv[1]
-    if new_indexer_parameter == '1':
-        InvertedIndexer.init_indexer(True)
-    elif new_indexer_parameter == '0':
-        InvertedIndexer.init_indexer(False)
-    else:
-        raise ValueError("Please run the app again! Give 1 in order to make new indexer or 0 to update indexer")
-    update_indexer(1)
-except IndexError:
-    new_indexer_parameter = None
-except ValueError as e:
-    print(e)
-    new_indexer_parameter = None
+    if compact:
+        compactor = my_segments.SegmentCompactor()
+        compactor.start()
+        return compactor
+    return None
 
 
+if __name__ == '__main__':
+    try:
+        new_indexer_parameter = sys.argv[1]
+        # The number of shards is optional (0 for an index that is not sharded), by default a new index
+        # is not sharded and an existing index keeps its shards
+        number_of_index_shards = int(sys.argv[4]) if len(sys.argv) > 4 else None
+        if new_indexer_parameter == '1':
+            InvertedIndexer.init_indexer(True, number_of_index_shards)
+        elif new_indexer_parameter == '0':
+            InvertedIndexer.init_indexer(False, number_of_index_shards)
+        else:
+            raise ValueError("Please run the app again! Give 1 in order to make new indexer or 0 to update indexer")
+        # The number of processes is optional, by default one process for each cpu is used
+        number_of_indexer_processes = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2] != "None" else None
+        # The memory budget in MB is optional, if it is given the single-pass (SPIMI) indexer is used
+        indexer_memory_budget_mb = float(sys.argv[3]) if len(sys.argv) > 3 and sys.argv[3] != "None" else None
+        segments_compactor = update_indexer(number_of_indexer_processes, indexer_memory_budget_mb)
+        segments_compactor.join()
+    except IndexError:
+        new_indexer_parameter = None
+    except ValueError as e:
+        print(e)
+        new_indexer_parameter = None
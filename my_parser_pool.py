@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from my_text_processor import TextProcessor
+import metadata as meta
+
+import os
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# The TextProcessor object (of each parser process) that will use stemming, it is made by init_parser_process
+text_processor = None
+
+
+# Makes the TextProcessor of the parser process, its stem cache starts with the words of the stem table
+# and keeps the words that it stems, for the stem cache of the crawler's process
+def init_parser_process(parser_backend, stem_table_path):
+    global text_processor
+    text_processor = TextProcessor(stemming=True, parser_backend=parser_backend)
+    TextProcessor.stem_cache.load(stem_table_path)
+    TextProcessor.stem_cache.track_new_stems()
+
+
+# Runs in a parser process, returns the title of the html text along with the cleaned words, the out-links
+# and the words that the process has stemmed since its last result (with its hits and misses).
+# The exceptions are raised again as ValueError, since some of them (like the LangDetectException)
+# can not be sent back to the crawler's process
+def parse_website(html_text, link_scheme):
+    try:
+        title, cleaned_words = text_processor.get_cleaned_doc(html_text)
+    except Exception as e:
+        raise ValueError(e.__str__())
+    return (title, cleaned_words, TextProcessor.get_links_from_text(html_text, link_scheme),
+            TextProcessor.stem_cache.take_new_stems())
+
+
+# Pool of parser processes that clean the html texts of the crawlers, so the parsing doesn't hold the GIL of the
+# crawler's process. At most max_pending html texts are sent to the pool at the same time, the crawlers wait
+# when the pool is full (backpressure), so the html texts don't pile up in the memory when the parsers are slower
+# than the fetching. The processes are started with a forkserver, since the crawler's threads are already running
+class ParserPool:
+
+    def __init__(self, parser_processes=None, parser_backend=meta.DEFAULT_PARSER_BACKEND, max_pending=None):
+        self.parser_processes = os.cpu_count() if parser_processes is None else parser_processes
+        self.max_pending = self.parser_processes * meta.PARSER_PENDING_PER_PROCESS if max_pending is None \
+            else max_pending
+        self.executor = ProcessPoolExecutor(max_workers=self.parser_processes,
+                                            mp_context=multiprocessing.get_context('forkserver'),
+                                            initializer=init_parser_process,
+                                            initargs=(parser_backend, meta.STEM_TABLE_FILE_PATH))
+        # The free places of the pool, for the threads and for the coroutines of the event loop
+        self.pending_slots = threading.BoundedSemaphore(self.max_pending)
+        self.async_pending_slots = None
+
+    # Adds the words that the parser process has stemmed to the stem cache of the crawler's process (the one that is
+    # saved as the stem table), returns the title, the cleaned words and the out-links of the result
+    @staticmethod
+    def get_parsed_website(result):
+        title, cleaned_words, list_of_links, (new_stems, hits, misses) = result
+        TextProcessor.stem_cache.add_new_stems(new_stems, hits, misses)
+        return title, cleaned_words, list_of_links
+
+    # Parses the html text in a parser process and waits for the result (used by the threads)
+    def parse(self, html_text, link_scheme):
+        with self.pending_slots:
+            return ParserPool.get_parsed_website(self.executor.submit(parse_website, html_text, link_scheme).result())
+
+    # Parses the html text in a parser process without blocking the event loop (used by the coroutines)
+    async def parse_async(self, html_text, link_scheme):
+        if self.async_pending_slots is None:
+            self.async_pending_slots = asyncio.Semaphore(self.max_pending)
+        async with self.async_pending_slots:
+            return ParserPool.get_parsed_website(await asyncio.get_event_loop().run_in_executor(
+                self.executor, parse_website, html_text, link_scheme))
+
+    def shutdown(self):
+        self.executor.shutdown()
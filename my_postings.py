@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+import metadata as meta
+from my_compression import CompressedPostings, PositionalPostings, get_position_gaps
+import numpy as np
+import scipy.sparse as sp
+import heapq
+import os
+
+
+# Saves a list of strings as one utf-8 byte array and an array with the offsets of each string,
+# in order to load them later without having to unpickle one python object per string
+def save_string_table(file_path_prefix, strings):
+    encoded_strings = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded_strings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded_strings], dtype=np.int64)
+    data = np.frombuffer(b''.join(encoded_strings), dtype=np.uint8)
+    np.save(file_path_prefix + meta.STRING_TABLE_DATA_SUFFIX, data)
+    np.save(file_path_prefix + meta.STRING_TABLE_OFFSETS_SUFFIX, offsets)
+
+
+# Read-only table of strings that was saved with save_string_table
+class StringTable:
+
+    def __init__(self, file_path_prefix, mmap_mode=None):
+        self.data = np.load(file_path_prefix + meta.STRING_TABLE_DATA_SUFFIX, mmap_mode=mmap_mode)
+        self.offsets = np.load(file_path_prefix + meta.STRING_TABLE_OFFSETS_SUFFIX, mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+
+# Inverted index that keeps the postings in contiguous arrays with integer document ids.
+# Structure: terms[t] is the term with id t and its postings are the documents doc_ids[s:e] with the frequencies
+# freqs[s:e] of the term in each of those documents, where s, e = term_offsets[t], term_offsets[t + 1]
+# The documents' metadata (url, title, max_freq and Ld) are kept in arrays indexed by the document id.
+# If the postings are compressed (my_compression.py) the doc_ids and freqs arrays are None,
+# the postings of each term are decoded when they are read. The positions of the terms in the documents
+# are kept in the positional postings, None if the index doesn't have them
+class PostingsIndex:
+
+    # If mmap_mode is 'r' the arrays are memory-mapped instead of being read in memory, so opening the index takes
+    # the same time for any size of the corpus, and all the processes that open the index share the same
+    # (page-cache) copy of the files. Only the parts of the index that are used by the queries are read from the disk
+    def __init__(self, index_path=meta.INVERTED_INDEX_DIR_PATH, mmap_mode=None):
+        self.index_path = index_path
+        self.mmap_mode = mmap_mode
+
+        # The term dictionary and the postings
+        self.terms = self.load_array(meta.INDEX_TERMS_FILENAME)
+        self.term_offsets = self.load_array(meta.INDEX_TERM_OFFSETS_FILENAME)
+        if os.path.exists(os.path.join(index_path, meta.INDEX_POSTINGS_DOC_DATA_FILENAME)):
+            self.compressed_postings = CompressedPostings(index_path, self.term_offsets, mmap_mode)
+            self.doc_ids = None
+            self.freqs = None
+        else:
+            self.compressed_postings = None
+            self.doc_ids = self.load_array(meta.INDEX_DOC_IDS_FILENAME)
+            self.freqs = self.load_array(meta.INDEX_FREQS_FILENAME)
+        self.term_max_weight = self.load_array(meta.INDEX_TERM_MAX_WEIGHT_FILENAME)
+        self.term_max_freq = self.load_array(meta.INDEX_TERM_MAX_FREQ_FILENAME)
+        self.term_min_length_ratio = self.load_array(meta.INDEX_TERM_MIN_LENGTH_RATIO_FILENAME)
+
+        # The documents table
+        self.doc_urls = StringTable(os.path.join(index_path, meta.INDEX_DOC_URLS_FILENAME), mmap_mode)
+        self.doc_titles = StringTable(os.path.join(index_path, meta.INDEX_DOC_TITLES_FILENAME), mmap_mode)
+        self.doc_max_freq = self.load_array(meta.INDEX_DOC_MAX_FREQ_FILENAME)
+        self.doc_ld = self.load_array(meta.INDEX_DOC_LD_FILENAME)
+        self.doc_length = self.load_array(meta.INDEX_DOC_LENGTH_FILENAME)
+        self.doc_url_order = self.load_array(meta.INDEX_DOC_URL_ORDER_FILENAME)
+
+        # The arrays of the forward index, the CSR matrix is made only when it is used for the first time
+        self.forward_indptr = self.load_array(meta.INDEX_FORWARD_INDPTR_FILENAME)
+        self.forward_term_ids = self.load_array(meta.INDEX_FORWARD_TERM_IDS_FILENAME)
+        self.forward_tf = self.load_array(meta.INDEX_FORWARD_TF_FILENAME)
+        self.forward_index = None
+
+        # The impact ordered postings (with the same term_offsets), None if the index doesn't have them
+        if os.path.exists(os.path.join(index_path, meta.INDEX_IMPACT_DOC_IDS_FILENAME)):
+            self.impact_doc_ids = self.load_array(meta.INDEX_IMPACT_DOC_IDS_FILENAME)
+            self.impact_freqs = self.load_array(meta.INDEX_IMPACT_FREQS_FILENAME)
+        else:
+            self.impact_doc_ids = None
+            self.impact_freqs = None
+
+        if os.path.exists(os.path.join(index_path, meta.INDEX_POSITIONS_DATA_FILENAME)):
+            self.positional_postings = PositionalPostings(index_path, self.term_offsets, mmap_mode)
+        else:
+            self.positional_postings = None
+
+    def load_array(self, filename):
+        return np.load(os.path.join(self.index_path, filename), mmap_mode=self.mmap_mode)
+
+    # The number of total documents
+    @property
+    def total_docs(self):
+        return len(self.doc_max_freq)
+
+    # The number of terms in the term dictionary
+    @property
+    def total_terms(self):
+        return len(self.terms)
+
+    # Returns the id of the term with binary search in the sorted term dictionary, or None if the term doesn't exist
+    def get_term_id(self, term):
+        term_id = int(np.searchsorted(self.terms, term))
+        if term_id < len(self.terms) and self.terms[term_id] == term:
+            return term_id
+        return None
+
+    # Returns the postings (doc_ids, freqs) of the term with the given id
+    def get_postings_by_id(self, term_id):
+        if self.compressed_postings is not None:
+            return self.compressed_postings.get_postings_by_id(term_id)
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        return self.doc_ids[start:end], self.freqs[start:end]
+
+    # Returns all the postings (doc_ids, freqs) of the index, in the order of the terms
+    def get_all_postings(self):
+        if self.compressed_postings is not None:
+            return self.compressed_postings.get_all_postings()
+        return self.doc_ids, self.freqs
+
+    # Returns the postings (doc_ids, freqs) of the term, or None if the term doesn't exist in any document
+    def get_postings(self, term):
+        term_id = self.get_term_id(term)
+        if term_id is None:
+            return None
+        return self.get_postings_by_id(term_id)
+
+    # Returns the frequency of the term in each of the given (sorted) document ids, 0 for the documents
+    # that don't contain the term. The postings are probed with binary search, so only a few of them are read
+    # (only the blocks that may have the document ids are decoded from the compressed postings)
+    def get_term_frequencies(self, term, doc_ids):
+        term_id = self.get_term_id(term)
+        if term_id is None:
+            return np.zeros(len(doc_ids), dtype=np.int64)
+        if self.compressed_postings is not None:
+            return self.compressed_postings.get_term_frequencies(term_id, doc_ids)
+        term_doc_ids, term_freqs = self.get_postings_by_id(term_id)
+        freqs = np.zeros(len(doc_ids), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(term_doc_ids, doc_ids), len(term_doc_ids) - 1)
+        found = term_doc_ids[positions] == doc_ids
+        freqs[found] = term_freqs[positions[found]]
+        return freqs
+
+    # Returns the positions of the term in each of the given (sorted) document ids, an empty array for the documents
+    # that don't contain the term (None for every document if the index has no positions).
+    # Only the positions of the blocks with the postings of the documents are decoded
+    def get_positions(self, term, doc_ids):
+        if self.positional_postings is None:
+            return [None] * len(doc_ids)
+        positions = [np.zeros(0, dtype=np.int64)] * len(doc_ids)
+        term_id = self.get_term_id(term)
+        if term_id is None:
+            return positions
+        term_doc_ids, term_freqs = self.get_postings_by_id(term_id)
+        posting_ranks = np.minimum(np.searchsorted(term_doc_ids, doc_ids), len(term_doc_ids) - 1)
+        found = np.flatnonzero(term_doc_ids[posting_ranks] == doc_ids)
+        for position, doc_positions in zip(found.tolist(), self.positional_postings.get_positions(
+                term_id, posting_ranks[found], term_freqs)):
+            positions[position] = doc_positions
+        return positions
+
+    # Returns the first (at most limit) postings (doc_ids, freqs) of the term in impact order,
+    # or None if the term doesn't exist in any document
+    def get_impact_postings(self, term, limit):
+        term_id = self.get_term_id(term)
+        if term_id is None:
+            return None
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        end = min(end, start + limit)
+        return self.impact_doc_ids[start:end], self.impact_freqs[start:end]
+
+    # Returns the number of documents that contain each of the terms with the given ids (n_t)
+    def get_document_frequencies(self, term_ids):
+        return self.term_offsets[term_ids + 1] - self.term_offsets[term_ids]
+
+    # Returns the forward index, a CSR matrix (documents x terms) with the tf of each term in each document
+    def get_forward_index(self):
+        if self.forward_index is None:
+            self.forward_index = sp.csr_matrix((self.forward_tf, self.forward_term_ids, self.forward_indptr),
+                                               shape=(self.total_docs, self.total_terms), copy=False)
+        return self.forward_index
+
+    def get_url(self, doc_id):
+        return self.doc_urls[doc_id]
+
+    def get_title(self, doc_id):
+        return self.doc_titles[doc_id]
+
+    # Returns the id of the document with the given url, or None if the url is not indexed
+    # Binary search over the document ids sorted by url
+    def get_doc_id(self, url):
+        low, high = 0, len(self.doc_url_order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.doc_urls[self.doc_url_order[middle]] < url:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.doc_url_order) and self.doc_urls[self.doc_url_order[low]] == url:
+            return int(self.doc_url_order[low])
+        return None
+
+    # Saves the postings that are given as three arrays with the term id (the position of the term in the sorted
+    # terms), the document id and the frequency of each (term, document) pair, and the table with the url, title,
+    # Ld and max_freq of each document id. The postings have to be given in the order of the document ids.
+    # The positions (if they are given) are the positions of each posting's term in its document,
+    # sorted by the term id, then by the document id and then by the position
+    @staticmethod
+    def save_postings(index_path, terms, posting_term_ids, posting_doc_ids, posting_freqs,
+                      urls, titles, doc_ld, doc_max_freq, positions=None):
+        # Grouping the postings by term, the stable sort keeps the postings of each term sorted by the document id
+        order = np.argsort(posting_term_ids, kind='stable')
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum(np.bincount(posting_term_ids, minlength=len(terms)))
+
+        PostingsIndex.save_arrays(index_path, terms, term_offsets,
+                                  np.array(posting_doc_ids, dtype=np.int32)[order],
+                                  np.array(posting_freqs, dtype=np.int32)[order],
+                                  urls, titles, doc_ld, doc_max_freq, positions)
+
+    # Saves the index from its arrays (the term dictionary and postings) and the documents table.
+    # The positions (if they are given) are the positions of the postings, freqs[i] positions for the i-th posting.
+    # The length of each document is the sum of the frequencies of its postings
+    @staticmethod
+    def save_arrays(index_path, terms, term_offsets, doc_ids, freqs, urls, titles, doc_ld, doc_max_freq,
+                    positions=None):
+        os.makedirs(index_path, exist_ok=True)
+
+        np.save(os.path.join(index_path, meta.INDEX_TERMS_FILENAME), np.array(terms, dtype=str))
+        np.save(os.path.join(index_path, meta.INDEX_TERM_OFFSETS_FILENAME), term_offsets)
+        if meta.COMPRESS_POSTINGS:
+            CompressedPostings.save(index_path, term_offsets, doc_ids, freqs)
+        else:
+            np.save(os.path.join(index_path, meta.INDEX_DOC_IDS_FILENAME), doc_ids)
+            np.save(os.path.join(index_path, meta.INDEX_FREQS_FILENAME), freqs)
+        if positions is not None and meta.BUILD_POSITIONAL_POSTINGS:
+            PositionalPostings.save(index_path, term_offsets, freqs, get_position_gaps(positions, freqs))
+
+        save_string_table(os.path.join(index_path, meta.INDEX_DOC_URLS_FILENAME), urls)
+        save_string_table(os.path.join(index_path, meta.INDEX_DOC_TITLES_FILENAME), titles)
+        doc_max_freq = np.array(doc_max_freq, dtype=np.int32)
+        np.save(os.path.join(index_path, meta.INDEX_DOC_LD_FILENAME), np.array(doc_ld, dtype=np.float64))
+        np.save(os.path.join(index_path, meta.INDEX_DOC_MAX_FREQ_FILENAME), doc_max_freq)
+        doc_length = np.bincount(doc_ids, weights=freqs, minlength=len(urls)).astype(np.int32)
+        np.save(os.path.join(index_path, meta.INDEX_DOC_LENGTH_FILENAME), doc_length)
+        np.save(os.path.join(index_path, meta.INDEX_DOC_URL_ORDER_FILENAME),
+                np.array(sorted(range(len(urls)), key=urls.__getitem__), dtype=np.int32))
+        np.save(os.path.join(index_path, meta.INDEX_TERM_MAX_WEIGHT_FILENAME),
+                PostingsIndex.get_term_max_weights(term_offsets, doc_ids, freqs, doc_max_freq,
+                                                   np.array(doc_ld, dtype=np.float64)))
+        term_max_freq, term_min_length_ratio = PostingsIndex.get_term_bm25_statistics(term_offsets, doc_ids, freqs,
+                                                                                      doc_length)
+        np.save(os.path.join(index_path, meta.INDEX_TERM_MAX_FREQ_FILENAME), term_max_freq)
+        np.save(os.path.join(index_path, meta.INDEX_TERM_MIN_LENGTH_RATIO_FILENAME), term_min_length_ratio)
+        if meta.BUILD_IMPACT_ORDERED_POSTINGS:
+            PostingsIndex.save_impact_ordered_postings(index_path, term_offsets, doc_ids, freqs, doc_max_freq,
+                                                       np.array(doc_ld, dtype=np.float64))
+
+        PostingsIndex.save_forward_index(index_path, term_offsets, doc_ids, freqs, doc_max_freq)
+
+    # Returns the maximum weight (freq/(max_freq*Ld)) of the postings of each term
+    @staticmethod
+    def get_term_max_weights(term_offsets, doc_ids, freqs, doc_max_freq, doc_ld):
+        if len(doc_ids) == 0:
+            return np.zeros(len(term_offsets) - 1, dtype=np.float64)
+        weights = freqs / (doc_max_freq[doc_ids] * doc_ld[doc_ids])
+        # Every term has at least one posting, so each term's postings are a non-empty part of the weights
+        return np.maximum.reduceat(weights, term_offsets[:-1])
+
+    # Returns the maximum frequency of each term in its postings and the minimum length/freq of the documents
+    # of its postings. The BM25 score of a posting only grows with the freq and with the freq/length of the document,
+    # so the score of a posting with these two values is an upper bound of the BM25 scores of the term
+    @staticmethod
+    def get_term_bm25_statistics(term_offsets, doc_ids, freqs, doc_length):
+        if len(doc_ids) == 0:
+            return np.zeros(len(term_offsets) - 1, dtype=np.int32), np.zeros(len(term_offsets) - 1, dtype=np.float64)
+        return (np.maximum.reduceat(freqs, term_offsets[:-1]).astype(np.int32),
+                np.minimum.reduceat(doc_length[doc_ids] / freqs, term_offsets[:-1]))
+
+    # Saves the postings of each term sorted by their impact (freq/(max_freq*Ld)), the biggest first
+    # (and by document id if the impacts are equal)
+    @staticmethod
+    def save_impact_ordered_postings(index_path, term_offsets, doc_ids, freqs, doc_max_freq, doc_ld):
+        impacts = freqs / (doc_max_freq[doc_ids] * doc_ld[doc_ids])
+        posting_term_ids = np.repeat(np.arange(len(term_offsets) - 1), np.diff(term_offsets))
+        order = np.lexsort((doc_ids, -impacts, posting_term_ids))
+        np.save(os.path.join(index_path, meta.INDEX_IMPACT_DOC_IDS_FILENAME), np.asarray(doc_ids)[order])
+        np.save(os.path.join(index_path, meta.INDEX_IMPACT_FREQS_FILENAME), np.asarray(freqs)[order])
+
+    # Saves the forward index (document -> tf of each of its terms) as a CSR matrix.
+    # The postings are the columns of the same matrix (CSC), so the CSR matrix is their transpose
+    @staticmethod
+    def save_forward_index(index_path, term_offsets, doc_ids, freqs, doc_max_freq):
+        tf_values = freqs / doc_max_freq[doc_ids]
+        forward_index = sp.csc_matrix((tf_values, doc_ids, term_offsets),
+                                      shape=(len(doc_max_freq), len(term_offsets) - 1)).tocsr()
+        forward_index.sort_indices()
+
+        np.save(os.path.join(index_path, meta.INDEX_FORWARD_INDPTR_FILENAME), forward_index.indptr.astype(np.int64))
+        np.save(os.path.join(index_path, meta.INDEX_FORWARD_TERM_IDS_FILENAME), forward_index.indices.astype(np.int32))
+        np.save(os.path.join(index_path, meta.INDEX_FORWARD_TF_FILENAME), forward_index.data)
+
+
+# Creates a .npy file for an array of the given length that is written through a memory-map,
+# in order to write big arrays part by part without keeping all of them in memory
+def create_array_file(file_path, dtype, length):
+    return np.lib.format.open_memmap(file_path, mode='w+', dtype=dtype, shape=(int(length),))
+
+
+# Saves the concatenation of the given string tables as one string table
+def merge_string_tables(file_path_prefix, string_tables):
+    data = create_array_file(file_path_prefix + meta.STRING_TABLE_DATA_SUFFIX, np.uint8,
+                             sum(len(table.data) for table in string_tables))
+    offsets = create_array_file(file_path_prefix + meta.STRING_TABLE_OFFSETS_SUFFIX, np.int64,
+                                sum(len(table) for table in string_tables) + 1)
+    offsets[0] = 0
+    strings_base, data_base = 0, 0
+    for table in string_tables:
+        data[data_base:data_base + len(table.data)] = table.data
+        offsets[strings_base + 1:strings_base + len(table) + 1] = table.offsets[1:] + data_base
+        strings_base += len(table)
+        data_base += len(table.data)
+    data.flush()
+    offsets.flush()
+
+
+# Returns the (url, doc_id) pairs of an index sorted by url, with the ids moved by doc_base
+def get_sorted_urls(index, doc_base):
+    for doc_id in index.doc_url_order.tolist():
+        yield index.get_url(doc_id), doc_base + doc_id
+
+
+# Merges the (partial) indexes of the source paths into one index that is saved in index_path.
+# The documents of every source must not exist in any other source. The documents keep their order,
+# the documents of the first source get the first ids, then the documents of the second source and so on.
+# The sources are memory-mapped and the merged postings are written through memory-maps, one source at a time.
+# The memory is not bounded by the size of a source: the position of every merged posting is kept for the merge of
+# the positions, and the impact ordering, the positions and the compression are made from the whole merged arrays,
+# so the memory that the merge needs grows with the postings of all the sources. If COMPRESS_POSTINGS the merged
+# postings arrays are compressed at the end and only the compressed postings are kept. The positions of the postings
+# are merged if all the sources have them
+def merge_indexes(source_paths, index_path):
+    os.makedirs(index_path, exist_ok=True)
+    sources = [PostingsIndex(source_path, mmap_mode='r') for source_path in source_paths]
+
+    # The term dictionary of the merged index is the union of the sources' (sorted) term dictionaries
+    terms = np.unique(np.concatenate([source.terms for source in sources] + [np.array([], dtype=str)]))
+    # The ids that the terms of each source have in the merged term dictionary
+    sources_term_ids = [np.searchsorted(terms, source.terms) for source in sources]
+
+    # The postings of a term in the merged index are the postings of that term in every source
+    term_counts = np.zeros(len(terms), dtype=np.int64)
+    for source, term_ids in zip(sources, sources_term_ids):
+        term_counts[term_ids] += np.diff(source.term_offsets)
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum(term_counts)
+    np.save(os.path.join(index_path, meta.INDEX_TERMS_FILENAME), terms)
+    np.save(os.path.join(index_path, meta.INDEX_TERM_OFFSETS_FILENAME), term_offsets)
+
+    doc_ids = create_array_file(os.path.join(index_path, meta.INDEX_DOC_IDS_FILENAME), np.int32, term_offsets[-1])
+    freqs = create_array_file(os.path.join(index_path, meta.INDEX_FREQS_FILENAME), np.int32, term_offsets[-1])
+    # The maximum weight of a term is the maximum of its weights in the sources (the weights of the documents
+    # don't change, since the max_freq and Ld of each document are the same)
+    term_max_weight = np.zeros(len(terms), dtype=np.float64)
+    for source, term_ids in zip(sources, sources_term_ids):
+        np.maximum.at(term_max_weight, term_ids, source.term_max_weight)
+    np.save(os.path.join(index_path, meta.INDEX_TERM_MAX_WEIGHT_FILENAME), term_max_weight)
+    # The same for the BM25 statistics of the terms, the length of each document doesn't change either
+    term_max_freq = np.zeros(len(terms), dtype=np.int32)
+    term_min_length_ratio = np.full(len(terms), np.inf, dtype=np.float64)
+    for source, term_ids in zip(sources, sources_term_ids):
+        np.maximum.at(term_max_freq, term_ids, source.term_max_freq)
+        np.minimum.at(term_min_length_ratio, term_ids, source.term_min_length_ratio)
+    np.save(os.path.join(index_path, meta.INDEX_TERM_MAX_FREQ_FILENAME), term_max_freq)
+    np.save(os.path.join(index_path, meta.INDEX_TERM_MIN_LENGTH_RATIO_FILENAME), term_min_length_ratio)
+
+    # The position in the merged postings where the next postings of each term will be written
+    next_positions = term_offsets[:-1].copy()
+    # The position of each posting of each source in the merged postings
+    sources_positions = []
+    doc_base = 0
+    for source, term_ids in zip(sources, sources_term_ids):
+        counts = np.diff(source.term_offsets)
+        source_doc_ids, source_freqs = source.get_all_postings()
+        # The position of each posting of the source in the merged postings
+        positions = np.repeat(next_positions[term_ids] - source.term_offsets[:-1], counts) \
+            + np.arange(len(source_doc_ids))
+        doc_ids[positions] = source_doc_ids + doc_base
+        freqs[positions] = source_freqs
+        sources_positions.append(positions)
+        next_positions[term_ids] += counts
+        doc_base += source.total_docs
+    doc_ids.flush()
+    freqs.flush()
+
+    # The documents tables are concatenated
+    total_docs = doc_base
+    doc_ld = np.concatenate([source.doc_ld for source in sources] + [np.zeros(0, dtype=np.float64)])
+    doc_max_freq = np.concatenate([source.doc_max_freq for source in sources] + [np.zeros(0, dtype=np.int32)])
+    merge_string_tables(os.path.join(index_path, meta.INDEX_DOC_URLS_FILENAME),
+                        [source.doc_urls for source in sources])
+    merge_string_tables(os.path.join(index_path, meta.INDEX_DOC_TITLES_FILENAME),
+                        [source.doc_titles for source in sources])
+    np.save(os.path.join(index_path, meta.INDEX_DOC_LD_FILENAME), doc_ld)
+    np.save(os.path.join(index_path, meta.INDEX_DOC_MAX_FREQ_FILENAME), doc_max_freq)
+    np.save(os.path.join(index_path, meta.INDEX_DOC_LENGTH_FILENAME),
+            np.concatenate([source.doc_length for source in sources] + [np.zeros(0, dtype=np.int32)]))
+    if meta.BUILD_IMPACT_ORDERED_POSTINGS:
+        PostingsIndex.save_impact_ordered_postings(index_path, term_offsets, doc_ids, freqs, doc_max_freq, doc_ld)
+
+    # k-way merge of the sources' urls, that are already sorted in each source
+    doc_bases = np.cumsum([0] + [source.total_docs for source in sources])
+    sorted_urls = heapq.merge(*[get_sorted_urls(source, int(source_doc_base))
+                                for source, source_doc_base in zip(sources, doc_bases)])
+    np.save(os.path.join(index_path, meta.INDEX_DOC_URL_ORDER_FILENAME),
+            np.fromiter((doc_id for _, doc_id in sorted_urls), dtype=np.int32, count=total_docs))
+
+    # The rows of the forward index are the rows of each source, with the ids of the merged term dictionary
+    forward_length = sum(len(source.forward_tf) for source in sources)
+    forward_indptr = create_array_file(os.path.join(index_path, meta.INDEX_FORWARD_INDPTR_FILENAME),
+                                       np.int64, total_docs + 1)
+    forward_term_ids = create_array_file(os.path.join(index_path, meta.INDEX_FORWARD_TERM_IDS_FILENAME),
+                                         np.int32, forward_length)
+    forward_tf = create_array_file(os.path.join(index_path, meta.INDEX_FORWARD_TF_FILENAME),
+                                   np.float64, forward_length)
+    forward_indptr[0] = 0
+    doc_base, forward_base = 0, 0
+    for source, term_ids in zip(sources, sources_term_ids):
+        source_length = len(source.forward_tf)
+        forward_indptr[doc_base + 1:doc_base + source.total_docs + 1] = source.forward_indptr[1:] + forward_base
+        forward_term_ids[forward_base:forward_base + source_length] = term_ids[source.forward_term_ids]
+        forward_tf[forward_base:forward_base + source_length] = source.forward_tf
+        doc_base += source.total_docs
+        forward_base += source_length
+    forward_indptr.flush()
+    forward_term_ids.flush()
+    forward_tf.flush()
+
+    # The position gaps of each posting are the same in the merged index, they are moved together with the posting.
+    # The merged index has positions only if all the sources have them
+    if meta.BUILD_POSITIONAL_POSTINGS and all(source.positional_postings is not None for source in sources):
+        value_offsets = np.zeros(len(freqs) + 1, dtype=np.int64)
+        value_offsets[1:] = np.cumsum(freqs)
+        position_gaps = create_array_file(os.path.join(index_path, meta.INDEX_POSITION_GAPS_FILENAME), np.int32,
+                                          value_offsets[-1])
+        for source, positions in zip(sources, sources_positions):
+            source_gaps = source.positional_postings.get_all_position_gaps()
+            source_freqs = freqs[positions]
+            position_gaps[np.repeat(value_offsets[positions] - (np.cumsum(source_freqs) - source_freqs), source_freqs)
+                          + np.arange(len(source_gaps))] = source_gaps
+        position_gaps.flush()
+        PositionalPostings.save(index_path, term_offsets, freqs, position_gaps)
+        del position_gaps
+        os.remove(os.path.join(index_path, meta.INDEX_POSITION_GAPS_FILENAME))
+
+    if meta.COMPRESS_POSTINGS:
+        CompressedPostings.save(index_path, term_offsets, doc_ids, freqs)
+        del doc_ids, freqs
+        os.remove(os.path.join(index_path, meta.INDEX_DOC_IDS_FILENAME))
+        os.remove(os.path.join(index_path, meta.INDEX_FREQS_FILENAME))
@@ -1,9 +1,13 @@
 import my_indexer
 import my_text_processor
+from my_segments import SegmentedIndex
+import metadata as meta
 import numpy as np
 import collections
+import threading
+import time
 import math
-import heapq
+import re
 
 
 def tf(freq_term, max_freq_term):
@@ -15,96 +19,432 @@ def idf(total_docs, docs_with_term):
     return np.log(1 + (total_docs / docs_with_term))
 
 
+# The tf of BM25, the frequency is saturated by k1 and normalized by the length of the document relative to
+# the average length. The constants are computed first, so it is a multiply-add and a division for each posting
+def bm25_tf(freq_term, doc_length, average_doc_length):
+    return freq_term * (meta.BM25_K1 + 1) / (freq_term + meta.BM25_K1 * (1 - meta.BM25_B)
+                                             + (meta.BM25_K1 * meta.BM25_B / average_doc_length) * doc_length)
+
+
+# The idf of BM25 (with the 1 + that keeps it positive for the terms of more than half of the documents)
+def bm25_idf(total_docs, docs_with_term):
+    return np.log(1 + (total_docs - docs_with_term + 0.5) / (docs_with_term + 0.5))
+
+
+# Cache of the results of the queries, with the least recently used query removed when the cache is full
+# and the results removed after ttl seconds. The key of a query is made of the frequencies of its stemmed terms
+# (so the queries with the same terms in a different order or case share their result), the k and the version
+# of the index that the result was found in. The cache is cleared when the index changes
+class ResultCache:
+
+    def __init__(self, max_size=meta.QUERY_CACHE_SIZE, ttl=meta.QUERY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        # { key : (expiration time, result) }, from the least recently used key to the most recently used key
+        self.results = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    # Returns the key of the query with the given frequencies of its terms, the ranking has the other options
+    # of the query that change its results (its phrases, the proximity and the ranking function)
+    @staticmethod
+    def get_key(terms_frequencies_dict, k, postings_budget=None, index_version=None, ranking=None):
+        return tuple(sorted(terms_frequencies_dict.items())), k, postings_budget, index_version, ranking
+
+    # Returns the result of the key, or None if the key is not in the cache (or its result has expired)
+    def get(self, key):
+        with self.lock:
+            cached = self.results.get(key)
+            if cached is not None and cached[0] is not None and cached[0] <= time.time():
+                del self.results[key]
+                self.expirations += 1
+                cached = None
+            if cached is None:
+                self.misses += 1
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+    def put(self, key, result):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.results[key] = (None if self.ttl is None else time.time() + self.ttl, result)
+            self.results.move_to_end(key)
+            if len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+    # Removes all the results, they were found in an index that has changed
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.invalidations += 1
+
+    # Returns the statistics of the cache
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self.results), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups > 0 else 0.0, "expirations": self.expirations,
+                    "invalidations": self.invalidations}
+
+
+# The state of a query that the relevance feedback needs: the query vector (with the changes of the feedback)
+# and the top k documents with their similarities. Every user (session) has the state of its own query,
+# the query processor itself keeps no state of the queries, so many queries can run at the same time
+class QueryState:
+
+    def __init__(self, query="", k=1):
+        self.query = query
+        self.k = k
+        self.query_vector = {}
+        # { document id : similarity } of the top k documents
+        self.accumulators = {}
+        # The feedback of the same query is given one at a time
+        self.lock = threading.Lock()
+
+
 class QueryProcessor:
 
     # Different weights constants for positive and negative feedback
     POS_FEEDBACK_W = 0.5
     NEG_FEEDBACK_W = -1 * 0.25
+    # The relative slack of the k-th score in the dynamic pruning, for the rounding errors of the floating point sums
+    PRUNING_SLACK = 1e-9
+
+    # indexer_update_processes parameter has no effect if parameter update_indexer_from_datafile is False,
+    # if it is None one indexer process for each cpu is used. If indexer_memory_budget_mb is given
+    # the index is updated by the single-pass indexer that keeps its memory under that budget
+    # If read_only is True the query processor is in serving mode: the index that is already saved on the disk
+    # is memory-mapped (it is neither loaded in memory nor rebuilt), so the other parameters have no effect.
+    # The segments that are added to the index (or compacted) after the start are picked up by the next query
+    def __init__(self, new_indexer=False, update_indexer_from_datafile=True, indexer_update_processes=None,
+                 indexer_memory_budget_mb=None, read_only=False):
+        # The state of the queries that are given without a state of their own (when there is only one user)
+        self.query_state = QueryState()
+        # The results of the recent queries, for the index version that they were found in
+        self.result_cache = ResultCache()
+        # Only one thread opens the new segments of the index
+        self.index_lock = threading.Lock()
+        # Warm start of the stem cache, with the words that the crawler has already stemmed
+        my_text_processor.TextProcessor.stem_cache.load(meta.STEM_TABLE_FILE_PATH)
+
+        if read_only:
+            # The compact inverted index (all of its segments) that the postings are read from
+            self.index = SegmentedIndex(mmap_mode='r')
+            return
 
-    # indexer_update_threads parameter has no effect if parameter update_indexer_from_datafile is False
-    def __init__(self, new_indexer=False, update_indexer_from_datafile=True, indexer_update_threads=1):
         create_new_indexer = my_indexer.InvertedIndexer.init_indexer(new_indexer)
 
-        self.query_vector = None
-        self.accumulators = None
-
         if update_indexer_from_datafile or create_new_indexer:
-            my_indexer.update_indexer(number_of_threads=indexer_update_threads)
-
-    def update_accumulator_for_term(self, term, tf_tq):
+            my_indexer.update_indexer(number_of_processes=indexer_update_processes,
+                                      memory_budget_mb=indexer_memory_budget_mb)
+
+        # The compact inverted index (all of its segments) that the postings are read from
+        self.index = SegmentedIndex()
+
+    # Returns the index that a query uses from its start to its end. If the manifest has changed (new segments
+    # were added or segments were compacted) a new SegmentedIndex with the new segments replaces the old one,
+    # the queries that are still running keep using the old one
+    def get_index(self):
+        index = self.index
+        if index.get_manifest_modification_time() != index.manifest_modification_time:
+            with self.index_lock:
+                if self.index is index:
+                    self.index = SegmentedIndex(index.index_path, index.mmap_mode)
+                    # The cached results of the old segments are not used again, since the key has the index version
+                    self.result_cache.clear()
+        return self.index
+
+    # Returns the idf function of the ranking
+    @staticmethod
+    def get_idf_function(ranking=meta.DEFAULT_RANKING):
+        return bm25_idf if ranking == meta.RANKING_BM25 else idf
+
+    # Returns the idf of each of the terms, from the statistics of the whole collection if they are given
+    # as (total_docs, { term : n_t }, total length of the documents), the statistics of all the shards of a sharded
+    # index, or else from the index
+    @staticmethod
+    def get_idf(index, terms, collection_statistics=None, ranking=meta.DEFAULT_RANKING):
+        idf_function = QueryProcessor.get_idf_function(ranking)
+        if collection_statistics is None:
+            return idf_function(index.total_docs, index.get_document_frequencies(terms))
+        total_docs, document_frequencies, _ = collection_statistics
+        return idf_function(total_docs, np.array([document_frequencies[term] for term in terms], dtype=np.int64))
+
+    # Returns the average length of the documents (for BM25), of the whole collection if its statistics are given
+    @staticmethod
+    def get_average_doc_length(index, collection_statistics=None):
+        if collection_statistics is None:
+            return index.total_doc_length / max(index.total_docs, 1)
+        total_docs, _, total_doc_length = collection_statistics
+        return total_doc_length / max(total_docs, 1)
+
+    # Returns the weights of the postings (doc_ids, freqs) in the scores of the documents, without the idf of the
+    # term and its weight in the query: freq/(max_freq*Ld) for the cosine similarity and the tf of BM25 for BM25
+    @staticmethod
+    def get_posting_weights(index, doc_ids, freqs, ranking=meta.DEFAULT_RANKING, average_doc_length=None):
+        if ranking == meta.RANKING_BM25:
+            return bm25_tf(freqs, index.get_doc_length(doc_ids), average_doc_length)
+        return tf(freqs, index.get_doc_max_freq(doc_ids)) / index.get_doc_ld(doc_ids)
+
+    # Returns the weight of each query term in the scores of the documents, its idf times its weight in the query.
+    # The cosine similarity is also divided by the length of the query lq, BM25 doesn't normalize the query
+    @staticmethod
+    def get_term_weights(idf_t, tf_tq, lq, ranking=meta.DEFAULT_RANKING):
+        if ranking == meta.RANKING_BM25:
+            return idf_t * tf_tq
+        return idf_t * tf_tq / lq
+
+    # Returns the terms of the query vector that exist in the index (in any documents), with their idf
+    # and their weights in the query
+    @staticmethod
+    def get_query_terms(index, query_vector, collection_statistics=None, ranking=meta.DEFAULT_RANKING):
+        terms = list(query_vector.keys())
+        document_frequencies = index.get_document_frequencies(terms)
+        terms = [term for term, n_t in zip(terms, document_frequencies.tolist()) if n_t > 0]
+        if collection_statistics is None:
+            idf_t = QueryProcessor.get_idf_function(ranking)(index.total_docs,
+                                                             document_frequencies[document_frequencies > 0])
+        else:
+            idf_t = QueryProcessor.get_idf(index, terms, collection_statistics, ranking)
+        tf_tq = np.array([query_vector[term] for term in terms])
+        return terms, idf_t, tf_tq
+
+    @staticmethod
+    def update_accumulator_for_term(index, accumulators, term, tf_tq, collection_statistics=None,
+                                    ranking=meta.DEFAULT_RANKING):
         # The number of total documents
-        total_docs = len(my_indexer.InvertedIndexer.documents_metadata)
+        total_docs = index.total_docs if collection_statistics is None else collection_statistics[0]
 
-        # Searching term in the indexer
-        term_indexer = my_indexer.InvertedIndexer.indexer.get(term)
+        # Searching term in the index
+        postings = index.get_postings(term)
 
-        # Structure of term_indexer: { term : [n_t, [(doc_0, term_count_in_doc_0), ... , (doc_n, term_count_in_doc_n)]]}
+        # Structure of postings: (doc_ids, freqs), the arrays with the ids of the documents that contain the term
+        # and the frequency of the term in each of these documents
 
-        # If the term exists in the indexer (in any documents)
-        if term_indexer is not None:
+        # If the term exists in the index (in any documents)
+        if postings is not None:
+            doc_ids, freqs = postings
 
             # The number of docs that contain the term
-            n_t = term_indexer[0]
+            n_t = len(doc_ids) if collection_statistics is None else collection_statistics[1][term]
 
             # Calculate idf for the term
-            idf_t = idf(total_docs, n_t)
-
-            # This is the array with the items that have the document's url with
-            # the frequency of the term in the current document
-            doc_indexer = term_indexer[1]
-
-            # For all the documents that contain this term/word,
-            # Take name/url of the document
-            # and the frequency of the term in the current document
-            for document, freq_td in doc_indexer:
-
-                # The max_frequency of among all the terms in that document
-                max_freq_doc = my_indexer.InvertedIndexer.documents_metadata.get(document)[1]
-
-                # Calculating tf for the term
-                tf_td = tf(freq_td, max_freq_doc)
-
-                # Updating accumulator with the updated score of the tf-idf weight
-                doc_score = self.accumulators.get(document)
-                if doc_score is not None:
-                    updated_score = doc_score + (tf_td * idf_t) * tf_tq
-                    self.accumulators[document] = updated_score
-                else:
-                    self.accumulators[document] = (tf_td * idf_t) * tf_tq
-
-    # Update the accumulators in order to keep only the top k documents,
-    # return the top-k of the documents with their titles
-    def get_top_k_documents_title_dict(self, k=1):
-
-        # The top k largest keys in the dictionary of accumulators
-        # Using heapq in order to return the top k documents in an efficient time of O(n log k)
-        top_k_keys = heapq.nlargest(k, self.accumulators, key=self.accumulators.get)
+            idf_t = QueryProcessor.get_idf_function(ranking)(total_docs, n_t)
+
+            if ranking == meta.RANKING_BM25:
+                # Calculating the BM25 tf for the term in all the documents that contain it at once,
+                # with the length of each document
+                tf_td = bm25_tf(freqs, index.get_doc_length(doc_ids),
+                                QueryProcessor.get_average_doc_length(index, collection_statistics))
+            else:
+                # Calculating tf for the term in all the documents that contain this term/word at once,
+                # by dividing with the max_frequency among all the terms of each document
+                tf_td = tf(freqs, index.get_doc_max_freq(doc_ids))
+
+            # Keeping the tf-idf weights of the term for all of its postings,
+            # they are added to the accumulators of the documents in get_accumulators
+            accumulators[0].append(doc_ids)
+            accumulators[1].append((tf_td * idf_t) * tf_tq)
+
+    # Sums the weights of all the terms that were added with update_accumulator_for_term for each document,
+    # returns the array with the ids of the documents that have a score and the array with their scores
+    @staticmethod
+    def get_accumulators(accumulators):
+        if len(accumulators[0]) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+
+        # Finding the distinct documents, inverse has the position of the document of each posting in doc_ids
+        doc_ids, inverse = np.unique(np.concatenate(accumulators[0]), return_inverse=True)
+        # Summing the weights of the postings for each document (in the same order that the terms were added)
+        scores = np.bincount(inverse.ravel(), weights=np.concatenate(accumulators[1]), minlength=len(doc_ids))
+        return doc_ids, scores
+
+    # Returns the documents (with their similarities) that can be in the top k documents of the query vector,
+    # with the MaxScore dynamic pruning. The terms are processed from the one with the biggest upper bound of score
+    # (tf_tq*idf_t*max_weight_t/lq) to the one with the smallest, adding their scores to an accumulator of every
+    # document. The postings of a term are read completely only while a document that has no score yet could still
+    # reach the top k (the sum of the upper bounds of the remaining terms is not less than the k-th score so far).
+    # After that, only the candidates that can still reach the k-th score are kept, and the postings of the
+    # remaining terms are only probed for them. The scores of the candidates that are left in the end are computed
+    # again in the order of the query terms, so the similarities are exactly the ones of the exhaustive evaluation.
+    # The upper bound of a term's BM25 scores is the BM25 tf of its maximum freq and minimum length/freq
+    @staticmethod
+    def get_max_score_similarities(index, query_vector, lq, k, collection_statistics=None,
+                                   ranking=meta.DEFAULT_RANKING):
+        total_docs = index.total_docs
+        terms, idf_t, tf_tq = QueryProcessor.get_query_terms(index, query_vector, collection_statistics, ranking)
+        if len(terms) == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        average_doc_length = QueryProcessor.get_average_doc_length(index, collection_statistics)
+        term_weights = QueryProcessor.get_term_weights(idf_t, tf_tq, lq, ranking)
+        if ranking == meta.RANKING_BM25:
+            term_max_freqs, term_min_length_ratios = index.get_term_bm25_statistics(terms)
+            upper_bounds = term_weights * bm25_tf(term_max_freqs, term_min_length_ratios * term_max_freqs,
+                                                  average_doc_length)
+        else:
+            upper_bounds = term_weights * index.get_term_max_weights(terms)
+
+        # remaining_bounds[i] is the sum of the upper bounds of the i-th term (in the order of the upper bounds)
+        # and all the terms after it
+        order = np.argsort(-upper_bounds, kind='stable')
+        remaining_bounds = np.append(np.cumsum(upper_bounds[order][::-1])[::-1], 0)
+
+        # The accumulator of every document, and the position (in the order) of the last term read completely
+        # that each document contains (-1 for the documents that don't contain any of the terms read so far)
+        partial_scores = np.zeros(total_docs, dtype=np.float64)
+        last_term_positions = np.full(total_docs, -1, dtype=np.int32)
+        # The (at most) k documents with the biggest scores so far
+        top_doc_ids = np.zeros(0, dtype=np.int64)
+        candidates = None
+        threshold = 0.0
+        for position, term_number in enumerate(order.tolist()):
+            term = terms[term_number]
+            term_weight = term_weights[term_number]
+            if candidates is None and remaining_bounds[position] < threshold:
+                # No new document can reach the top k, from now on only the candidates are scored
+                candidates = np.flatnonzero((last_term_positions >= 0)
+                                            & (partial_scores + remaining_bounds[position] >= threshold))
+                partial_scores = partial_scores[candidates]
+
+            if candidates is None:
+                doc_ids, freqs = index.get_postings(term)
+                partial_scores[doc_ids] += QueryProcessor.get_posting_weights(index, doc_ids, freqs, ranking,
+                                                                              average_doc_length) * term_weight
+                last_term_positions[doc_ids] = position
+                # Only the scores of the term's documents have changed, so the new top k documents are
+                # the top k of the term's documents and the previous top k documents
+                top_doc_ids = np.concatenate((top_doc_ids[last_term_positions[top_doc_ids] != position], doc_ids))
+                if len(top_doc_ids) > k:
+                    top_doc_ids = top_doc_ids[np.argpartition(-partial_scores[top_doc_ids], k - 1)[:k]]
+                top_scores = partial_scores[top_doc_ids]
+            else:
+                freqs = index.get_term_frequencies(term, candidates)
+                found = freqs > 0
+                partial_scores[found] += QueryProcessor.get_posting_weights(index, candidates[found], freqs[found],
+                                                                            ranking, average_doc_length) * term_weight
+                top_scores = partial_scores
+
+            # The k-th score so far (minus a slack for the rounding errors of the floating point sums),
+            # the final k-th score can only be bigger, since the scores of the terms are not negative
+            if len(top_scores) >= k:
+                threshold = np.partition(top_scores, len(top_scores) - k)[len(top_scores) - k] \
+                    * (1 - QueryProcessor.PRUNING_SLACK)
+            # Dropping the candidates that can't reach the threshold even with all the remaining terms
+            if candidates is not None:
+                can_reach_threshold = partial_scores + remaining_bounds[position + 1] >= threshold
+                candidates, partial_scores = candidates[can_reach_threshold], partial_scores[can_reach_threshold]
+
+        # The candidates are the documents that have reached the threshold
+        if candidates is None:
+            candidates = np.flatnonzero((last_term_positions >= 0) & (partial_scores >= threshold))
+
+        return candidates, QueryProcessor.get_exact_similarities(index, candidates, terms, idf_t, tf_tq, lq,
+                                                                 ranking, average_doc_length)
+
+    # Returns the similarities of the candidates (sorted document ids), computed in the same way (and order) as
+    # the update_accumulator_for_term, the postings of the terms are only probed for the candidates
+    @staticmethod
+    def get_exact_similarities(index, candidates, terms, idf_t, tf_tq, lq, ranking=meta.DEFAULT_RANKING,
+                               average_doc_length=None):
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        if ranking == meta.RANKING_BM25:
+            doc_length = index.get_doc_length(candidates)
+            for term_number, term in enumerate(terms):
+                freqs = index.get_term_frequencies(term, candidates)
+                found = freqs > 0
+                scores[found] += (bm25_tf(freqs[found], doc_length[found], average_doc_length)
+                                  * idf_t[term_number]) * tf_tq[term_number]
+            return scores
+
+        doc_max_freq = index.get_doc_max_freq(candidates)
+        for term_number, term in enumerate(terms):
+            freqs = index.get_term_frequencies(term, candidates)
+            found = freqs > 0
+            scores[found] += (tf(freqs[found], doc_max_freq[found]) * idf_t[term_number]) * tf_tq[term_number]
+        return scores/(index.get_doc_ld(candidates)*lq)
+
+    # Returns the approximate top k documents of the query vector (with their exact similarities), reading at most
+    # postings_budget postings from the impact ordered postings. The postings of all the terms are read
+    # in the order of their score (the impact of the posting times the weight of the term), the biggest first,
+    # so the budget is spent on the postings that add the most to the scores. The top k documents of these scores
+    # are the candidates, their similarities are computed exactly. The impact order is the order of the cosine weights,
+    # with BM25 the postings are read in the same order and scored with BM25
+    @staticmethod
+    def get_impact_ordered_similarities(index, query_vector, lq, k, postings_budget, collection_statistics=None,
+                                        ranking=meta.DEFAULT_RANKING):
+        terms, idf_t, tf_tq = QueryProcessor.get_query_terms(index, query_vector, collection_statistics, ranking)
+        if len(terms) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        average_doc_length = QueryProcessor.get_average_doc_length(index, collection_statistics)
+        term_weights = QueryProcessor.get_term_weights(idf_t, tf_tq, lq, ranking)
+
+        # The first postings of each term are enough, no more than postings_budget postings of a term can be read
+        terms_doc_ids, terms_scores = [], []
+        for term_number, term in enumerate(terms):
+            doc_ids, freqs = index.get_impact_postings(term, postings_budget)
+            terms_doc_ids.append(doc_ids)
+            terms_scores.append(QueryProcessor.get_posting_weights(index, doc_ids, freqs, ranking, average_doc_length)
+                                * term_weights[term_number])
+        doc_ids, posting_scores = np.concatenate(terms_doc_ids), np.concatenate(terms_scores)
+        if len(posting_scores) > postings_budget:
+            read_postings = np.argpartition(-posting_scores, postings_budget - 1)[:postings_budget]
+            doc_ids, posting_scores = doc_ids[read_postings], posting_scores[read_postings]
+
+        # The top k documents of the approximate scores (with the smaller document id first if the scores are equal)
+        doc_ids, inverse = np.unique(doc_ids, return_inverse=True)
+        approximate_scores = np.bincount(inverse.ravel(), weights=posting_scores, minlength=len(doc_ids))
+        candidates = np.sort(doc_ids[np.lexsort((doc_ids, -approximate_scores))[:k]])
+        return candidates, QueryProcessor.get_exact_similarities(index, candidates, terms, idf_t, tf_tq, lq,
+                                                                 ranking, average_doc_length)
+
+    # Returns the top k documents with their similarities (the new accumulators of the query)
+    # and the top-k of the documents with their titles
+    @staticmethod
+    def get_top_k_documents_title_dict(index, doc_ids, scores, k=1):
+        # No documents are wanted
+        if k <= 0:
+            return {}, {}
+
+        # The top k largest scores, using argpartition in order to find them in O(n) time
+        # and then sorting only the k documents (with the smaller document id first if the scores are equal)
+        if k < len(scores):
+            kth_score = scores[np.argpartition(-scores, k - 1)[:k]].min()
+            # Keeping all the documents with a score equal to the k-th score, in order to pick them by id
+            candidates = np.flatnonzero(scores >= kth_score)
+        else:
+            candidates = np.arange(len(scores))
+        top_k_keys = candidates[np.lexsort((doc_ids[candidates], -scores[candidates]))[:k]]
 
         top_k_accumulator = {}
         top_k_documents_title_dict = {}
 
         # Adding the top_k documents with their similarities in a new dictionary,
         # also adding the top_k documents with their titles in a another dictionary that will be returned
-        for document in top_k_keys:
-            top_k_accumulator.update({document: self.accumulators.get(document)})
-            doc_title = my_indexer.InvertedIndexer.documents_metadata.get(document)[2]
-            top_k_documents_title_dict.update({document: doc_title})
-
-        # Update the accumulator to have only the top k documents
-        self.accumulators = top_k_accumulator        
-
-        return top_k_documents_title_dict
-
-    def top_k(self, query, k=1):
-        self.query_vector = {}
-
-        # Initialise Accumulators
-        self.accumulators = {}
-
+        for position in top_k_keys.tolist():
+            document = int(doc_ids[position])
+            top_k_accumulator.update({document: float(scores[position])})
+            doc_title = index.get_title(document)
+            top_k_documents_title_dict.update({index.get_url(document): doc_title})
+
+        return top_k_accumulator, top_k_documents_title_dict
+
+    # Returns the frequencies of the terms of the query, the query vector (the tf of each term) and the length
+    # of the query vector, or None if the query has no useful words
+    @staticmethod
+    def get_query_vector(query):
         # Applying the same pre-processing on the queries that was used in the crawler
         query_terms = my_text_processor.TextProcessor.get_useful_word_list(query, stemming=True)
         if len(query_terms) == 0:
-            return {}
+            return None
         # The frequencies of the terms in the query
         terms_frequencies_dict = collections.Counter(query_terms)
         #  The frequency of the most frequent term in the query
@@ -112,105 +452,299 @@ class QueryProcessor:
         #  The length of the vectors of the query
         lq = math.sqrt(sum([x ** 2 for x in terms_frequencies_dict.values()])) / max_freq_query
 
-        # For every term in query update the accumulator for that term
+        query_vector = {}
         for term in terms_frequencies_dict.keys():
             # Updating the query vector's weights (the tf of that term)
             freq_tq = terms_frequencies_dict.get(term)  # The frequency of this term in the query
             tf_tq = tf(freq_tq, max_freq_query)
-            self.query_vector.update({term: tf_tq})
+            query_vector.update({term: tf_tq})
+        return terms_frequencies_dict, query_vector, lq
+
+    # Returns the documents of the index that can be in the top k documents of the query vector
+    # with their similarities (see top_k for dynamic_pruning, postings_budget and ranking)
+    @staticmethod
+    def get_similarities(index, query_vector, lq, k, dynamic_pruning=True, postings_budget=None,
+                         collection_statistics=None, ranking=meta.DEFAULT_RANKING):
+        if postings_budget is not None:
+            return QueryProcessor.get_impact_ordered_similarities(index, query_vector, lq, k, postings_budget,
+                                                                  collection_statistics, ranking)
+        if dynamic_pruning:
+            return QueryProcessor.get_max_score_similarities(index, query_vector, lq, k, collection_statistics,
+                                                             ranking)
+
+        # Initialise Accumulators, the lists with the postings' document ids and weights of each term
+        accumulators = ([], [])
 
-            # Update the documents' accumulator for that term
-            self.update_accumulator_for_term(term, tf_tq)
+        # For every term in query update the accumulator for that term
+        for term, tf_tq in query_vector.items():
+            QueryProcessor.update_accumulator_for_term(index, accumulators, term, tf_tq, collection_statistics,
+                                                       ranking)
 
+        doc_ids, scores = QueryProcessor.get_accumulators(accumulators)
+        if ranking == meta.RANKING_BM25:
+            return doc_ids, scores
         # Updating similarities of accumulators based on the lengths
-        for document in self.accumulators.keys():
-            ld = my_indexer.InvertedIndexer.documents_metadata.get(document)[0]
-            similarity = self.accumulators.get(document)/(ld*lq)
-            self.accumulators.update({document: similarity})
+        return doc_ids, scores/(index.get_doc_ld(doc_ids)*lq)
+
+    # Returns the terms of each phrase of the query (the words in double quotes) with the same pre-processing
+    # as the query terms, only the phrases with more than one term
+    @staticmethod
+    def get_query_phrases(query):
+        phrases = []
+        for phrase in re.findall('"([^"]*)"', query):
+            phrase_terms = my_text_processor.TextProcessor.get_useful_word_list(phrase, stemming=True)
+            if len(phrase_terms) > 1:
+                phrases.append(tuple(phrase_terms))
+        return tuple(phrases)
+
+    # Returns True if the terms of the phrase are next to each other (in the order of the phrase) in a document,
+    # with the positions of the terms in the document { term : positions }
+    @staticmethod
+    def has_phrase(terms_positions, phrase):
+        phrase_starts = terms_positions[phrase[0]]
+        for offset, term in enumerate(phrase[1:], 1):
+            phrase_starts = phrase_starts[np.isin(phrase_starts + offset, terms_positions[term])]
+        return len(phrase_starts) > 0
+
+    # Returns the proximity of the query terms in a document, with the positions of each query term in the document.
+    # The number of the query terms in the smallest window of the document that has all the query terms of
+    # the document, divided by the length of the window and multiplied by the fraction of the query terms that
+    # the document has. It is 1 when the document has all the query terms next to each other, and 0 when it has
+    # fewer than two of them
+    @staticmethod
+    def get_proximity(terms_positions):
+        number_of_terms = len(terms_positions)
+        terms_positions = [positions for positions in terms_positions if len(positions) > 0]
+        if len(terms_positions) < 2:
+            return 0.0
+        # The positions of all the query terms in the document, with the term of each position
+        positions = np.concatenate(terms_positions)
+        position_terms = np.repeat(np.arange(len(terms_positions)), [len(term) for term in terms_positions])
+        order = np.argsort(positions, kind='stable')
+        positions, position_terms = positions[order].tolist(), position_terms[order].tolist()
+
+        # Sliding window over the positions, the smallest window with all the terms
+        window_term_counts = [0] * len(terms_positions)
+        missing_terms = len(terms_positions)
+        smallest_window = None
+        window_start = 0
+        for position, term in zip(positions, position_terms):
+            if window_term_counts[term] == 0:
+                missing_terms -= 1
+            window_term_counts[term] += 1
+            while missing_terms == 0:
+                window = position - positions[window_start] + 1
+                if smallest_window is None or window < smallest_window:
+                    smallest_window = window
+                window_term_counts[position_terms[window_start]] -= 1
+                if window_term_counts[position_terms[window_start]] == 0:
+                    missing_terms += 1
+                window_start += 1
+        return (len(terms_positions) / smallest_window) * (len(terms_positions) / number_of_terms)
+
+    # Returns the documents that contain all the terms of the phrases, with their exact similarities.
+    # The postings of the rarest term of the phrases are probed for the other terms of the phrases
+    @staticmethod
+    def get_phrase_terms_similarities(index, query_vector, lq, phrases, collection_statistics=None,
+                                      ranking=meta.DEFAULT_RANKING):
+        terms, idf_t, tf_tq = QueryProcessor.get_query_terms(index, query_vector, collection_statistics, ranking)
+        phrase_terms = sorted(set(term for phrase in phrases for term in phrase))
+        if not set(phrase_terms).issubset(terms):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        document_frequencies = index.get_document_frequencies(phrase_terms)
+        rarest_term = phrase_terms[int(np.argmin(document_frequencies))]
+        candidates = index.get_postings(rarest_term)[0]
+        for term in phrase_terms:
+            if term != rarest_term:
+                candidates = candidates[index.get_term_frequencies(term, candidates) > 0]
+        return candidates, QueryProcessor.get_exact_similarities(
+            index, candidates, terms, idf_t, tf_tq, lq, ranking,
+            QueryProcessor.get_average_doc_length(index, collection_statistics))
+
+    # Scores again the candidates (sorted document ids) with the positions of the query terms in them,
+    # from the candidate with the biggest similarity to the smallest, in batches of (at least) PROXIMITY_CANDIDATES
+    # candidates. The candidates that don't have all the phrases of the query are removed and the batches are read
+    # until enough candidates with the phrases are found, without phrases only the first batch is read.
+    # If proximity is True, the similarities are multiplied by the proximity boost of the query terms.
+    # Only the positions of the candidates of the batches are decoded, the candidates of the segments
+    # without positions keep their similarities. Returns the candidates of the batches with their new scores
+    @staticmethod
+    def rerank_by_positions(index, doc_ids, similarities, k, query_terms, phrases=(), proximity=False):
+        batch_size = max(k, meta.PROXIMITY_CANDIDATES)
+        order = np.lexsort((doc_ids, -similarities))
+        ranked_doc_ids, ranked_scores = [], []
+        for batch_start in range(0, len(order), batch_size):
+            batch = np.sort(order[batch_start:batch_start + batch_size])
+            batch_terms_positions = [index.get_positions(term, doc_ids[batch]) for term in query_terms]
+            for candidate_number, candidate in enumerate(batch.tolist()):
+                terms_positions = [term_positions[candidate_number] for term_positions in batch_terms_positions]
+                score = float(similarities[candidate])
+                if terms_positions[0] is not None:
+                    terms_positions_dict = dict(zip(query_terms, terms_positions))
+                    if not all(QueryProcessor.has_phrase(terms_positions_dict, phrase) for phrase in phrases):
+                        continue
+                    if proximity:
+                        score *= 1 + meta.PROXIMITY_WEIGHT * QueryProcessor.get_proximity(terms_positions)
+                ranked_doc_ids.append(int(doc_ids[candidate]))
+                ranked_scores.append(score)
+            if len(phrases) == 0 or len(ranked_doc_ids) >= batch_size:
+                break
+        return np.array(ranked_doc_ids, dtype=np.int64), np.array(ranked_scores, dtype=np.float64)
+
+    # Returns the documents that can be in the top k documents of the query with their scores, the similarities of
+    # get_similarities with the phrases and the proximity of the query terms (see top_k). The query terms are
+    # the terms of the query vector, in the order of the query
+    @staticmethod
+    def get_positional_similarities(index, query_vector, lq, k, dynamic_pruning=True, postings_budget=None,
+                                    collection_statistics=None, phrases=(), proximity=False,
+                                    ranking=meta.DEFAULT_RANKING):
+        proximity = proximity and len(query_vector) > 1 and meta.PROXIMITY_WEIGHT > 0
+        if len(phrases) > 0:
+            doc_ids, similarities = QueryProcessor.get_phrase_terms_similarities(index, query_vector, lq, phrases,
+                                                                                 collection_statistics, ranking)
+        elif proximity:
+            doc_ids, similarities = QueryProcessor.get_similarities(index, query_vector, lq,
+                                                                    max(k, meta.PROXIMITY_CANDIDATES),
+                                                                    dynamic_pruning, postings_budget,
+                                                                    collection_statistics, ranking)
+        else:
+            return QueryProcessor.get_similarities(index, query_vector, lq, k, dynamic_pruning, postings_budget,
+                                                   collection_statistics, ranking)
+        return QueryProcessor.rerank_by_positions(index, doc_ids, similarities, k, list(query_vector.keys()),
+                                                  phrases, proximity)
+
+    # With dynamic_pruning the top k documents are found with the MaxScore pruning instead of scoring every posting
+    # of every query term, the top k documents and their similarities are the same.
+    # With a postings_budget the top k documents are approximate, at most postings_budget postings are read
+    # from the impact ordered postings.
+    # The words of the query in double quotes are phrases, only the documents that have the words of each phrase
+    # next to each other are found. With proximity (off by default, the similarities are then the ones of the ranking)
+    # the similarities of the top candidates of a query with many terms are boosted when the query terms are close
+    # to each other in the document (see get_proximity). The phrases and the proximity need the positions of the index,
+    # the documents of the segments without positions keep their similarities
+    # The ranking is the scoring function of the query, meta.RANKING_COSINE for the cosine similarity of the tf-idf
+    # vectors or meta.RANKING_BM25 for BM25 (with the lengths of the documents that are saved in the index)
+    # The results are kept in the result cache, a query with the same terms, k, postings_budget, phrases,
+    # proximity and ranking is answered from the cache until the index changes.
+    # The query vector and the top k documents are kept in the query_state (for the relevance feedback),
+    # or in the query processor's own state if no query_state is given
+    def top_k(self, query, k=1, dynamic_pruning=True, postings_budget=None, query_state=None, proximity=False,
+              ranking=meta.DEFAULT_RANKING):
+        # Using the new segments of the index, if any, the same index is used until the end of the query
+        index = self.get_index()
+
+        if query_state is None:
+            query_state = self.query_state
+        query_state.query = query
+        query_state.k = k
+        query_state.query_vector = {}
+        query_state.accumulators = {}
+
+        query_vector_result = QueryProcessor.get_query_vector(query)
+        if query_vector_result is None:
+            return {}
+        terms_frequencies_dict, query_state.query_vector, lq = query_vector_result
+        phrases = QueryProcessor.get_query_phrases(query)
+
+        # The top k documents and their similarities are the same with or without the dynamic pruning
+        cache_key = ResultCache.get_key(terms_frequencies_dict, k, postings_budget, index.version,
+                                        (phrases, proximity, ranking))
+        cached_result = self.result_cache.get(cache_key)
+        if cached_result is not None:
+            top_k_accumulator, top_k_documents_title_dict = cached_result
+            query_state.accumulators = dict(top_k_accumulator)
+            return dict(top_k_documents_title_dict)
+
+        doc_ids, similarities = QueryProcessor.get_positional_similarities(index, query_state.query_vector, lq, k,
+                                                                           dynamic_pruning, postings_budget,
+                                                                           phrases=phrases, proximity=proximity,
+                                                                           ranking=ranking)
 
         # Update the accumulators in order to keep only the top k documents,
         # return the top-k of the documents with their titles
-        return self.get_top_k_documents_title_dict(k)
+        top_k_accumulator, top_k_documents_title_dict = \
+            QueryProcessor.get_top_k_documents_title_dict(index, doc_ids, similarities, k)
+        query_state.accumulators = top_k_accumulator
+        self.result_cache.put(cache_key, (dict(top_k_accumulator), dict(top_k_documents_title_dict)))
+        return top_k_documents_title_dict
 
-    def top_k_feedback(self, k=1):
-        # Initialise Accumulators
-        self.accumulators = {}
+    @staticmethod
+    def top_k_feedback(index, query_state, k=1, collection_statistics=None):
+        # Initialise Accumulators, the lists with the postings' document ids and weights of each term
+        accumulators = ([], [])
 
         # For every term in query update the accumulator for that term
-        for term in self.query_vector.keys():
-            tf_tq = self.query_vector.get(term)
-            self.update_accumulator_for_term(term, tf_tq)
+        for term in query_state.query_vector.keys():
+            tf_tq = query_state.query_vector.get(term)
+            QueryProcessor.update_accumulator_for_term(index, accumulators, term, tf_tq, collection_statistics)
 
         # Updating similarities of accumulators based on the lengths
-        for document in self.accumulators.keys():
-            ld = my_indexer.InvertedIndexer.documents_metadata.get(document)[0]
-            similarity = self.accumulators.get(document)/ld
-            self.accumulators.update({document: similarity})
+        doc_ids, scores = QueryProcessor.get_accumulators(accumulators)
+        similarities = scores/index.get_doc_ld(doc_ids)
 
         # Update the accumulators in order to keep only the top k documents,
         # return the top-k of the documents with their titles
-        return self.get_top_k_documents_title_dict(k)
+        query_state.accumulators, top_k_documents_title_dict = \
+            QueryProcessor.get_top_k_documents_title_dict(index, doc_ids, similarities, k)
+        return top_k_documents_title_dict
 
-    def feedback(self, feedback_docs, k):
-        # import time
-        # start = time.time()
-        relevant_docs = set(feedback_docs)
+    # Returns the judged documents with the weight of each one, the positive weight for the relevant documents
+    # and the negative weight for the other documents of the top k documents
+    @staticmethod
+    def get_judged_documents(relevant_docs, top_k_documents):
         non_relevant_docs = set()
-        for document in self.accumulators.keys():
+        for document in top_k_documents:
             if document not in relevant_docs:
                 non_relevant_docs.add(document)
 
-        meta_data_docs = my_indexer.InvertedIndexer.documents_metadata
-
-        # The number of total documents
-        total_docs = len(meta_data_docs)
-
-        # The inverted indexer with the terms as keys
-        indexer = my_indexer.InvertedIndexer.indexer
-
-        for term in indexer:
-            term_indexer = indexer.get(term)
-
-            # The number of docs that contain the term
-            n_t = term_indexer[0]
-
-            # Calculate idf for the term
-            idf_t = idf(total_docs, n_t)
-
-            # This is the array with the items that have the document's url with
-            # the frequency of the term in the current document
-            doc_indexer = term_indexer[1]
-
-            # For every document that contains the term make changes to the "query vector"
-            for document, freq_td in doc_indexer:
-
-                set_of_document = None
-                weight = None
-
-                if document in relevant_docs:
-                    set_of_document = relevant_docs
-                    # Since the document had positive feedback multiply with positive weight
-                    weight = QueryProcessor.POS_FEEDBACK_W
-
-                elif document in non_relevant_docs:
-                    set_of_document = non_relevant_docs
-                    # Since the document had negative feedback multiply with negative weight
-                    weight = QueryProcessor.NEG_FEEDBACK_W
-
-                if set_of_document is not None:
-                    max_freq_doc = meta_data_docs.get(document)[1]
-                    tf_td = tf(freq_td, max_freq_doc)
-
-                    # If the term already exists in the keys of the dictionary then take the previous value,
-                    # else start from 0
-                    prev_total = self.query_vector.get(term)
-                    if prev_total is None:
-                        prev_total = 0
-
-                    # Update the query vector
-                    self.query_vector.update({term: prev_total + (weight * (idf_t * tf_td))/len(set_of_document)})
-
-        # print("Total time for feedback: ", (time.time() - start))
-        return self.top_k_feedback(k)
-
-
+        judged_docs = []
+        judged_docs_weights = []
+        for set_of_document, weight in ((relevant_docs, QueryProcessor.POS_FEEDBACK_W),
+                                        (non_relevant_docs, QueryProcessor.NEG_FEEDBACK_W)):
+            for document in sorted(set_of_document):
+                judged_docs.append(document)
+                judged_docs_weights.append(weight/len(set_of_document))
+        return judged_docs, judged_docs_weights
+
+    # Adds the weight changes of the terms to the query vector
+    @staticmethod
+    def update_query_vector(query_vector, terms, weight_changes):
+        # Make changes to the "query vector" for every term of the judged documents
+        for term, weight_change in zip(terms, weight_changes.tolist()):
+
+            # If the term already exists in the keys of the dictionary then take the previous value,
+            # else start from 0
+            prev_total = query_vector.get(term)
+            if prev_total is None:
+                prev_total = 0
+
+            # Update the query vector
+            query_vector.update({term: prev_total + weight_change})
+
+    # The feedback is given for the query of the query_state (or for the last query without a state of its own),
+    # the query vector of the query_state is changed by the feedback. The query vector is a tf-idf vector,
+    # so the documents of the feedback are ranked with the cosine similarity whatever the ranking of the query
+    def feedback(self, feedback_docs, k, query_state=None):
+        index = self.get_index()
+        if query_state is None:
+            query_state = self.query_state
+
+        with query_state.lock:
+            # The feedback documents are given with their urls
+            relevant_docs = set(index.get_doc_id(url) for url in feedback_docs)
+            relevant_docs.discard(None)
+            judged_docs, judged_docs_weights = QueryProcessor.get_judged_documents(relevant_docs,
+                                                                                   query_state.accumulators.keys())
+
+            if len(judged_docs) > 0:
+                # Only the rows of the judged documents are read from the forward index (documents x terms),
+                # their weighted sum has the sum of the weighted tf of each term
+                tf_sums = index.get_weighted_tf_sums(judged_docs, judged_docs_weights)
+
+                # Multiplying the tf sums with the idf of each term
+                terms = list(tf_sums.keys())
+                idf_t = idf(index.total_docs, index.get_document_frequencies(terms))
+                QueryProcessor.update_query_vector(query_state.query_vector, terms,
+                                                   np.array(list(tf_sums.values())) * idf_t)
+
+            return QueryProcessor.top_k_feedback(index, query_state, k)
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+import metadata as meta
+from my_postings import PostingsIndex, merge_indexes
+from my_checkpoint import save_file_atomically
+import numpy as np
+import scipy.sparse as sp
+import threading
+import shutil
+import time
+import os
+try:
+    import fcntl
+except ImportError:
+    # Only the posix systems have the fcntl module, elsewhere only the threads of one process are serialized
+    fcntl = None
+
+# The segments of the index are changed by the indexers when new documents are added (the my_indexer.py and the
+# indexing process of a crawl) and by the compaction, this lock is used so that only one thread of a process
+# writes the manifest at a time (the ManifestLock serializes the processes too)
+manifest_lock = threading.Lock()
+
+
+def get_manifest_path(index_path=meta.INVERTED_INDEX_DIR_PATH):
+    return os.path.join(index_path, meta.SEGMENTS_MANIFEST_FILENAME)
+
+
+# Returns the manifest of the index, or an empty manifest if the index doesn't exist
+def load_manifest(index_path=meta.INVERTED_INDEX_DIR_PATH):
+    try:
+        manifest = np.load(get_manifest_path(index_path), allow_pickle=True).item()
+        # Assert in order to confirm that this is a dictionary before the call of the get() operation
+        assert isinstance(manifest, dict)
+        return manifest
+    except FileNotFoundError:
+        return {meta.MANIFEST_SEGMENTS_KEY: [], meta.MANIFEST_NEXT_SEGMENT_KEY: 0,
+                meta.MANIFEST_INDEXED_BLOCKS_KEY: {}, meta.MANIFEST_VERSION_KEY: 0}
+
+
+# Lock for the reading and the changing of the manifest of an index. It takes the manifest_lock and an exclusive lock
+# (flock) of the lock file next to the manifest, so the writers of the other processes wait too
+class ManifestLock:
+
+    def __init__(self, index_path=meta.INVERTED_INDEX_DIR_PATH):
+        self.index_path = index_path
+        self.lock_file = None
+
+    def __enter__(self):
+        manifest_lock.acquire()
+        if fcntl is not None:
+            try:
+                os.makedirs(self.index_path, exist_ok=True)
+                self.lock_file = open(os.path.join(self.index_path, meta.SEGMENTS_LOCK_FILENAME), 'a')
+                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self.release_lock_file()
+                manifest_lock.release()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release_lock_file()
+        manifest_lock.release()
+
+    # Closing the lock file releases its lock
+    def release_lock_file(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+# Saves the manifest atomically and durably (see my_checkpoint.write_file_atomically),
+# so the readers never see a half-written manifest
+def save_manifest(manifest, index_path=meta.INVERTED_INDEX_DIR_PATH):
+    os.makedirs(index_path, exist_ok=True)
+    manifest[meta.MANIFEST_VERSION_KEY] += 1
+    save_file_atomically(get_manifest_path(index_path), manifest)
+
+
+# Deletes all the segments of the index. The lock file is kept, since the other processes may be waiting for its lock
+def clear_index(index_path=meta.INVERTED_INDEX_DIR_PATH):
+    with ManifestLock(index_path):
+        os.makedirs(index_path, exist_ok=True)
+        for name in os.listdir(index_path):
+            if name == meta.SEGMENTS_LOCK_FILENAME:
+                continue
+            if os.path.isdir(os.path.join(index_path, name)):
+                shutil.rmtree(os.path.join(index_path, name))
+            else:
+                os.remove(os.path.join(index_path, name))
+        save_manifest(load_manifest(index_path), index_path)
+
+
+# Returns the number of shards of the index, 0 if the index is not sharded
+def get_number_of_shards(index_path=meta.INVERTED_INDEX_DIR_PATH):
+    return load_manifest(index_path).get(meta.MANIFEST_SHARDS_KEY, 0)
+
+
+def get_shard_path(shard_number, index_path=meta.INVERTED_INDEX_DIR_PATH):
+    return os.path.join(index_path, meta.SHARD_DIR_PREFIX + shard_number.__str__())
+
+
+# Returns the paths of the indexes with the segments, the paths of the shards of a sharded index
+# or else the path of the index itself
+def get_shard_paths(index_path=meta.INVERTED_INDEX_DIR_PATH):
+    number_of_shards = get_number_of_shards(index_path)
+    if number_of_shards == 0:
+        return [index_path]
+    return [get_shard_path(shard_number, index_path) for shard_number in range(number_of_shards)]
+
+
+# Returns the shard of the documents of a block, the blocks are given to the shards in turn
+def get_block_shard(block_number, number_of_shards):
+    return (block_number - 1) % number_of_shards
+
+
+# Deletes all the segments of the index and makes it a sharded index with the given number of shards
+# (an index that is not sharded if the number of shards is 0)
+def clear_sharded_index(number_of_shards, index_path=meta.INVERTED_INDEX_DIR_PATH):
+    clear_index(index_path)
+    if number_of_shards == 0:
+        return
+    for shard_number in range(number_of_shards):
+        clear_index(get_shard_path(shard_number, index_path))
+    with ManifestLock(index_path):
+        manifest = load_manifest(index_path)
+        manifest[meta.MANIFEST_SHARDS_KEY] = number_of_shards
+        save_manifest(manifest, index_path)
+
+
+# Returns the name of a new segment of the index and makes its (empty) directory, it has to be called with the
+# ManifestLock. The directory reserves the name for the threads and the processes, so the manifest is saved (and its
+# version is changed) only when the segment is added to it. The numbers with a directory are skipped, the segments
+# that are being made by a compaction and the ones that were made but not added (by a compaction that was stopped)
+def get_new_segment_name(manifest, index_path=meta.INVERTED_INDEX_DIR_PATH):
+    os.makedirs(index_path, exist_ok=True)
+    segment_number = manifest[meta.MANIFEST_NEXT_SEGMENT_KEY]
+    while True:
+        try:
+            os.mkdir(os.path.join(index_path, meta.SEGMENT_DIR_PREFIX + segment_number.__str__()))
+            break
+        except FileExistsError:
+            segment_number += 1
+    manifest[meta.MANIFEST_NEXT_SEGMENT_KEY] = segment_number + 1
+    return meta.SEGMENT_DIR_PREFIX + segment_number.__str__()
+
+
+# Merges the given partial indexes into a new segment that is added after the other segments of the index.
+# indexed_blocks has the number of documents of each block that are indexed (including the new segment),
+# the blocks that another process has indexed more documents of keep their numbers
+def add_segment(source_paths, indexed_blocks, index_path=meta.INVERTED_INDEX_DIR_PATH):
+    with ManifestLock(index_path):
+        manifest = load_manifest(index_path)
+        segment_name = get_new_segment_name(manifest, index_path)
+
+        merge_indexes(source_paths, os.path.join(index_path, segment_name))
+
+        manifest[meta.MANIFEST_SEGMENTS_KEY].append(segment_name)
+        manifest_indexed_blocks = manifest[meta.MANIFEST_INDEXED_BLOCKS_KEY]
+        manifest[meta.MANIFEST_INDEXED_BLOCKS_KEY] = {
+            block_number: max(documents, manifest_indexed_blocks.get(block_number, 0))
+            for block_number, documents in {**manifest_indexed_blocks, **indexed_blocks}.items()}
+        save_manifest(manifest, index_path)
+    return segment_name
+
+
+# Returns the position of the first segment of the consecutive segments that will be merged,
+# the consecutive segments with the fewest documents are chosen (None if no compaction is needed)
+def choose_segments_to_compact(segment_sizes):
+    if len(segment_sizes) <= meta.MAX_SEGMENTS:
+        return None
+    merge_factor = min(meta.SEGMENTS_MERGE_FACTOR, len(segment_sizes))
+    window_sizes = [sum(segment_sizes[i:i + merge_factor]) for i in range(len(segment_sizes) - merge_factor + 1)]
+    return window_sizes.index(min(window_sizes))
+
+
+# Merges consecutive segments until the index has at most MAX_SEGMENTS segments.
+# The merged segment replaces the segments in the manifest only after it is saved, so the queries can keep
+# reading the old segments while the compaction is running. Merging consecutive segments keeps the document ids.
+# The manifest is saved once for each merged segment, so the version of the index (and the cached results of the
+# queries) changes only when the segments are replaced
+def compact_segments(index_path=meta.INVERTED_INDEX_DIR_PATH):
+    while True:
+        with ManifestLock(index_path):
+            manifest = load_manifest(index_path)
+            segment_names = list(manifest[meta.MANIFEST_SEGMENTS_KEY])
+            segment_sizes = [len(np.load(os.path.join(index_path, name, meta.INDEX_DOC_MAX_FREQ_FILENAME),
+                                         mmap_mode='r')) for name in segment_names]
+            first_segment = choose_segments_to_compact(segment_sizes)
+            if first_segment is None:
+                return
+            merged_names = segment_names[first_segment:first_segment + meta.SEGMENTS_MERGE_FACTOR]
+            merged_segment_name = get_new_segment_name(manifest, index_path)
+
+        print("Compacting segments " + ", ".join(merged_names) + " into " + merged_segment_name)
+        merge_indexes([os.path.join(index_path, name) for name in merged_names],
+                      os.path.join(index_path, merged_segment_name))
+
+        with ManifestLock(index_path):
+            # New segments may have been added after the compaction started, they are always added at the end
+            manifest = load_manifest(index_path)
+            segment_names = manifest[meta.MANIFEST_SEGMENTS_KEY]
+            first_segment = segment_names.index(merged_names[0]) if merged_names[0] in segment_names else None
+            # The compaction of another process may have merged some of the segments meanwhile
+            if first_segment is None or \
+                    segment_names[first_segment:first_segment + len(merged_names)] != merged_names:
+                shutil.rmtree(os.path.join(index_path, merged_segment_name))
+                continue
+            segment_names[first_segment:first_segment + len(merged_names)] = [merged_segment_name]
+            save_manifest(manifest, index_path)
+
+        # The readers that still use the old segments keep their (memory-mapped) files open until they refresh
+        for name in merged_names:
+            shutil.rmtree(os.path.join(index_path, name))
+
+
+# Thread that runs the compaction of the segments in the background
+class SegmentCompactor(threading.Thread):
+
+    def __init__(self, index_path=meta.INVERTED_INDEX_DIR_PATH):
+        threading.Thread.__init__(self)
+        self.index_path = index_path
+
+    # The segments of each shard of a sharded index are compacted separately
+    def run(self):
+        compaction_start_time = time.time()
+        for shard_path in get_shard_paths(self.index_path):
+            compact_segments(shard_path)
+        print("Time needed for segments compaction: %f seconds" % (time.time() - compaction_start_time))
+
+
+# Index that is made of the segments of the manifest. Each segment is a PostingsIndex,
+# the documents of each segment have the ids after the documents of the previous segments
+# (the global id of a document is the doc_base of its segment plus its id in the segment).
+# The queries are answered from all the segments, with the statistics (total_docs and n_t) of the whole index
+class SegmentedIndex:
+
+    def __init__(self, index_path=meta.INVERTED_INDEX_DIR_PATH, mmap_mode=None):
+        self.index_path = index_path
+        self.mmap_mode = mmap_mode
+        self.manifest_modification_time = None
+        self.segments = []
+        self.doc_bases = np.zeros(1, dtype=np.int64)
+        self.total_doc_length = 0
+        self.version = None
+        self.open_segments()
+
+    # Opens the segments of the manifest
+    def open_segments(self):
+        while True:
+            manifest_modification_time = self.get_manifest_modification_time()
+            manifest = load_manifest(self.index_path)
+            try:
+                segments = [PostingsIndex(os.path.join(self.index_path, name), self.mmap_mode)
+                            for name in manifest[meta.MANIFEST_SEGMENTS_KEY]]
+                break
+            except FileNotFoundError:
+                # A segment was deleted by the compaction after the manifest was read, reading the new manifest
+                continue
+
+        self.manifest_modification_time = manifest_modification_time
+        self.version = manifest[meta.MANIFEST_VERSION_KEY]
+        self.segments = segments
+        # doc_bases[i] is the global id of the first document of the i-th segment, the last one is total_docs
+        self.doc_bases = np.cumsum([0] + [segment.total_docs for segment in segments], dtype=np.int64)
+        # The sum of the lengths of all the documents, for the average length of the documents of BM25
+        self.total_doc_length = sum(int(segment.doc_length.sum()) for segment in segments)
+
+    def get_manifest_modification_time(self):
+        try:
+            return os.stat(get_manifest_path(self.index_path)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    # Opens the segments again if the manifest has changed (new segments were added or segments were compacted)
+    # Returns True if the segments were opened again
+    def refresh(self):
+        if self.get_manifest_modification_time() == self.manifest_modification_time:
+            return False
+        self.open_segments()
+        return True
+
+    # The number of total documents
+    @property
+    def total_docs(self):
+        return int(self.doc_bases[-1])
+
+    # Returns the postings (doc_ids, freqs) of the term in all the segments with the global document ids,
+    # or None if the term doesn't exist in any document
+    def get_postings(self, term):
+        segments_doc_ids, segments_freqs = [], []
+        for segment, doc_base in zip(self.segments, self.doc_bases.tolist()):
+            postings = segment.get_postings(term)
+            if postings is not None:
+                segments_doc_ids.append(postings[0] + doc_base)
+                segments_freqs.append(postings[1])
+        if len(segments_doc_ids) == 0:
+            return None
+        return np.concatenate(segments_doc_ids), np.concatenate(segments_freqs)
+
+    # Returns the first (at most limit) postings of the term in impact order from each segment, with the global
+    # document ids, or None if the term doesn't exist in any document. The segments without the impact ordered
+    # postings give all their postings
+    def get_impact_postings(self, term, limit):
+        segments_doc_ids, segments_freqs = [], []
+        for segment, doc_base in zip(self.segments, self.doc_bases.tolist()):
+            if segment.impact_doc_ids is None:
+                postings = segment.get_postings(term)
+            else:
+                postings = segment.get_impact_postings(term, limit)
+            if postings is not None:
+                segments_doc_ids.append(postings[0] + doc_base)
+                segments_freqs.append(postings[1])
+        if len(segments_doc_ids) == 0:
+            return None
+        return np.concatenate(segments_doc_ids), np.concatenate(segments_freqs)
+
+    # Returns the number of documents that contain each of the given terms (n_t) in all the segments
+    def get_document_frequencies(self, terms):
+        terms = np.asarray(terms, dtype=str)
+        document_frequencies = np.zeros(len(terms), dtype=np.int64)
+        for segment in self.segments:
+            if segment.total_terms == 0:
+                continue
+            term_ids = np.minimum(np.searchsorted(segment.terms, terms), segment.total_terms - 1)
+            found = segment.terms[term_ids] == terms
+            document_frequencies[found] += segment.get_document_frequencies(term_ids[found])
+        return document_frequencies
+
+    # Returns the maximum weight (freq/(max_freq*Ld)) of each of the given terms in all the segments
+    def get_term_max_weights(self, terms):
+        terms = np.asarray(terms, dtype=str)
+        term_max_weights = np.zeros(len(terms), dtype=np.float64)
+        for segment in self.segments:
+            if segment.total_terms == 0:
+                continue
+            term_ids = np.minimum(np.searchsorted(segment.terms, terms), segment.total_terms - 1)
+            found = segment.terms[term_ids] == terms
+            term_max_weights[found] = np.maximum(term_max_weights[found], segment.term_max_weight[term_ids[found]])
+        return term_max_weights
+
+    # Returns the maximum frequency of each of the given terms and the minimum length/freq of the documents
+    # of their postings in all the segments (see PostingsIndex.get_term_bm25_statistics)
+    def get_term_bm25_statistics(self, terms):
+        terms = np.asarray(terms, dtype=str)
+        term_max_freqs = np.zeros(len(terms), dtype=np.int64)
+        term_min_length_ratios = np.full(len(terms), np.inf, dtype=np.float64)
+        for segment in self.segments:
+            if segment.total_terms == 0:
+                continue
+            term_ids = np.minimum(np.searchsorted(segment.terms, terms), segment.total_terms - 1)
+            found = segment.terms[term_ids] == terms
+            term_max_freqs[found] = np.maximum(term_max_freqs[found], segment.term_max_freq[term_ids[found]])
+            term_min_length_ratios[found] = np.minimum(term_min_length_ratios[found],
+                                                       segment.term_min_length_ratio[term_ids[found]])
+        return term_max_freqs, term_min_length_ratios
+
+    # Returns the frequency of the term in each of the given (sorted global) document ids, 0 for the documents
+    # that don't contain the term. The postings of each segment are probed only for the segment's documents
+    def get_term_frequencies(self, term, doc_ids):
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if len(self.segments) == 1:
+            return self.segments[0].get_term_frequencies(term, doc_ids)
+        freqs = np.zeros(len(doc_ids), dtype=np.int64)
+        segment_positions = self.get_segment_positions(doc_ids)
+        for segment_position in np.unique(segment_positions).tolist():
+            in_segment = np.flatnonzero(segment_positions == segment_position)
+            freqs[in_segment] = self.segments[segment_position].get_term_frequencies(
+                term, doc_ids[in_segment] - self.doc_bases[segment_position])
+        return freqs
+
+    # Returns the positions of the term in each of the given (sorted global) document ids, an empty array for the
+    # documents that don't contain the term and None for the documents of the segments that have no positions
+    def get_positions(self, term, doc_ids):
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        positions = [None] * len(doc_ids)
+        segment_positions = self.get_segment_positions(doc_ids)
+        for segment_position in np.unique(segment_positions).tolist():
+            in_segment = np.flatnonzero(segment_positions == segment_position)
+            segment_doc_positions = self.segments[segment_position].get_positions(
+                term, doc_ids[in_segment] - self.doc_bases[segment_position])
+            for position, doc_positions in zip(in_segment.tolist(), segment_doc_positions):
+                positions[position] = doc_positions
+        return positions
+
+    # Returns the position of the segment of each of the given (global) document ids
+    def get_segment_positions(self, doc_ids):
+        return np.searchsorted(self.doc_bases, doc_ids, side='right') - 1
+
+    # Returns the values of a documents' array of the segments for the given (global) document ids
+    def get_documents_values(self, doc_ids, array_name):
+        doc_ids = np.asarray(doc_ids)
+        # The global ids of an index with one segment are the ids of the segment (the common case after compaction)
+        if len(self.segments) == 1:
+            return getattr(self.segments[0], array_name)[doc_ids]
+        segment_positions = self.get_segment_positions(doc_ids)
+        values = None
+        for segment_position in np.unique(segment_positions).tolist():
+            segment_array = getattr(self.segments[segment_position], array_name)
+            in_segment = segment_positions == segment_position
+            if values is None:
+                values = np.zeros(len(doc_ids), dtype=segment_array.dtype)
+            values[in_segment] = segment_array[doc_ids[in_segment] - self.doc_bases[segment_position]]
+        if values is None:
+            return np.zeros(0)
+        return values
+
+    def get_doc_max_freq(self, doc_ids):
+        return self.get_documents_values(doc_ids, 'doc_max_freq')
+
+    def get_doc_ld(self, doc_ids):
+        return self.get_documents_values(doc_ids, 'doc_ld')
+
+    def get_doc_length(self, doc_ids):
+        return self.get_documents_values(doc_ids, 'doc_length')
+
+    def get_url(self, doc_id):
+        segment_position = int(self.get_segment_positions(doc_id))
+        return self.segments[segment_position].get_url(doc_id - int(self.doc_bases[segment_position]))
+
+    def get_title(self, doc_id):
+        segment_position = int(self.get_segment_positions(doc_id))
+        return self.segments[segment_position].get_title(doc_id - int(self.doc_bases[segment_position]))
+
+    # Returns the (global) id of the document with the given url, or None if the url is not indexed
+    def get_doc_id(self, url):
+        for segment, doc_base in zip(self.segments, self.doc_bases.tolist()):
+            doc_id = segment.get_doc_id(url)
+            if doc_id is not None:
+                return doc_base + doc_id
+        return None
+
+    # Returns the weighted sum of the forward index' rows (tf of each term) of the given documents,
+    # as a dictionary { term : sum of the weighted tf of the term in the documents }.
+    # Only the rows of the given documents are read from the forward index of each segment
+    def get_weighted_tf_sums(self, doc_ids, weights):
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        segment_positions = self.get_segment_positions(doc_ids)
+
+        tf_sums = {}
+        for segment_position in np.unique(segment_positions).tolist():
+            segment = self.segments[segment_position]
+            in_segment = segment_positions == segment_position
+            rows = segment.get_forward_index()[doc_ids[in_segment] - self.doc_bases[segment_position]]
+            segment_tf_sums = sp.csr_matrix(weights[in_segment][np.newaxis, :]) @ rows
+            for term, tf_sum in zip(segment.terms[segment_tf_sums.indices].tolist(), segment_tf_sums.data.tolist()):
+                tf_sums[term] = tf_sums.get(term, 0) + tf_sum
+        return tf_sums
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+from my_query_processor import QueryProcessor, QueryState, ResultCache, idf
+from my_segments import SegmentedIndex
+import my_segments
+import my_text_processor
+import metadata as meta
+
+import heapq
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# The index of the shard that the shard worker process answers from, it is opened by init_shard_worker
+shard_index = None
+
+
+# Opens the index of the shard in the shard worker process (memory-mapped, like the index of the serving mode)
+def init_shard_worker(shard_path):
+    global shard_index
+    shard_index = SegmentedIndex(shard_path, mmap_mode='r')
+
+
+# Returns the index of the shard, with the new segments of the shard (if any)
+def get_shard_index():
+    shard_index.refresh()
+    return shard_index
+
+
+# Returns the version of the shard's index, the number of its documents, the number of its documents
+# that contain each of the terms and the sum of the lengths of its documents (the statistics of the shard)
+def get_shard_statistics(terms):
+    index = get_shard_index()
+    return index.version, index.total_docs, index.get_document_frequencies(terms), index.total_doc_length
+
+
+# Returns the top k documents of the shard as a list of (similarity, document id in the shard, url, title)
+def get_shard_documents(index, doc_ids, similarities, k):
+    top_k_accumulator, top_k_documents_title_dict = \
+        QueryProcessor.get_top_k_documents_title_dict(index, doc_ids, similarities, k)
+    return [(similarity, doc_id, url, title) for (doc_id, similarity), (url, title)
+            in zip(top_k_accumulator.items(), top_k_documents_title_dict.items())]
+
+
+# Returns the top k documents of the shard for the query vector, with the idf of the whole collection.
+# The phrases and the proximity of a document only need the positions of the document, that are in its shard.
+# Each shard boosts the proximity of its own top candidates, so more candidates are boosted than in the index
+# that is not sharded and a document that is not in the top candidates of the whole collection can be in the top k.
+# Without proximity (the default) the top k documents are the same as the ones of the index that is not sharded
+def get_shard_top_k(query_vector, lq, k, dynamic_pruning, postings_budget, collection_statistics, phrases, proximity,
+                    ranking):
+    index = get_shard_index()
+    doc_ids, similarities = QueryProcessor.get_positional_similarities(index, query_vector, lq, k, dynamic_pruning,
+                                                                       postings_budget, collection_statistics,
+                                                                       phrases, proximity, ranking)
+    return get_shard_documents(index, doc_ids, similarities, k)
+
+
+# Returns the top k documents of the shard for the query vector of the relevance feedback
+def get_shard_feedback_top_k(query_vector, k, collection_statistics):
+    query_state = QueryState()
+    query_state.query_vector = query_vector
+    top_k_documents_title_dict = QueryProcessor.top_k_feedback(get_shard_index(), query_state, k,
+                                                               collection_statistics)
+    return [(similarity, doc_id, url, title) for (doc_id, similarity), (url, title)
+            in zip(query_state.accumulators.items(), top_k_documents_title_dict.items())]
+
+
+# Returns the id (in the shard) of the document of each url, None for the urls that are not in the shard
+def get_shard_doc_ids(urls):
+    index = get_shard_index()
+    return [index.get_doc_id(url) for url in urls]
+
+
+def get_shard_weighted_tf_sums(doc_ids, weights):
+    return get_shard_index().get_weighted_tf_sums(doc_ids, weights)
+
+
+# Query processor of a sharded index (see my_indexer.py), with the same top_k and feedback as the QueryProcessor.
+# Each shard is served by its own worker process, a query is sent to all the shards at the same time
+# (scatter) and the top k documents of each shard are merged into the top k documents of the collection (gather).
+# The idf (and the average length of the documents of BM25) is computed from the statistics of the whole collection
+# (the sums of the shards' statistics), that are gathered from the shards before the query is scored,
+# so the similarities are the same as the similarities of the index that is not sharded.
+# The documents are (shard number, document id in the shard) and the documents with equal similarities
+# are ordered by them
+class ShardedQueryProcessor:
+
+    def __init__(self, index_path=meta.INVERTED_INDEX_DIR_PATH):
+        # The state of the queries that are given without a state of their own (when there is only one user)
+        self.query_state = QueryState()
+        # The results of the recent queries, for the versions of the shards that they were found in
+        self.result_cache = ResultCache()
+        self.shards_versions = None
+        # Warm start of the stem cache, with the words that the crawler has already stemmed
+        my_text_processor.TextProcessor.stem_cache.load(meta.STEM_TABLE_FILE_PATH)
+
+        # One worker process for each shard, the requests to a shard are answered one at a time in their order
+        self.shard_workers = [ProcessPoolExecutor(max_workers=1, initializer=init_shard_worker,
+                                                  initargs=(shard_path,))
+                              for shard_path in my_segments.get_shard_paths(index_path)]
+        # Starting the worker processes now (before the threads of the app are started)
+        self.get_collection_statistics([])
+
+    # Runs the function with the same arguments in every shard at the same time, returns the result of each shard
+    def scatter_gather(self, function, *args):
+        return self.scatter_gather_each(function, [args] * len(self.shard_workers))
+
+    # Runs the function with the arguments of each shard in every shard at the same time,
+    # returns the result of each shard
+    def scatter_gather_each(self, function, shards_args):
+        futures = [shard_worker.submit(function, *args) for shard_worker, args in zip(self.shard_workers, shards_args)]
+        return [future.result() for future in futures]
+
+    # Returns the statistics of the whole collection for the terms as (total_docs, { term : n_t }, total length of
+    # the documents) and the versions of the shards' indexes. When a shard has changed the cached results are removed
+    def get_collection_statistics(self, terms):
+        shards_statistics = self.scatter_gather(get_shard_statistics, terms)
+        total_docs = sum(shard_total_docs for _, shard_total_docs, _, _ in shards_statistics)
+        total_doc_length = sum(shard_total_doc_length for _, _, _, shard_total_doc_length in shards_statistics)
+        document_frequencies = np.zeros(len(terms), dtype=np.int64)
+        for _, _, shard_document_frequencies, _ in shards_statistics:
+            document_frequencies += shard_document_frequencies
+        shards_versions = tuple(version for version, _, _, _ in shards_statistics)
+        if shards_versions != self.shards_versions:
+            if self.shards_versions is not None:
+                self.result_cache.clear()
+            self.shards_versions = shards_versions
+        return (total_docs, dict(zip(terms, document_frequencies.tolist())), total_doc_length), shards_versions
+
+    # Merges the top k documents of the shards into the top k documents of the collection,
+    # returns the top k documents with their similarities and the top k documents with their titles
+    @staticmethod
+    def merge_top_k(shards_top_k, k):
+        documents = [(-similarity, shard_number, doc_id, url, title)
+                     for shard_number, shard_top_k in enumerate(shards_top_k)
+                     for similarity, doc_id, url, title in shard_top_k]
+        top_k_accumulator = {}
+        top_k_documents_title_dict = {}
+        for negative_similarity, shard_number, doc_id, url, title in heapq.nsmallest(k, documents):
+            top_k_accumulator.update({(shard_number, doc_id): -negative_similarity})
+            top_k_documents_title_dict.update({url: title})
+        return top_k_accumulator, top_k_documents_title_dict
+
+    # The same as the top_k of the QueryProcessor, each shard finds its own top k documents
+    def top_k(self, query, k=1, dynamic_pruning=True, postings_budget=None, query_state=None, proximity=False,
+              ranking=meta.DEFAULT_RANKING):
+        if query_state is None:
+            query_state = self.query_state
+        query_state.query = query
+        query_state.k = k
+        query_state.query_vector = {}
+        query_state.accumulators = {}
+
+        query_vector_result = QueryProcessor.get_query_vector(query)
+        if query_vector_result is None:
+            return {}
+        terms_frequencies_dict, query_state.query_vector, lq = query_vector_result
+        collection_statistics, shards_versions = self.get_collection_statistics(list(query_state.query_vector.keys()))
+        phrases = QueryProcessor.get_query_phrases(query)
+
+        cache_key = ResultCache.get_key(terms_frequencies_dict, k, postings_budget, shards_versions,
+                                        (phrases, proximity, ranking))
+        cached_result = self.result_cache.get(cache_key)
+        if cached_result is not None:
+            top_k_accumulator, top_k_documents_title_dict = cached_result
+            query_state.accumulators = dict(top_k_accumulator)
+            return dict(top_k_documents_title_dict)
+
+        shards_top_k = self.scatter_gather(get_shard_top_k, query_state.query_vector, lq, k, dynamic_pruning,
+                                           postings_budget, collection_statistics, phrases, proximity, ranking)
+        top_k_accumulator, top_k_documents_title_dict = ShardedQueryProcessor.merge_top_k(shards_top_k, k)
+        query_state.accumulators = top_k_accumulator
+        self.result_cache.put(cache_key, (dict(top_k_accumulator), dict(top_k_documents_title_dict)))
+        return top_k_documents_title_dict
+
+    # The same as the feedback of the QueryProcessor, the weighted tf sums of the judged documents
+    # are the sums of the weighted tf sums of each shard's judged documents
+    def feedback(self, feedback_docs, k, query_state=None):
+        if query_state is None:
+            query_state = self.query_state
+
+        with query_state.lock:
+            # The feedback documents are given with their urls, each url is in (at most) one of the shards
+            relevant_docs = set()
+            for shard_number, shard_doc_ids in enumerate(self.scatter_gather(get_shard_doc_ids, list(feedback_docs))):
+                relevant_docs.update((shard_number, doc_id) for doc_id in shard_doc_ids if doc_id is not None)
+            judged_docs, judged_docs_weights = QueryProcessor.get_judged_documents(relevant_docs,
+                                                                                   query_state.accumulators.keys())
+
+            if len(judged_docs) > 0:
+                shards_args = [([doc_id for (document_shard, doc_id) in judged_docs if document_shard == shard_number],
+                                [weight for (document_shard, _), weight in zip(judged_docs, judged_docs_weights)
+                                 if document_shard == shard_number])
+                               for shard_number in range(len(self.shard_workers))]
+                tf_sums = {}
+                for shard_tf_sums in self.scatter_gather_each(get_shard_weighted_tf_sums, shards_args):
+                    for term, tf_sum in shard_tf_sums.items():
+                        tf_sums[term] = tf_sums.get(term, 0) + tf_sum
+
+                # Multiplying the tf sums with the idf of each term
+                terms = list(tf_sums.keys())
+                (total_docs, document_frequencies, _), _ = self.get_collection_statistics(terms)
+                idf_t = idf(total_docs, np.array([document_frequencies[term] for term in terms], dtype=np.int64))
+                QueryProcessor.update_query_vector(query_state.query_vector, terms,
+                                                   np.array(list(tf_sums.values())) * idf_t)
+
+            collection_statistics, _ = self.get_collection_statistics(list(query_state.query_vector.keys()))
+            shards_top_k = self.scatter_gather(get_shard_feedback_top_k, query_state.query_vector, k,
+                                               collection_statistics)
+            query_state.accumulators, top_k_documents_title_dict = \
+                ShardedQueryProcessor.merge_top_k(shards_top_k, k)
+            return top_k_documents_title_dict
+
+    def shutdown(self):
+        for shard_worker in self.shard_workers:
+            shard_worker.shutdown()
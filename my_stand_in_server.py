@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import random
+import time
+import sys
+
+# English words that the pages of the stand-in server are made of (so that the pages pass the language detection)
+PAGE_WORDS = ("the search engine crawls every page of the web and keeps the words of each page in an index so that "
+              "people can find the pages they are looking for with a few words when they write a query the engine "
+              "finds the pages that have these words and shows the most relevant of them first with their title "
+              "and their link some pages have links to other pages and the crawler follows these links to find new "
+              "pages that were not visited before").split()
+
+
+# Handler of the stand-in server. The server has the pages /page/0 ... /page/<number_of_pages - 1>,
+# each page has some english text and links to other pages of the server.
+# Every response is delayed by the latency, in order to look like a website that is far away
+class StandInHandler(BaseHTTPRequestHandler):
+    number_of_pages = 1000
+    links_per_page = 10
+    words_per_page = 300
+    latency = 0.05
+
+    # Using HTTP/1.1 so that the clients can keep the connections alive
+    protocol_version = "HTTP/1.1"
+
+    def get_page(self):
+        try:
+            page_number = int(self.path.rsplit('/', 1)[-1])
+        except ValueError:
+            return None
+        if not self.path.startswith('/page/') or not 0 <= page_number < StandInHandler.number_of_pages:
+            return None
+
+        # Each page is always the same, the random generator is seeded with the number of the page
+        page_random = random.Random(page_number)
+        base_url = "http://" + self.headers.get('Host')
+        words = " ".join(page_random.choice(PAGE_WORDS) for _ in range(StandInHandler.words_per_page))
+        links = "".join('<a href="' + base_url + '/page/' + page_random.randrange(StandInHandler.number_of_pages)
+                        .__str__() + '">link</a> ' for _ in range(StandInHandler.links_per_page))
+        return ("<html><head><title>Page " + page_number.__str__() + "</title></head><body><p>" + words + "</p>"
+                + links + "</body></html>").encode('utf-8')
+
+    def send_page_headers(self, page):
+        time.sleep(StandInHandler.latency)
+        if page is None:
+            self.send_response(404)
+            self.send_header('content-type', 'text/html')
+            self.send_header('content-length', '0')
+        else:
+            self.send_response(200)
+            self.send_header('content-type', 'text/html; charset=utf-8')
+            self.send_header('content-length', len(page).__str__())
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.send_page_headers(self.get_page())
+
+    def do_GET(self):
+        page = self.get_page()
+        self.send_page_headers(page)
+        if page is not None:
+            self.wfile.write(page)
+
+    # No logging of each request
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Allowing many connections to wait to be accepted, for the crawlers with high concurrency
+    request_queue_size = 1024
+
+
+# Starts the stand-in server in a background thread, returns the server and the url of its first page
+def start_stand_in_server(number_of_pages=1000, links_per_page=10, latency=0.05, port=0):
+    StandInHandler.number_of_pages = number_of_pages
+    StandInHandler.links_per_page = links_per_page
+    StandInHandler.latency = latency
+    server = StandInServer(('127.0.0.1', port), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:" + server.server_address[1].__str__() + "/page/0"
+
+
+if __name__ == '__main__':
+    # Args: port, number of pages, links per page and latency in seconds (all of them are optional)
+    port_arg = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    number_of_pages_arg = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    links_per_page_arg = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    latency_arg = float(sys.argv[4]) if len(sys.argv) > 4 else 0.05
+
+    stand_in_server, first_page_url = start_stand_in_server(number_of_pages_arg, links_per_page_arg, latency_arg,
+                                                            port_arg)
+    print("Stand-in server is running, first page: " + first_page_url)
+    while True:
+        time.sleep(3600)
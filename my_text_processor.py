@@ -1,7 +1,118 @@
 from bs4 import BeautifulSoup
 from nltk.stem.snowball import SnowballStemmer
 from langdetect import detect, lang_detect_exception
+import metadata as meta
+from my_checkpoint import write_file_atomically
+from collections import OrderedDict
+import numpy as np
+import threading
+import html
 import re
+import os
+
+
+# Bounded LRU cache of the stems of the words, the most of the words of the documents and the queries
+# are repeats of a few words, so the stemmer is called only for the words that are not in the cache.
+# The cache is shared by the threads, each call looks up all the words of a document with one lock acquisition
+class StemCache:
+
+    def __init__(self, stemmer, max_size=meta.STEM_CACHE_SIZE):
+        self.stemmer = stemmer
+        self.max_size = max_size
+        # { word : stem }, from the least recently used word to the most recently used word
+        self.stems = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # The words that were stemmed (and the hits and misses) since the last take_new_stems, kept only after
+        # track_new_stems is called. The parser processes send them to the crawler's process with their results
+        self.new_stems = None
+        self.taken_hits = 0
+        self.taken_misses = 0
+
+    def __len__(self):
+        return len(self.stems)
+
+    def track_new_stems(self):
+        with self.lock:
+            self.new_stems = {}
+
+    def add_stem(self, word, stem):
+        self.stems[word] = stem
+        if len(self.stems) > self.max_size:
+            self.stems.popitem(last=False)
+
+    # Returns the list with the stem of each word. The cached stems are looked up with the lock, the words that are
+    # not in the cache are stemmed without it (so a document with many new words doesn't block the other threads)
+    # and then they are added to the cache with the lock
+    def stem_words(self, words_list):
+        word_stems = {}
+        missing_words = []
+        with self.lock:
+            for word in words_list:
+                if word in word_stems:
+                    continue
+                stem = self.stems.get(word)
+                if stem is None:
+                    missing_words.append(word)
+                else:
+                    self.stems.move_to_end(word)
+                word_stems[word] = stem
+            self.hits += len(words_list) - len(missing_words)
+
+        if len(missing_words) > 0:
+            new_stems = {word: self.stemmer.stem(word) for word in missing_words}
+            with self.lock:
+                for word, stem in new_stems.items():
+                    self.add_stem(word, stem)
+                    if self.new_stems is not None:
+                        self.new_stems[word] = stem
+                self.misses += len(missing_words)
+            word_stems.update(new_stems)
+        return [word_stems[word] for word in words_list]
+
+    # Returns the words that were stemmed { word : stem }, the hits and the misses since the last call
+    def take_new_stems(self):
+        with self.lock:
+            new_stems, self.new_stems = self.new_stems, {}
+            hits, misses = self.hits - self.taken_hits, self.misses - self.taken_misses
+            self.taken_hits, self.taken_misses = self.hits, self.misses
+        return new_stems, hits, misses
+
+    # Adds the words that were stemmed by another cache (of a parser process) with its hits and misses
+    def add_new_stems(self, new_stems, hits, misses):
+        with self.lock:
+            for word, stem in new_stems.items():
+                self.add_stem(word, stem)
+            self.hits += hits
+            self.misses += misses
+
+    # Returns the statistics of the cache
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self.stems), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups > 0 else 0.0}
+
+    # Saves the cached words and their stems (the vocabulary -> stem table) atomically and durably
+    # (see my_checkpoint.write_file_atomically)
+    def save(self, file_path=meta.STEM_TABLE_FILE_PATH):
+        with self.lock:
+            words = np.array(list(self.stems.keys()), dtype=str)
+            stems = np.array(list(self.stems.values()), dtype=str)
+        write_file_atomically(file_path, lambda stem_table_file: np.savez(stem_table_file, words=words, stems=stems))
+
+    # Adds the words and the stems of the saved table to the cache (if the table exists), returns the number of them
+    def load(self, file_path=meta.STEM_TABLE_FILE_PATH):
+        if not os.path.exists(file_path):
+            return 0
+        with np.load(file_path) as stem_table_file:
+            words = stem_table_file['words'].tolist()
+            stems = stem_table_file['stems'].tolist()
+        with self.lock:
+            for word, stem in zip(words, stems):
+                self.add_stem(word, stem)
+        return len(words)
 
 
 # TextProcessor class that is used for the different text manipulation tasks
@@ -32,19 +143,40 @@ class TextProcessor:
 
     # Stemming words for english language
     stemmer = SnowballStemmer('english')
-
-    # Constructor of the class that sets the stemming as True or False
-    def __init__(self, stemming=False):
+    # The cache of the stems, shared by the crawler and the query processor
+    stem_cache = StemCache(stemmer)
+
+    # The html parsers that can be used. "html.parser" and "lxml" are the parsers of BeautifulSoup
+    # (lxml is a lot faster, but it has to be installed), "regex" does not build the tree of the html text,
+    # it only removes the tags with regular expressions (the fastest, but less accurate for broken html)
+    parser_backends = ("html.parser", "lxml", "regex")
+
+    # Regular expressions of the regex parser
+    title_pattern = re.compile(r'<title\b[^>]*>(.*?)</title\s*>', re.IGNORECASE | re.DOTALL)
+    comment_pattern = re.compile(r'<!--.*?-->', re.DOTALL)
+    script_style_pattern = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+    tag_pattern = re.compile(r'<[^>]*>')
+
+    # Constructor of the class that sets the stemming as True or False and the html parser
+    def __init__(self, stemming=False, parser_backend=meta.DEFAULT_PARSER_BACKEND):
+        if not (parser_backend in TextProcessor.parser_backends):
+            raise KeyError("No such parser backend as " + parser_backend + " is supported")
         self.stemming = stemming
+        self.parser_backend = parser_backend
 
     # Finds and returns all the links that start with "http" from the given html text
     @staticmethod
     def get_https_links_from_text(html_text):
-        return re.findall('(?<=<a href=")https[^"]*', html_text)
+        return TextProcessor.get_links_from_text(html_text, "https")
+
+    # Finds and returns all the links that start with the given scheme (followed by "://") from the given html text
+    @staticmethod
+    def get_links_from_text(html_text, scheme):
+        return re.findall('(?<=<a href=")' + re.escape(scheme) + '://[^"]*', html_text)
 
     @staticmethod
     def apply_stemming(words_list):
-        return [TextProcessor.stemmer.stem(word) for word in words_list]
+        return TextProcessor.stem_cache.stem_words(words_list)
 
     @staticmethod
     def remove_stop_words(words_list):
@@ -67,11 +199,25 @@ class TextProcessor:
 
         return useful_words
 
-    # Returns the title of the given html_text (if it exists)
-    # and also an array with the useful words
-    def get_cleaned_doc(self, html_text):
+    # Returns the title of the given html_text (if it exists) and its text, using the regular expressions
+    @staticmethod
+    def get_title_and_text_with_regex(html_text):
+        title_match = TextProcessor.title_pattern.search(html_text)
+        if title_match is not None:
+            doc_title = " ".join(html.unescape(TextProcessor.tag_pattern.sub(' ', title_match.group(1))).split())
+        else:
+            doc_title = None
+
+        # Remove the comments and all script/Javascript and CSS styling code, then all the tags
+        text = TextProcessor.comment_pattern.sub(' ', html_text)
+        text = TextProcessor.script_style_pattern.sub(' ', text)
+        text = TextProcessor.tag_pattern.sub(' ', text)
+        return doc_title, " ".join(html.unescape(text).split())
+
+    # Returns the title of the given html_text (if it exists) and its text, using BeautifulSoup
+    def get_title_and_text_with_soup(self, html_text):
         # Getting the html file as a bs4 object
-        soup = BeautifulSoup(html_text, "html.parser")
+        soup = BeautifulSoup(html_text, self.parser_backend)
 
         # Get the title from the html text if it exists
         if soup.title is not None:
@@ -84,7 +230,15 @@ class TextProcessor:
             script.extract()
 
         # Get the text from the bs4 object
-        text = soup.get_text(separator=' ', strip=True)
+        return doc_title, soup.get_text(separator=' ', strip=True)
+
+    # Returns the title of the given html_text (if it exists)
+    # and also an array with the useful words
+    def get_cleaned_doc(self, html_text):
+        if self.parser_backend == "regex":
+            doc_title, text = TextProcessor.get_title_and_text_with_regex(html_text)
+        else:
+            doc_title, text = self.get_title_and_text_with_soup(html_text)
 
         # If the language of this text in not English, raise a value error
         # (in order to abort this html file from the outside)
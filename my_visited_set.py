@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import metadata as meta
+from my_checkpoint import write_file_atomically
+
+import math
+import hashlib
+import numpy as np
+
+
+# Returns the 64-bit fingerprint of the link (the first 8 bytes of its blake2b hash)
+def get_fingerprint(link):
+    return int.from_bytes(hashlib.blake2b(link.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+# Saves the arrays (with np.savez) atomically and durably, so a crash never leaves a half-written file
+# and the file is on the disk before the crawl log is truncated (see my_checkpoint.write_file_atomically)
+def save_arrays_file(file_path, **arrays):
+    write_file_atomically(file_path, lambda arrays_file: np.savez(arrays_file, **arrays))
+
+
+# Set of the visited links that keeps only the 64-bit fingerprint of each link, instead of the whole link.
+# The fingerprints are kept in a sorted uint64 array (8 bytes for each link), and the new fingerprints in a
+# python set until they are enough to be merged in the array. Two links may have the same fingerprint,
+# but with 64 bits this is almost impossible even for billions of links
+class FingerprintSet:
+    backend = "fingerprints"
+
+    def __init__(self, fingerprints=None):
+        self.fingerprints = np.zeros(0, dtype=np.uint64) if fingerprints is None else fingerprints
+        self.new_fingerprints = set()
+
+    def __len__(self):
+        return len(self.fingerprints) + len(self.new_fingerprints)
+
+    def __contains__(self, link):
+        fingerprint = get_fingerprint(link)
+        if fingerprint in self.new_fingerprints:
+            return True
+        position = int(np.searchsorted(self.fingerprints, np.uint64(fingerprint)))
+        return position < len(self.fingerprints) and int(self.fingerprints[position]) == fingerprint
+
+    def add(self, link):
+        fingerprint = get_fingerprint(link)
+        position = int(np.searchsorted(self.fingerprints, np.uint64(fingerprint)))
+        if position < len(self.fingerprints) and int(self.fingerprints[position]) == fingerprint:
+            return
+        self.new_fingerprints.add(fingerprint)
+        # Merging when the new fingerprints are a part of the array, so each fingerprint is merged a few times
+        if len(self.new_fingerprints) >= max(meta.VISITED_SET_MIN_MERGE_SIZE, len(self.fingerprints) // 8):
+            self.merge_new_fingerprints()
+
+    def merge_new_fingerprints(self):
+        new_fingerprints = np.fromiter(self.new_fingerprints, dtype=np.uint64, count=len(self.new_fingerprints))
+        # The new array is assigned before the set is replaced, so the links are always in one of them
+        self.fingerprints = np.union1d(self.fingerprints, new_fingerprints)
+        self.new_fingerprints = set()
+
+    def save(self, file_path):
+        self.merge_new_fingerprints()
+        save_arrays_file(file_path, backend=np.array(FingerprintSet.backend), fingerprints=self.fingerprints)
+
+    @staticmethod
+    def load(file_path):
+        with np.load(file_path) as visited_set_file:
+            return FingerprintSet(visited_set_file['fingerprints'])
+
+
+# Bloom filter that grows when it is full. It is made of bloom filters with increasing capacities, each new filter
+# is used when the previous one is full and has a smaller false positive rate, so the false positive rate
+# of all the filters is at most the error_rate (a link that was not visited may be found in the set, with
+# probability error_rate, but a visited link is always found)
+class ScalableBloomFilter:
+    backend = "bloom"
+    # Each new filter has GROWTH times the capacity and TIGHTENING times the false positive rate of the previous one
+    GROWTH = 2
+    TIGHTENING = 0.5
+
+    def __init__(self, error_rate=meta.BLOOM_ERROR_RATE, initial_capacity=meta.BLOOM_INITIAL_CAPACITY):
+        self.error_rate = error_rate
+        self.initial_capacity = initial_capacity
+        # For each filter, its bits (packed in a bytearray), the number of bits, the number of hash functions,
+        # the number of links that it can have and the number of links that it has
+        self.filters_bits = []
+        self.filters_num_bits = []
+        self.filters_num_hashes = []
+        self.filters_capacities = []
+        self.filters_counts = []
+
+    def __len__(self):
+        return sum(self.filters_counts)
+
+    def add_filter(self):
+        filter_number = len(self.filters_bits)
+        capacity = self.initial_capacity * ScalableBloomFilter.GROWTH ** filter_number
+        filter_error_rate = self.error_rate * (1 - ScalableBloomFilter.TIGHTENING) * \
+            ScalableBloomFilter.TIGHTENING ** filter_number
+        # The optimal number of bits and hash functions for the capacity and the false positive rate
+        num_bits = int(math.ceil(-capacity * math.log(filter_error_rate) / (math.log(2) ** 2)))
+        num_bits = (num_bits + 7) // 8 * 8
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        self.filters_bits.append(bytearray(num_bits // 8))
+        self.filters_num_bits.append(num_bits)
+        self.filters_num_hashes.append(num_hashes)
+        self.filters_capacities.append(capacity)
+        self.filters_counts.append(0)
+
+    # Returns the two 64-bit hashes of the link, the positions of the bits are made of them (double hashing)
+    @staticmethod
+    def get_hashes(link):
+        digest = hashlib.blake2b(link.encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+    # Returns the positions of the link's bits in the filter
+    def get_bit_positions(self, hashes, filter_number):
+        num_bits = self.filters_num_bits[filter_number]
+        return [(hashes[0] + i * hashes[1]) % num_bits for i in range(self.filters_num_hashes[filter_number])]
+
+    def filter_contains(self, hashes, filter_number):
+        bits = self.filters_bits[filter_number]
+        return all(bits[position >> 3] & (1 << (position & 7))
+                   for position in self.get_bit_positions(hashes, filter_number))
+
+    def __contains__(self, link):
+        hashes = ScalableBloomFilter.get_hashes(link)
+        return any(self.filter_contains(hashes, filter_number) for filter_number in range(len(self.filters_bits)))
+
+    def add(self, link):
+        hashes = ScalableBloomFilter.get_hashes(link)
+        if any(self.filter_contains(hashes, filter_number) for filter_number in range(len(self.filters_bits))):
+            return
+        if len(self.filters_bits) == 0 or self.filters_counts[-1] >= self.filters_capacities[-1]:
+            self.add_filter()
+        bits = self.filters_bits[-1]
+        for position in self.get_bit_positions(hashes, len(self.filters_bits) - 1):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.filters_counts[-1] += 1
+
+    def save(self, file_path):
+        save_arrays_file(file_path, backend=np.array(ScalableBloomFilter.backend),
+                         error_rate=np.array(self.error_rate), initial_capacity=np.array(self.initial_capacity),
+                         bits=np.frombuffer(b"".join(self.filters_bits), dtype=np.uint8),
+                         num_bits=np.array(self.filters_num_bits, dtype=np.int64),
+                         num_hashes=np.array(self.filters_num_hashes, dtype=np.int64),
+                         capacities=np.array(self.filters_capacities, dtype=np.int64),
+                         counts=np.array(self.filters_counts, dtype=np.int64))
+
+    @staticmethod
+    def load(file_path):
+        with np.load(file_path) as visited_set_file:
+            bloom_filter = ScalableBloomFilter(float(visited_set_file['error_rate']),
+                                               int(visited_set_file['initial_capacity']))
+            bloom_filter.filters_num_bits = visited_set_file['num_bits'].tolist()
+            bloom_filter.filters_num_hashes = visited_set_file['num_hashes'].tolist()
+            bloom_filter.filters_capacities = visited_set_file['capacities'].tolist()
+            bloom_filter.filters_counts = visited_set_file['counts'].tolist()
+            # The bits of each filter are in the positions [bits_offsets[i], bits_offsets[i + 1]) of the bits
+            bits_offsets = np.cumsum([0] + [num_bits // 8 for num_bits in bloom_filter.filters_num_bits])
+            bits = visited_set_file['bits']
+            bloom_filter.filters_bits = [bytearray(bits[bits_offsets[i]:bits_offsets[i + 1]].tobytes())
+                                         for i in range(len(bloom_filter.filters_num_bits))]
+        return bloom_filter
+
+
+# Dictionary that has the classes of the different visited set backends
+visited_set_backends = {
+    FingerprintSet.backend: FingerprintSet,
+    ScalableBloomFilter.backend: ScalableBloomFilter,
+}
+
+
+# Returns an empty visited set of the given backend
+def create_visited_set(backend=meta.DEFAULT_VISITED_SET_BACKEND):
+    if not (backend in visited_set_backends):
+        raise KeyError("No such visited set backend as " + backend + " is supported")
+    return visited_set_backends[backend]()
+
+
+# Loads the visited set of the file, the backend is saved in the file
+def load_visited_set(file_path=meta.VISITED_SET_FILE_PATH):
+    with np.load(file_path) as visited_set_file:
+        backend = str(visited_set_file['backend'])
+    return visited_set_backends[backend].load(file_path)
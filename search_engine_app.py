@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 from flask import Flask, render_template, request
-from my_query_processor import QueryProcessor
+from my_query_processor import QueryProcessor, QueryState, ResultCache
+from my_shards import ShardedQueryProcessor
+import my_segments
+from my_text_processor import TextProcessor
+import metadata as meta
 from abc import ABC  # Package that is used for the abstract classes
+import secrets
 import time
 
 app = Flask(__name__)
@@ -9,59 +14,97 @@ app = Flask(__name__)
 
 # Abstract class for the flask application
 class FlaskApp(ABC):
-    my_query_processor = QueryProcessor(new_indexer=False)
-    given_query = None
-    number_of_wanted_docs = None
+    # Serving mode, the index that was made by the my_indexer.py is memory-mapped and it is not rebuilt.
+    # The query processor keeps no state of the queries, so it is shared by all the requests (threads).
+    # A sharded index is served by the processes of its shards (see my_shards.py)
+    my_query_processor = ShardedQueryProcessor() if my_segments.get_number_of_shards() > 0 \
+        else QueryProcessor(read_only=True)
+    # { token : QueryState }, the state of each user's query for the relevance feedback. The token is given
+    # to the page of the results and sent back with the feedback. The states are kept like the cached results,
+    # the least recently used is removed when there are too many of them and each one expires after the ttl
+    query_states = ResultCache(meta.QUERY_STATES_SIZE, meta.QUERY_STATE_TTL)
 
 
 # index page of search engine
 @app.route('/')
 def index():
-    return render_template('index.html', urls={}, comments=" ", query="", topk="")
+    return render_template('index.html', urls={}, comments=" ", query="", topk="", token="")
 
 
 # function for handling query
 @app.route('/query', methods=['GET', 'POST'])
 def get_query():
     # get query
-    FlaskApp.given_query = request.form['field']
+    given_query = request.form['field']
     # check if query is empty in order to not find results 
-    if FlaskApp.given_query.isspace() or not FlaskApp.given_query:
-        return render_template('index.html', urls={}, comments=" ", query="", topk="")
+    if given_query.isspace() or not given_query:
+        return render_template('index.html', urls={}, comments=" ", query="", topk="", token="")
 
-    # get number of wanted documents
-    FlaskApp.number_of_wanted_docs = request.form['top_k']
-    FlaskApp.number_of_wanted_docs = int(FlaskApp.number_of_wanted_docs) if (FlaskApp.number_of_wanted_docs != "") else 10
+    # get number of wanted documents, 10 if it is not a number and at least 1 and at most QUERY_MAX_RESULTS
+    try:
+        number_of_wanted_docs = int(request.form.get('top_k', ""))
+    except ValueError:
+        number_of_wanted_docs = 10
+    number_of_wanted_docs = min(max(number_of_wanted_docs, 1), meta.QUERY_MAX_RESULTS)
+    # get the ranking of the query (the default ranking if it is not one of the rankings)
+    ranking = request.form.get('ranking', meta.DEFAULT_RANKING)
+    if ranking not in meta.RANKINGS:
+        ranking = meta.DEFAULT_RANKING
+    # the proximity boost of the query terms is used only if the user asks for it
+    proximity = request.form.get('proximity') is not None
 
-    # find top-k results
-    top_k = FlaskApp.my_query_processor.top_k(FlaskApp.given_query, FlaskApp.number_of_wanted_docs)
+    # find top-k results, the state of the query is kept with a new token for the feedback
+    query_state = QueryState(given_query, number_of_wanted_docs)
+    top_k = FlaskApp.my_query_processor.top_k(given_query, number_of_wanted_docs,
+                                              postings_budget=meta.QUERY_POSTINGS_BUDGET, query_state=query_state,
+                                              ranking=ranking, proximity=proximity)
+    token = secrets.token_urlsafe(16)
+    FlaskApp.query_states.put(token, query_state)
     
     # comments for the user depending on results
     comments = ""
     if len(top_k) == 0:
         comments = "No results for this query! Please try again with other keywords. " \
                    "Use English words and avoid stemming words"
-    elif FlaskApp.number_of_wanted_docs > len(top_k):
+    elif number_of_wanted_docs > len(top_k):
         comments = "No more results to show"
 
     return render_template('index.html', urls=top_k.items(), comments=comments,
-                           query=FlaskApp.given_query, topk=FlaskApp.number_of_wanted_docs)
+                           query=given_query, topk=number_of_wanted_docs, token=token, ranking=ranking,
+                           proximity=proximity)
 
 
 # function for handling feedback
 @app.route('/feedback', methods=['GET', 'POST'])
 def get_feedback():
+    # the state of the query that the feedback is given for
+    token = request.form.get('token', "")
+    query_state = FlaskApp.query_states.get(token)
+    if query_state is None:
+        return render_template('index.html', urls={}, comments="This search has expired, please search again",
+                               query="", topk="", token="")
+
     # get relevant documents
     feedback = request.form.getlist('feedback')
     # get results after feedback
     start = time.time()
-    top_k_feedback = FlaskApp.my_query_processor.feedback(feedback, FlaskApp.number_of_wanted_docs)
+    top_k_feedback = FlaskApp.my_query_processor.feedback(feedback, query_state.k, query_state=query_state)
     end = time.time()
     
     print((end-start))
     
     return render_template('index.html', urls=top_k_feedback.items(), comments="",
-                           query=FlaskApp.given_query, topk=FlaskApp.number_of_wanted_docs)
+                           query=query_state.query, topk=query_state.k, token=token)
+
+
+# statistics of the caches of the query processor (the results of the queries and the stems of the words)
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    return {"result_cache": FlaskApp.my_query_processor.result_cache.get_stats(),
+            "stem_cache": TextProcessor.stem_cache.get_stats()}
 
 
-app.run()
+# The requests are served by many threads, that share the query processor and the (read-only) index.
+# The app can also be served by a WSGI server (with many threads), the query states are kept by each process
+if __name__ == '__main__':
+    app.run(threaded=True)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from my_stand_in_server import start_stand_in_server
+import my_crawler
+import my_blocks
+import metadata as meta
+
+import os
+
+
+# A polite crawl waits for the delay of the hosts, that is longer than the wait of the threads for a link,
+# the threads must not stop while the frontier still has links
+def test_polite_crawl_keeps_all_links(tmp_path, monkeypatch):
+    os.makedirs(os.path.join(tmp_path, meta.DOCUMENTS_DATA_FILENAME))
+    for file_path_name, filename in [("METADATA_DICTIONARY_FILE_PATH", meta.METADATA_DICTIONARY_FILENAME),
+                                     ("VISITED_SET_FILE_PATH", meta.VISITED_SET_FILENAME),
+                                     ("STEM_TABLE_FILE_PATH", meta.STEM_TABLE_FILENAME),
+                                     ("FRONTIER_FILE_PATH", meta.FRONTIER_FILENAME),
+                                     ("CRAWL_LOG_FILE_PATH", meta.CRAWL_LOG_FILENAME),
+                                     ("BLOCK_FILE_NAME_PREFIX_PATH", meta.BLOCK_FILE_NAME_PREFIX)]:
+        monkeypatch.setattr(meta, file_path_name, os.path.join(tmp_path, filename))
+    # The stand-in server is one host, so the crawl takes the host's delay for each page
+    monkeypatch.setattr(meta, "FRONTIER_WAIT_TIMEOUT", 0.05)
+    monkeypatch.setattr(my_crawler.Crawler.host_frontier, "min_delay", 0.1)
+    monkeypatch.setattr(my_crawler.Crawler, "link_scheme", "http")
+    server, first_page_url = start_stand_in_server(number_of_pages=100, latency=0)
+    try:
+        my_crawler.crawl(first_page_url, 20, True, 4, "POLITE", parser_processes=0)
+    finally:
+        server.shutdown()
+
+    assert my_crawler.Crawler.kept_links_crawled_in_session == 20
+    kept_urls = [url for block_number in range(1, my_crawler.Crawler.total_blocks + 1)
+                 for url in my_blocks.open_block(block_number).get_urls()]
+    assert len(kept_urls) == 20
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from my_parser_pool import ParserPool
+from my_stand_in_server import start_stand_in_server
+from my_text_processor import TextProcessor, StemCache
+import my_crawler
+import metadata as meta
+
+import requests
+
+
+# The pages of a crawl are parsed (and their words are stemmed) in the parser processes, the stem table that the
+# crawler's process saves has to have the words that the parser processes have stemmed
+def test_stem_table_of_parser_pool_crawl(tmp_path, monkeypatch):
+    monkeypatch.setattr(meta, "STEM_TABLE_FILE_PATH", str(tmp_path / meta.STEM_TABLE_FILENAME))
+    monkeypatch.setattr(TextProcessor, "stem_cache", StemCache(TextProcessor.stemmer))
+    server, first_page_url = start_stand_in_server(number_of_pages=20, latency=0)
+    parser_pool = ParserPool(parser_processes=2)
+    try:
+        links = [first_page_url]
+        for _ in range(10):
+            html_text = requests.get(links.pop(0), timeout=10).text
+            title, cleaned_words, list_of_links = parser_pool.parse(html_text, "http")
+            assert len(cleaned_words) > 0
+            links.extend(list_of_links)
+    finally:
+        parser_pool.shutdown()
+        server.shutdown()
+
+    my_crawler.save_stem_cache()
+    stem_table = StemCache(TextProcessor.stemmer)
+    assert stem_table.load(meta.STEM_TABLE_FILE_PATH) > 0
+    assert stem_table.stems["crawls"] == TextProcessor.stemmer.stem("crawls")
+    assert TextProcessor.stem_cache.get_stats()["misses"] > 0